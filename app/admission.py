@@ -0,0 +1,182 @@
+"""
+Admission control. Requests are grouped into reads, writes and reports, and each group may
+only run so many requests at once; the rest wait in a short, bounded queue. Once the
+connection pool falls behind (the average checkout time exceeds
+``admission_max_checkout_ms``), requests that cannot start straight away are turned away
+with a 503 and a Retry-After header instead of queueing, so admitted requests keep a
+bounded latency rather than every request slowing down and timing out together.
+"""
+
+import asyncio
+import json
+
+from app.config import settings
+from app.databaseConnection import checkout_latency, engine
+
+READ = "read"
+WRITE = "write"
+REPORT = "report"
+
+# Never limited: probes must answer under load, streams are long lived and hold no connection,
+# and admins must be able to profile a worker that is overloaded
+EXEMPT_PREFIXES = ("/health", "/stream", "/admin", "/docs", "/redoc", "/openapi.json")
+
+# Reads sent as POST because their keys do not fit in a query string, besides the /get_ batch lookups
+READ_ONLY_POSTS = ("/products/prices_at",)
+
+
+def request_class(method: str, path: str):
+    """Returns the admission class of a request, None if it is not limited.
+
+    Args:
+        method (str): HTTP method
+        path (str): Request path
+
+    Returns:
+        str: READ, WRITE or REPORT
+    """
+    if method == "OPTIONS" or path == "/" or path.startswith(EXEMPT_PREFIXES):
+        return None
+    # Polling a report job for its status or stored result is a cheap read, unlike running a report
+    if path.startswith("/reports/jobs/") and method in ("GET", "HEAD"):
+        return READ
+    if path.startswith("/reports"):
+        return REPORT
+    # Batch lookups are reads sent as POST
+    if method in ("GET", "HEAD") or "/get_" in path or path in READ_ONLY_POSTS:
+        return READ
+    return WRITE
+
+
+class ConcurrencyLimit:
+    """Slots for one class of requests, with a bounded queue in front of them.
+
+    Args:
+        limit (int): Requests running at once
+        queue_limit (int): Requests allowed to wait for a slot
+    """
+
+    def __init__(self, limit: int, queue_limit: int):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self, timeout: float, queue: bool) -> bool:
+        """Takes a slot, waiting up to ``timeout`` seconds in the queue if allowed.
+
+        Args:
+            timeout (float): Longest wait for a slot
+            queue (bool): False to only admit the request if a slot is free right now
+
+        Returns:
+            bool: Whether the request was admitted
+        """
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+        elif queue and self.waiting < self.queue_limit:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            self.rejected += 1
+            return False
+
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def status(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionController:
+    """Concurrency limits per request class and the overload check shared by them."""
+
+    def __init__(self):
+        self.limits = {
+            READ: ConcurrencyLimit(settings.admission_read_limit, settings.admission_queue_limit),
+            WRITE: ConcurrencyLimit(settings.admission_write_limit, settings.admission_queue_limit),
+            REPORT: ConcurrencyLimit(settings.admission_report_limit, settings.admission_queue_limit),
+        }
+
+    @staticmethod
+    def overloaded() -> bool:
+        return checkout_latency.average_seconds * 1000 > settings.admission_max_checkout_ms
+
+    def status(self) -> dict:
+        return {
+            "enabled": settings.admission_control_enabled,
+            "overloaded": self.overloaded(),
+            "checkout_ms": round(checkout_latency.average_seconds * 1000, 3),
+            "pool_checked_out": engine.pool.checkedout(),
+            "classes": {name: limit.status() for name, limit in self.limits.items()},
+        }
+
+
+admission_controller = AdmissionController()
+
+
+async def _reject(send):
+    body = json.dumps({"detail": "The server is overloaded, please retry shortly."}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(settings.admission_retry_after_seconds).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionControl:
+    """ASGI middleware applying the admission controller's limits to every request.
+
+    Args:
+        app (ASGIApp): The wrapped application
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.admission_control_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        name = request_class(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        limit = admission_controller.limits[name]
+        admitted = await limit.acquire(settings.admission_queue_timeout_ms / 1000,
+                                       queue=not admission_controller.overloaded())
+        if not admitted:
+            await _reject(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
@@ -0,0 +1,258 @@
+"""
+Online schema and data changes for Alembic revisions.
+
+Altering a column in place, or rewriting it with a single UPDATE, locks the whole table for
+as long as the rewrite takes. The helpers here split such a change into steps that each hold
+their locks briefly (expand/contract):
+
+1. Expand: add the new column as nullable, which does not rewrite the table, and keep it in
+   step with the old one for rows the running application writes (add_sync_trigger).
+2. Backfill the existing rows in keyset-ordered batches, each committed on its own, pausing
+   between batches and recording a checkpoint so an interrupted run resumes (backfill).
+3. Tighten without blocking writes: set_not_null, add_foreign_key and
+   create_index_concurrently validate or build while the table stays writable.
+4. Contract, in a later revision once no deployed code reads the old column: drop the sync
+   trigger and the old column, and rename the new one.
+
+A revision changing products.barcode this way would do:
+
+    def upgrade() -> None:
+        op.add_column('products', sa.Column('barcode_new', sa.String(length=50), nullable=True))
+        add_sync_trigger('products', 'barcode_new', 'NEW.barcode')
+        with op.get_context().autocommit_block():
+            backfill(op.get_bind(), 'products_barcode_new', 'products', 'barcode_new = barcode',
+                     where='barcode_new IS DISTINCT FROM barcode')
+            set_not_null('products', 'barcode_new')
+
+backfill, set_not_null, add_foreign_key and create_index_concurrently have to run inside
+``op.get_context().autocommit_block()``, so every batch or step commits on its own.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from alembic import op
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+# lock_not_available (lock_timeout expired) and deadlock_detected, both worth retrying
+RETRYABLE_ERRORS = ("55P03", "40P01")
+
+BATCH_STATEMENT = """
+WITH batch AS (
+    SELECT {key} AS backfill_key FROM {table}
+    WHERE {key} > :last_key AND {key} <= :end_key
+    ORDER BY {key} LIMIT :batch_size
+), updated AS (
+    {statement}
+), checkpoint AS (
+    UPDATE backfill_checkpoints
+    SET last_key = (SELECT max(backfill_key) FROM batch),
+        rows_updated = rows_updated + (SELECT count(*) FROM updated),
+        updated_at = now()
+    WHERE name = :name AND EXISTS (SELECT 1 FROM batch)
+)
+SELECT (SELECT max(backfill_key) FROM batch) AS last_key, (SELECT count(*) FROM updated) AS updated
+"""
+
+
+def backfill(connection: Connection, name: str, table: str, set_clause: Optional[str] = None,
+             where: Optional[str] = None, key: str = "id", batch_size: int = 1000, pause_seconds: float = 0.05,
+             lock_timeout_ms: int = 2000, max_retries: int = 10, log_every_seconds: float = 10.0,
+             parameters: Optional[dict] = None, statement: Optional[str] = None) -> int:
+    """Updates every row of a table in batches of consecutive keys, each in its own transaction.
+
+    The batch update and its checkpoint are a single statement, so a run stopped at any point
+    resumes after the last committed batch when the migration is run again. Only rows that
+    existed when the run started are visited; rows written since are the application's (or a
+    sync trigger's) responsibility. A batch that cannot get its row locks within
+    ``lock_timeout_ms`` is retried after a back-off instead of queueing behind other writers.
+
+    Args:
+        connection (Connection): Connection in autocommit mode, e.g. op.get_bind() inside
+            op.get_context().autocommit_block()
+        name (str): Name of the checkpoint, unique per backfill
+        table (str): Table to update
+        set_clause (str, optional): SET clause of the UPDATE, e.g. "barcode_new = barcode"
+        where (str, optional): Only update the rows of a batch matching this condition. Defaults to None.
+        key (str, optional): Unique integer column the batches are ordered by. Defaults to "id".
+        batch_size (int, optional): Keys per batch. Defaults to 1000.
+        pause_seconds (float, optional): Pause after each batch, leaving room for other writers
+            and for replicas to catch up. Defaults to 0.05.
+        lock_timeout_ms (int, optional): Longest wait for a row lock. Defaults to 2000.
+        max_retries (int, optional): Retries of one batch before giving up. Defaults to 10.
+        log_every_seconds (float, optional): Interval of progress messages. Defaults to 10.0.
+        parameters (dict, optional): Bound parameters used in set_clause or where. Defaults to None.
+        statement (str, optional): Statement run for each batch instead of the UPDATE, e.g. an
+            ``INSERT ... SELECT`` copying the batch's rows elsewhere. It reads the keys of the batch
+            from ``batch.backfill_key`` and returns one row per row written. Defaults to None.
+
+    Raises:
+        RuntimeError: When the connection is not in autocommit mode
+        DBAPIError: When a batch still fails after max_retries retries
+
+    Returns:
+        int: Number of rows written by this run
+    """
+    if (set_clause is None) == (statement is None):
+        raise ValueError("backfill() needs either set_clause or statement")
+    if connection.get_execution_options().get("isolation_level") != "AUTOCOMMIT":
+        raise RuntimeError("backfill() must run in autocommit mode, inside op.get_context().autocommit_block()")
+
+    connection.execute(text("INSERT INTO backfill_checkpoints (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"),
+                       {"name": name})
+    checkpoint = connection.execute(text("SELECT last_key, finished_at FROM backfill_checkpoints WHERE name = :name"),
+                                    {"name": name}).one()
+    if checkpoint.finished_at is not None:
+        logger.info("Backfill %s already finished at %s", name, checkpoint.finished_at)
+        return 0
+
+    bounds = connection.execute(text(f"SELECT min({key}), max({key}) FROM {table}")).one()
+    if bounds[0] is None:
+        last_key, end_key = 0, 0
+    else:
+        last_key = checkpoint.last_key if checkpoint.last_key is not None else bounds[0] - 1
+        end_key = bounds[1]
+    first_key = last_key
+
+    if statement is None:
+        statement = (f"UPDATE {table} SET {set_clause} FROM batch WHERE {table}.{key} = batch.backfill_key"
+                     f"{f' AND ({where})' if where else ''} RETURNING 1")
+    statement = text(BATCH_STATEMENT.format(table=table, key=key, statement=statement))
+    rows_updated = 0
+    batches = 0
+    started = last_logged = time.monotonic()
+
+    with lock_timeout(connection, lock_timeout_ms):
+        while last_key < end_key:
+            batch_parameters = {**(parameters or {}), "name": name, "last_key": last_key,
+                                "end_key": end_key, "batch_size": batch_size}
+            result = _execute_with_retries(connection, statement, batch_parameters, max_retries)
+            if result.last_key is None:
+                break
+
+            last_key = result.last_key
+            rows_updated += result.updated
+            batches += 1
+
+            if time.monotonic() - last_logged >= log_every_seconds:
+                last_logged = time.monotonic()
+                done = (last_key - first_key) / (end_key - first_key)
+                logger.info("Backfill %s: %.1f%% (key %s of %s), %s rows updated, %.0f rows/s", name,
+                            done * 100, last_key, end_key, rows_updated, rows_updated / (last_logged - started))
+
+            if pause_seconds:
+                time.sleep(pause_seconds)
+
+    connection.execute(text("UPDATE backfill_checkpoints SET finished_at = now(), updated_at = now() WHERE name = :name"),
+                       {"name": name})
+    logger.info("Backfill %s finished: %s rows updated in %s batches, %.1fs", name, rows_updated, batches,
+                time.monotonic() - started)
+    return rows_updated
+
+
+def _execute_with_retries(connection: Connection, statement, parameters: dict, max_retries: int):
+    for attempt in range(max_retries + 1):
+        try:
+            return connection.execute(statement, parameters).one()
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) not in RETRYABLE_ERRORS or attempt == max_retries:
+                raise
+            delay = min(0.1 * 2 ** attempt, 5.0)
+            logger.warning("Backfill batch after key %s could not lock its rows, retrying in %.1fs",
+                           parameters["last_key"], delay)
+            time.sleep(delay)
+
+
+@contextmanager
+def lock_timeout(connection: Connection, milliseconds: int):
+    """Makes statements on the connection give up waiting for a lock after ``milliseconds``.
+
+    A DDL statement waiting for its lock blocks every query queued behind it, so it is better
+    for a migration step to fail fast and be retried than to stall the application.
+    """
+    previous = connection.execute(text("SHOW lock_timeout")).scalar()
+    connection.execute(text(f"SET lock_timeout = {int(milliseconds)}"))
+    try:
+        yield
+    finally:
+        connection.execute(text("SELECT set_config('lock_timeout', :previous, false)"), {"previous": previous})
+
+
+def add_sync_trigger(table: str, column: str, expression: str):
+    """Keeps a new column filled in for rows inserted or updated while a migration is under way.
+
+    Args:
+        table (str): Table of the column
+        column (str): Column to set
+        expression (str): Its value, in terms of the written row, e.g. "NEW.barcode"
+    """
+    function = f"{table}_{column}_sync"
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+        BEGIN
+            NEW.{column} := {expression};
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute(f"DROP TRIGGER IF EXISTS {function} ON {table}")
+    op.execute(f"CREATE TRIGGER {function} BEFORE INSERT OR UPDATE ON {table} "
+               f"FOR EACH ROW EXECUTE FUNCTION {function}()")
+
+
+def drop_sync_trigger(table: str, column: str):
+    """Removes the trigger added by add_sync_trigger, once the application writes the column itself."""
+    function = f"{table}_{column}_sync"
+    op.execute(f"DROP TRIGGER IF EXISTS {function} ON {table}")
+    op.execute(f"DROP FUNCTION IF EXISTS {function}()")
+
+
+def set_not_null(table: str, column: str, lock_timeout_ms: int = 2000):
+    """Makes a column NOT NULL without holding an exclusive lock while every row is checked.
+
+    A NOT VALID check constraint is added first (brief lock), then validated, which only blocks
+    other schema changes. SET NOT NULL then uses the validated constraint instead of scanning.
+    Must run inside op.get_context().autocommit_block().
+    """
+    constraint = f"{table}_{column}_not_null"
+    connection = op.get_bind()
+    with lock_timeout(connection, lock_timeout_ms):
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}")
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {constraint} CHECK ({column} IS NOT NULL) NOT VALID")
+        op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {constraint}")
+
+
+def add_foreign_key(name: str, source_table: str, referent_table: str, local_cols: List[str], remote_cols: List[str],
+                    **kwargs):
+    """Adds a foreign key as NOT VALID and then validates it, so existing rows are checked
+    without blocking writes to either table. Must run inside op.get_context().autocommit_block(),
+    otherwise the lock taken to add the constraint is held until validation finishes.
+    """
+    op.create_foreign_key(name, source_table, referent_table, local_cols, remote_cols, postgresql_not_valid=True,
+                          **kwargs)
+    op.execute(f"ALTER TABLE {source_table} VALIDATE CONSTRAINT {name}")
+
+
+def create_index_concurrently(name: str, table: str, columns: List[str], **kwargs):
+    """Builds an index without blocking writes to the table.
+
+    A concurrent build that failed leaves an invalid index behind; it is dropped and rebuilt.
+    Must run inside op.get_context().autocommit_block().
+    """
+    connection = op.get_bind()
+    invalid = connection.execute(text("""
+        SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+    """), {"name": name}).first()
+    if invalid:
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+    op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kwargs)
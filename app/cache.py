@@ -0,0 +1,142 @@
+"""
+In-process cache of the small reference tables (categories, financial quarters and
+active discounts) that almost every request looks up.
+"""
+
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.config import settings
+from app.databaseConnection import SessionLocal
+from app.utils import row_to_dict
+
+
+class ReferenceCache:
+    """Holds categories, financial quarters and active discounts as plain dictionaries.
+
+    Each table is reloaded as a whole with a single query once it is older than
+    ``ttl_seconds``, so changes made by other workers show up within the TTL while
+    writes made by this worker are applied straight away through the ``put_*`` methods.
+    Stale tables are always reloaded from the primary, a lagging replica could otherwise
+    put rows older than this worker's own writes back into the cache.
+
+    Args:
+        ttl_seconds (int): Seconds before a cached table is considered stale
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.categories_by_id = {}
+        self.categories_by_code = {}
+        self.quarters_by_id = {}
+        self.active_discounts = {}
+        # Bumped whenever the quarters change, lets derived structures know when to rebuild
+        self.quarters_version = 0
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def is_fresh(self, table: str) -> bool:
+        loaded_at = self._loaded_at.get(table)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds
+
+    def load(self, db: Session):
+        """Loads every reference table, used when warming up a worker."""
+        self.load_categories(db)
+        self.load_quarters(db)
+        self.load_discounts(db)
+
+    def load_categories(self, db: Session):
+        categories = [row_to_dict(category) for category in db.query(models.ProductCategory).all()]
+
+        with self._lock:
+            self.categories_by_id = {category["id"]: category for category in categories}
+            self.categories_by_code = {category["code"]: category for category in categories}
+            self._loaded_at["categories"] = time.monotonic()
+
+    def load_quarters(self, db: Session):
+        quarters = [row_to_dict(quarter) for quarter in db.query(models.FinancialQuarters).all()]
+
+        with self._lock:
+            self.quarters_by_id = {quarter["id"]: quarter for quarter in quarters}
+            self.quarters_version += 1
+            self._loaded_at["quarters"] = time.monotonic()
+
+    def load_discounts(self, db: Session):
+        today = date.today()
+        discounts = db.query(models.ProductDiscounts).filter(
+            models.ProductDiscounts.is_active.is_(True),
+            models.ProductDiscounts.start_date <= today,
+            or_(models.ProductDiscounts.end_date.is_(None), models.ProductDiscounts.end_date >= today)
+        ).all()
+
+        active_discounts = {}
+        for discount in discounts:
+            active_discounts.setdefault(discount.product_id, []).append(row_to_dict(discount))
+
+        with self._lock:
+            self.active_discounts = active_discounts
+            self._loaded_at["discounts"] = time.monotonic()
+
+    def _reload(self, loader):
+        with SessionLocal() as db:
+            loader(db)
+
+    def categories(self) -> dict:
+        """Returns all categories keyed by id, reloading them from the primary first if stale."""
+        if not self.is_fresh("categories"):
+            self._reload(self.load_categories)
+        return self.categories_by_id
+
+    def quarters(self) -> dict:
+        """Returns all financial quarters keyed by id, reloading them from the primary first if stale."""
+        if not self.is_fresh("quarters"):
+            self._reload(self.load_quarters)
+        return self.quarters_by_id
+
+    def discounts(self) -> dict:
+        """Returns the currently active discounts grouped by product id, reloading them from the primary first if stale."""
+        if not self.is_fresh("discounts"):
+            self._reload(self.load_discounts)
+        return self.active_discounts
+
+    def get_category(self, category_id: int):
+        return self.categories_by_id.get(category_id) if self.is_fresh("categories") else None
+
+    def get_category_by_code(self, code: str):
+        return self.categories_by_code.get(code) if self.is_fresh("categories") else None
+
+    def get_quarter(self, quarter_id: int):
+        return self.quarters_by_id.get(quarter_id) if self.is_fresh("quarters") else None
+
+    def put_category(self, category: models.ProductCategory):
+        row = row_to_dict(category)
+
+        with self._lock:
+            previous = self.categories_by_id.get(row["id"])
+            if previous is not None:
+                self.categories_by_code.pop(previous["code"], None)
+            self.categories_by_id[row["id"]] = row
+            self.categories_by_code[row["code"]] = row
+
+    def put_quarter(self, quarter: models.FinancialQuarters):
+        row = row_to_dict(quarter)
+
+        with self._lock:
+            self.quarters_by_id[row["id"]] = row
+            self.quarters_version += 1
+
+    def invalidate(self, table: str = None):
+        """Marks one table (or all of them) stale so the next read reloads it."""
+        with self._lock:
+            if table is None:
+                self._loaded_at.clear()
+            else:
+                self._loaded_at.pop(table, None)
+
+
+reference_cache = ReferenceCache(settings.reference_cache_ttl_seconds)
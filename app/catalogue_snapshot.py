@@ -0,0 +1,458 @@
+"""
+Read-only catalogue snapshot shared by all workers through a memory-mapped file.
+
+The snapshot holds products (with their category and discounts) in a compact columnar
+layout: fixed width columns such as ids, prices and stock as packed arrays, and strings
+(codes, names, barcodes) as one UTF-8 blob per column plus an array of offsets into it.
+Every worker maps the file read-only, so barcode and price lookups are memory reads and
+the operating system keeps one copy in RAM however many workers there are.
+
+A rebuild writes a new file next to the current one and renames it over it, so a reader
+sees either the old or the new snapshot, never a partial one. Readers check for a new
+version at most once a second; the old mapping is released once nothing uses it. The file
+uses the native byte order and is only meant to be shared by workers on the same host.
+"""
+
+import array
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.change_stream import change_broker, change_listener
+from app.config import settings
+from app.databaseConnection import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"INVCAT01"
+# Magic, version, time the data was read (unix seconds), product, category and discount counts
+HEADER = struct.Struct("=8sQdIII")
+# Offset and length in bytes of one column
+SECTION = struct.Struct("=QQ")
+
+# products.selling_price is DECIMAL(19, 4) and product_discounts.discount_value DECIMAL(10, 2),
+# both are stored as scaled integers
+PRICE_SCALE = 10000
+DISCOUNT_SCALE = 100
+
+DISCOUNT_TYPES = ("Percentage", "Fixed Amount")
+# Stored as the end date of discounts that do not end
+NO_END_DATE = 0
+
+# Only one worker rebuilds the snapshot at a time
+SNAPSHOT_LOCK_KEY = 5_382_217
+
+# Columns in file order with their array type code, "B" columns are UTF-8 string blobs
+COLUMNS = (
+    ("product_ids", "i"),
+    ("product_category_ids", "i"),
+    ("product_prices", "q"),
+    ("product_stock", "i"),
+    ("product_reorder_levels", "i"),
+    ("product_codes_offsets", "I"),
+    ("product_codes", "B"),
+    ("product_names_offsets", "I"),
+    ("product_names", "B"),
+    ("product_barcodes_offsets", "I"),
+    ("product_barcodes", "B"),
+    # Product positions ordered by barcode, for binary search
+    ("barcode_order", "i"),
+    ("category_ids", "i"),
+    ("category_codes_offsets", "I"),
+    ("category_codes", "B"),
+    ("discount_product_ids", "i"),
+    ("discount_types", "b"),
+    ("discount_values", "q"),
+    ("discount_starts", "i"),
+    ("discount_ends", "i"),
+)
+
+
+def discounted_price(price: Decimal, discount_type: Optional[str], discount_value: Optional[Decimal]) -> Decimal:
+    """Applies a percentage or fixed amount discount to a price, never going below zero."""
+    if discount_type is None:
+        return price
+    if discount_type == "Percentage":
+        return (price * (100 - discount_value) / 100).quantize(Decimal("0.0001"))
+    return max(price - discount_value, Decimal(0))
+
+
+def _strings(values: list):
+    offsets = array.array("I", [0])
+    blob = bytearray()
+    for value in values:
+        blob += value
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def build_snapshot(path: str) -> Optional[int]:
+    """Builds a new snapshot from the database and atomically replaces the file at ``path``.
+
+    Args:
+        path (str): Location of the snapshot file
+
+    Returns:
+        int: The new snapshot's version, None if another worker is building one right now
+    """
+    started = time.perf_counter()
+    taken_at = time.time()
+
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ") as connection:
+        if not connection.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SNAPSHOT_LOCK_KEY}).scalar():
+            return None
+
+        products = connection.execute(text(
+            "SELECT id, category_id, selling_price, stock_count, reorder_level, product_code, product_name, barcode "
+            "FROM products ORDER BY id"
+        )).all()
+        categories = connection.execute(text("SELECT id, code FROM product_category ORDER BY id")).all()
+        discounts = connection.execute(text(
+            "SELECT product_id, discount_type, discount_value, start_date, end_date "
+            "FROM product_discounts WHERE is_active ORDER BY product_id, id"
+        )).all()
+        connection.rollback()
+
+    barcodes = [product.barcode.encode() for product in products]
+    columns = {
+        "product_ids": array.array("i", (product.id for product in products)),
+        "product_category_ids": array.array("i", (product.category_id for product in products)),
+        "product_prices": array.array("q", (int(product.selling_price * PRICE_SCALE) for product in products)),
+        "product_stock": array.array("i", (product.stock_count for product in products)),
+        "product_reorder_levels": array.array("i", (product.reorder_level for product in products)),
+        "barcode_order": array.array("i", sorted(range(len(products)), key=barcodes.__getitem__)),
+        "category_ids": array.array("i", (category.id for category in categories)),
+        "discount_product_ids": array.array("i", (discount.product_id for discount in discounts)),
+        "discount_types": array.array("b", (DISCOUNT_TYPES.index(discount.discount_type) for discount in discounts)),
+        "discount_values": array.array("q", (int(discount.discount_value * DISCOUNT_SCALE) for discount in discounts)),
+        "discount_starts": array.array("i", (discount.start_date.toordinal() for discount in discounts)),
+        "discount_ends": array.array("i", (discount.end_date.toordinal() if discount.end_date else NO_END_DATE
+                                           for discount in discounts)),
+    }
+    columns["product_codes_offsets"], columns["product_codes"] = _strings(
+        [product.product_code.encode() for product in products])
+    columns["product_names_offsets"], columns["product_names"] = _strings(
+        [product.product_name.encode() for product in products])
+    columns["product_barcodes_offsets"], columns["product_barcodes"] = _strings(barcodes)
+    columns["category_codes_offsets"], columns["category_codes"] = _strings(
+        [category.code.encode() for category in categories])
+
+    version = time.time_ns()
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary_path, "wb") as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, version, taken_at, len(products), len(categories), len(discounts)))
+        snapshot_file.write(bytes(SECTION.size * len(COLUMNS)))
+
+        sections = []
+        for name, _ in COLUMNS:
+            # Columns start on 8 byte boundaries
+            snapshot_file.write(bytes(-snapshot_file.tell() % 8))
+            data = columns[name]
+            data = data.tobytes() if isinstance(data, array.array) else data
+            sections.append((snapshot_file.tell(), len(data)))
+            snapshot_file.write(data)
+
+        snapshot_file.seek(HEADER.size)
+        for section in sections:
+            snapshot_file.write(SECTION.pack(*section))
+
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+
+    os.replace(temporary_path, path)
+
+    logger.info("Built catalogue snapshot %s with %s products (%s bytes) in %.3fs", version, len(products),
+                os.path.getsize(path), time.perf_counter() - started)
+    return version
+
+
+class CatalogueSnapshot:
+    """One mapped snapshot file. Columns are memoryviews straight into the mapping.
+
+    Args:
+        path (str): Location of the snapshot file
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self.version, self.taken_at, self.product_count,
+         self.category_count, self.discount_count) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a catalogue snapshot")
+
+        view = memoryview(self._map)
+        self.columns = {}
+        for position, (name, typecode) in enumerate(COLUMNS):
+            offset, length = SECTION.unpack_from(self._map, HEADER.size + position * SECTION.size)
+            self.columns[name] = view[offset:offset + length].cast(typecode)
+
+    def _bytes(self, column: str, index: int) -> bytes:
+        offsets = self.columns[column + "_offsets"]
+        return bytes(self.columns[column][offsets[index]:offsets[index + 1]])
+
+    def find_product(self, product_id: int) -> Optional[int]:
+        """Returns the position of a product in the snapshot, None if it is not in it."""
+        ids = self.columns["product_ids"]
+        index = bisect.bisect_left(ids, product_id)
+        return index if index < len(ids) and ids[index] == product_id else None
+
+    def find_barcode(self, barcode: str) -> Optional[int]:
+        """Returns the position of the product with this barcode, None if it is not in the snapshot."""
+        target = barcode.encode()
+        order = self.columns["barcode_order"]
+        low, high = 0, len(order)
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._bytes("product_barcodes", order[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(order) and self._bytes("product_barcodes", order[low]) == target:
+            return order[low]
+        return None
+
+    def _category_code(self, category_id: int) -> Optional[str]:
+        ids = self.columns["category_ids"]
+        index = bisect.bisect_left(ids, category_id)
+        if index < len(ids) and ids[index] == category_id:
+            return self._bytes("category_codes", index).decode()
+        return None
+
+    def _best_discount(self, product_id: int, price: Decimal, today: int):
+        # The running discount taking the most off the price
+        product_ids = self.columns["discount_product_ids"]
+        index = bisect.bisect_left(product_ids, product_id)
+        best = (None, None, price)
+
+        while index < len(product_ids) and product_ids[index] == product_id:
+            end = self.columns["discount_ends"][index]
+            if self.columns["discount_starts"][index] <= today and (end == NO_END_DATE or end >= today):
+                discount_type = DISCOUNT_TYPES[self.columns["discount_types"][index]]
+                value = Decimal(self.columns["discount_values"][index]) / DISCOUNT_SCALE
+                price_after = discounted_price(price, discount_type, value)
+                if price_after < best[2]:
+                    best = (discount_type, value, price_after)
+            index += 1
+
+        return best
+
+    def product(self, index: int) -> dict:
+        """Returns the product at a position as a catalogue entry."""
+        product_id = self.columns["product_ids"][index]
+        category_id = self.columns["product_category_ids"][index]
+        price = Decimal(self.columns["product_prices"][index]) / PRICE_SCALE
+        discount_type, discount_value, price_after = self._best_discount(product_id, price, date.today().toordinal())
+
+        return {
+            "product_id": product_id,
+            "product_code": self._bytes("product_codes", index).decode(),
+            "product_name": self._bytes("product_names", index).decode(),
+            "barcode": self._bytes("product_barcodes", index).decode(),
+            "category_id": category_id,
+            "category_code": self._category_code(category_id),
+            "selling_price": price,
+            "stock_count": self.columns["product_stock"][index],
+            "reorder_level": self.columns["product_reorder_levels"][index],
+            "discount_type": discount_type,
+            "discount_value": discount_value,
+            "discounted_price": price_after,
+            "source": "snapshot",
+            "snapshot_version": self.version,
+        }
+
+
+class SnapshotHolder:
+    """Keeps the current snapshot mapped, switching to a newer file when one appears.
+
+    Args:
+        path (str): Location of the snapshot file, None when snapshots are disabled
+    """
+
+    CHECK_SECONDS = 1
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._snapshot = None
+        self._identity = None
+        self._checked_at = None
+
+    def current(self, recheck: bool = False) -> Optional[CatalogueSnapshot]:
+        """Returns the latest snapshot, None if disabled or not built yet.
+
+        Args:
+            recheck (bool): Look for a newer file even if the last check was less than a second ago
+        """
+        if self.path is None:
+            return None
+
+        now = time.monotonic()
+        if not recheck and self._checked_at is not None and now - self._checked_at < self.CHECK_SECONDS:
+            return self._snapshot
+        self._checked_at = now
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._snapshot = self._identity = None
+            return None
+
+        identity = (stat.st_ino, stat.st_mtime_ns)
+        if identity != self._identity:
+            try:
+                self._snapshot = CatalogueSnapshot(self.path)
+                self._identity = identity
+            except (OSError, ValueError) as e:
+                logger.warning("Could not map catalogue snapshot %s: %s", self.path, e)
+
+        return self._snapshot
+
+
+catalogue_snapshot = SnapshotHolder(settings.catalogue_snapshot_path)
+
+
+def lookup_in_database(product_id: Optional[int] = None, barcode: Optional[str] = None) -> Optional[dict]:
+    """Builds the same catalogue entry as the snapshot straight from the database, used
+    when snapshots are disabled or the product is newer than the snapshot.
+
+    Args:
+        product_id (int, optional): Product to look up
+        barcode (str, optional): Barcode to look up, when no product_id is given
+
+    Returns:
+        dict: The catalogue entry, None if no product matches
+    """
+    with SessionLocal() as db:
+        product = db.execute(text(
+            "SELECT p.id, p.product_code, p.product_name, p.barcode, p.category_id, c.code AS category_code, "
+            "p.selling_price, p.stock_count, p.reorder_level "
+            "FROM products p JOIN product_category c ON c.id = p.category_id "
+            + ("WHERE p.id = :key" if product_id is not None else "WHERE p.barcode = :key")
+        ), {"key": product_id if product_id is not None else barcode}).first()
+
+        if product is None:
+            return None
+
+        discounts = db.execute(text(
+            "SELECT discount_type, discount_value FROM product_discounts "
+            "WHERE product_id = :product_id AND is_active AND start_date <= CURRENT_DATE "
+            "AND (end_date IS NULL OR end_date >= CURRENT_DATE)"
+        ), {"product_id": product.id}).all()
+
+    best = (None, None, product.selling_price)
+    for discount in discounts:
+        price_after = discounted_price(product.selling_price, discount.discount_type, discount.discount_value)
+        if price_after < best[2]:
+            best = (discount.discount_type, discount.discount_value, price_after)
+
+    return {
+        "product_id": product.id,
+        "product_code": product.product_code,
+        "product_name": product.product_name,
+        "barcode": product.barcode,
+        "category_id": product.category_id,
+        "category_code": product.category_code,
+        "selling_price": product.selling_price,
+        "stock_count": product.stock_count,
+        "reorder_level": product.reorder_level,
+        "discount_type": best[0],
+        "discount_value": best[1],
+        "discounted_price": best[2],
+        "source": "database",
+        "snapshot_version": None,
+    }
+
+
+def lookup(product_id: Optional[int] = None, barcode: Optional[str] = None) -> Optional[dict]:
+    """Looks a product up in the snapshot, falling back to the database if it is not there.
+
+    Args:
+        product_id (int, optional): Product to look up
+        barcode (str, optional): Barcode to look up, when no product_id is given
+
+    Returns:
+        dict: The catalogue entry, None if no product matches
+    """
+    snapshot = catalogue_snapshot.current()
+
+    if snapshot is not None:
+        index = snapshot.find_product(product_id) if product_id is not None else snapshot.find_barcode(barcode)
+        if index is not None:
+            return snapshot.product(index)
+
+    return lookup_in_database(product_id, barcode)
+
+
+def changes_prices(change: dict, snapshot: Optional[CatalogueSnapshot]) -> bool:
+    """Whether a change notification affects what a lookup from the snapshot would answer
+    beyond stock: a price, discount or catalogue change, such as a reassigned barcode or a
+    renamed product. Stock is sent with every product notification, so an update's other
+    fields are compared with the ones in the snapshot."""
+    if change.get("table") != "products" or change.get("op") != "update" or snapshot is None:
+        return True
+
+    index = snapshot.find_product(change.get("id"))
+    if index is None or change.get("selling_price") is None:
+        return True
+    if snapshot.columns["product_prices"][index] != int(Decimal(str(change["selling_price"])) * PRICE_SCALE):
+        return True
+    if "category_id" in change and change["category_id"] != snapshot.columns["product_category_ids"][index]:
+        return True
+
+    # Notifications from before these fields were sent carry only stock and price
+    return any(field in change and change[field] != snapshot._bytes(column, index).decode()
+               for field, column in (("barcode", "product_barcodes"), ("product_code", "product_codes"),
+                                     ("product_name", "product_names")))
+
+
+async def maintain_snapshot():
+    """Keeps the snapshot file up to date while the application runs: builds it at start-up
+    unless a recent one exists, then rebuilds it after price, discount and catalogue changes
+    such as a reassigned barcode (gathered for ``catalogue_snapshot_rebuild_delay_ms``) and
+    whenever it gets older than ``catalogue_snapshot_max_age_seconds``, which also picks up
+    stock changes and changes no trigger reports, such as renamed categories. Rebuilding on
+    every stock change would rebuild the whole catalogue continuously while goods are being sold."""
+    path = settings.catalogue_snapshot_path
+    max_age = settings.catalogue_snapshot_max_age_seconds
+
+    change_listener.start(asyncio.get_running_loop())
+    subscriber = change_broker.subscribe()
+
+    try:
+        # Time of the earliest price change no mapped snapshot covers yet
+        changed_at = None
+        while True:
+            snapshot = catalogue_snapshot.current(recheck=True)
+            # Every worker hears about every change, the first to rebuild covers it for the others
+            if changed_at is not None and snapshot is not None and snapshot.taken_at >= changed_at:
+                changed_at = None
+
+            if changed_at is not None or snapshot is None or time.time() - snapshot.taken_at >= max_age:
+                try:
+                    await asyncio.to_thread(build_snapshot, path)
+                except Exception as e:
+                    logger.warning("Could not build catalogue snapshot: %s", e)
+
+            delay = settings.catalogue_snapshot_rebuild_delay_ms / 1000
+            # A change still pending (another worker was building, or the build failed) is retried
+            # after the rebuild delay instead of waiting for the next change
+            batch = await subscriber.next_batch(delay, max_age if changed_at is None else delay)
+            if changed_at is None:
+                snapshot = catalogue_snapshot.current(recheck=True)
+                if any(changes_prices(change, snapshot) for change in batch):
+                    changed_at = time.time()
+    finally:
+        change_broker.unsubscribe(subscriber)
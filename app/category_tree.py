@@ -0,0 +1,128 @@
+"""
+Hierarchy of product categories.
+
+Every category stores its materialized path, the ids from its root category down to itself,
+each followed by a dot: a category 9 under 4 under 1 has the path "1.4.9.". The subtree of a
+category is then every category whose path starts with its path, one range of the
+text_pattern_ops index on path rather than a recursive query, and products of a subtree are
+found by joining that range to ix_products_category.
+
+Paths are written by add_category and update_category. Moving a category rewrites the path of
+its whole subtree with a single UPDATE. Moves take a transaction level advisory lock, so two
+moves running at once cannot make categories each other's ancestors, and a category added
+under a parent being moved cannot keep the parent's old path.
+"""
+
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import app.models as models
+
+# Advisory lock key serialising changes to the shape of the tree
+TREE_LOCK_KEY = 4_603_001
+
+# Matches the categories of a subtree through ix_product_category_path, given the subtree's
+# path followed by % as :subtree_path
+SUBTREE_IDS = "SELECT id FROM product_category WHERE path LIKE :subtree_path"
+
+
+def category_path(db: Session, category_id: int) -> Optional[str]:
+    """Returns the path of a category, None if it does not exist. Read from the database rather
+    than the reference cache, whose paths can be outdated by a move made by another worker."""
+    return db.execute(text("SELECT path FROM product_category WHERE id = :id"), {"id": category_id}).scalar()
+
+
+def subtree_pattern(path: str) -> str:
+    """Returns the LIKE pattern matching a category and all of its subcategories. Paths only
+    hold digits and dots, so nothing needs escaping."""
+    return f"{path}%"
+
+
+def subtree_filter(db: Session, column, category_id: int):
+    """Returns an ORM condition keeping the rows whose category ``column`` is in the subtree of
+    a category (the category itself included), or None if the category does not exist.
+
+    Args:
+        db (Session): Database session the path is read with
+        column (Column): The category id column to filter, e.g. models.Products.category_id
+        category_id (int): The root of the subtree
+
+    Returns:
+        The condition, for Query.filter
+    """
+    path = category_path(db, category_id)
+    if path is None:
+        return None
+
+    subtree_ids = db.query(models.ProductCategory.id).filter(models.ProductCategory.path.like(subtree_pattern(path)))
+    return column.in_(subtree_ids.scalar_subquery())
+
+
+def new_category_path(db: Session, parent_id: Optional[int]) -> tuple:
+    """Reserves the id of a new category and computes its path, so it is inserted complete.
+    Takes the tree lock when the category has a parent. Does not commit.
+
+    Args:
+        db (Session): Database session
+        parent_id (int, optional): The parent category, None for a root category
+
+    Raises:
+        LookupError: When the parent category does not exist
+
+    Returns:
+        tuple: The new category's id and path
+    """
+    parent_path = ""
+    if parent_id is not None:
+        # Held until the insert commits, so a move of an ancestor waits for the new category
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": TREE_LOCK_KEY})
+        parent_path = category_path(db, parent_id)
+        if parent_path is None:
+            raise LookupError(f"Parent category with ID {parent_id} not found.")
+
+    category_id = db.execute(text("SELECT nextval(pg_get_serial_sequence('product_category', 'id'))")).scalar()
+    return category_id, f"{parent_path}{category_id}."
+
+
+def move_category(db: Session, category_id: int, parent_id: Optional[int]) -> int:
+    """Moves a category, with all of its subcategories, under another parent. Does not commit.
+
+    Args:
+        db (Session): Database session
+        category_id (int): The category to move
+        parent_id (int, optional): Its new parent, None to make it a root category
+
+    Raises:
+        LookupError: When the category or the new parent does not exist
+        ValueError: When the new parent is the category itself or one of its subcategories
+
+    Returns:
+        int: Number of categories whose path changed, the moved one included
+    """
+    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": TREE_LOCK_KEY})
+
+    old_path = category_path(db, category_id)
+    if old_path is None:
+        raise LookupError(f"Category with ID {category_id} not found.")
+
+    parent_path = ""
+    if parent_id is not None:
+        parent_path = category_path(db, parent_id)
+        if parent_path is None:
+            raise LookupError(f"Parent category with ID {parent_id} not found.")
+        if parent_path.startswith(old_path):
+            raise ValueError(f"Category {category_id} cannot be moved under itself or one of its subcategories.")
+
+    new_path = f"{parent_path}{category_id}."
+    if new_path == old_path:
+        return 0
+
+    result = db.execute(text(
+        "UPDATE product_category SET path = :new_path || substr(path, :old_length + 1), "
+        "parent_id = CASE WHEN id = :id THEN CAST(:parent_id AS integer) ELSE parent_id END "
+        "WHERE path LIKE :subtree_path"
+    ), {"id": category_id, "parent_id": parent_id, "new_path": new_path, "old_length": len(old_path),
+        "subtree_path": subtree_pattern(old_path)})
+    return result.rowcount
@@ -0,0 +1,176 @@
+"""
+Fan-out of stock, price and discount changes to streaming subscribers.
+
+Each worker holds a single LISTEN connection on the ``inventory_changes`` channel (fed by the
+triggers on ``products`` and ``product_discounts``) and hands every notification to the
+subscribers interested in it. Subscribers coalesce bursts: if a product changes several
+times before a subscriber's next delivery, only its latest state is sent.
+"""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+
+from app.databaseConnection import engine
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "inventory_changes"
+
+
+class Subscriber:
+    """One streaming client, optionally only interested in a single category.
+
+    Args:
+        category_id (int): Category to receive changes for, None for every change
+    """
+
+    def __init__(self, category_id=None):
+        self.category_id = category_id
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    def push(self, change: dict):
+        # Later changes to the same row replace earlier ones that were not delivered yet
+        self._pending[(change.get("table"), change.get("id"))] = change
+        self._ready.set()
+
+    async def next_batch(self, coalesce_seconds: float, keepalive_seconds: float):
+        """Waits for changes, then a little longer to gather a burst of them.
+
+        Args:
+            coalesce_seconds (float): How long to keep gathering once the first change arrived
+            keepalive_seconds (float): How long to wait for a first change at most
+
+        Returns:
+            list: The coalesced changes, empty if none arrived within the keep-alive interval
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), keepalive_seconds)
+        except asyncio.TimeoutError:
+            return []
+
+        await asyncio.sleep(coalesce_seconds)
+
+        batch = list(self._pending.values())
+        self._pending = {}
+        self._ready.clear()
+        return batch
+
+
+class ChangeBroker:
+    """Routes changes to subscribers, indexed by category so a change only touches the
+    subscribers that want it."""
+
+    def __init__(self):
+        self._by_category = {}
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._by_category.values())
+
+    def subscribe(self, category_id=None) -> Subscriber:
+        subscriber = Subscriber(category_id)
+        self._by_category.setdefault(category_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._by_category.get(subscriber.category_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._by_category[subscriber.category_id]
+
+    def publish(self, change: dict):
+        for category_id in (None, change.get("category_id")):
+            for subscriber in self._by_category.get(category_id, ()):
+                subscriber.push(change)
+
+    def publish_many(self, changes: list):
+        for change in changes:
+            self.publish(change)
+
+
+class ChangeListener:
+    """Background thread that LISTENs on the change channel over one dedicated connection
+    and forwards notifications to the broker on the event loop. Reconnects after errors.
+
+    Args:
+        broker (ChangeBroker): Receives every change
+    """
+
+    RECONNECT_SECONDS = 5
+    POLL_SECONDS = 1
+
+    def __init__(self, broker: ChangeBroker):
+        self.broker = broker
+        self._thread = None
+        self._stopping = threading.Event()
+        self.notifications_received = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Starts listening unless already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(loop,), name="change-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.POLL_SECONDS * 2)
+            self._thread = None
+
+    def _connect(self):
+        # Detached from the pool, the connection is ours for as long as we listen
+        connection = engine.raw_connection()
+        dbapi_connection = connection.driver_connection
+        connection.detach()
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return dbapi_connection
+
+    def _run(self, loop: asyncio.AbstractEventLoop):
+        while not self._stopping.is_set():
+            try:
+                connection = self._connect()
+            except Exception as e:
+                logger.warning("Change listener could not connect, retrying: %s", e)
+                self._stopping.wait(self.RECONNECT_SECONDS)
+                continue
+
+            try:
+                while not self._stopping.is_set():
+                    if select.select([connection], [], [], self.POLL_SECONDS) == ([], [], []):
+                        continue
+
+                    connection.poll()
+                    changes = []
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        try:
+                            changes.append(json.loads(notification.payload))
+                        except ValueError:
+                            logger.warning("Ignoring malformed change notification: %s", notification.payload)
+
+                    # One hop onto the event loop per burst rather than per notification
+                    self.notifications_received += len(changes)
+                    if changes:
+                        loop.call_soon_threadsafe(self.broker.publish_many, changes)
+            except Exception as e:
+                logger.warning("Change listener lost its connection, reconnecting: %s", e)
+                self._stopping.wait(self.RECONNECT_SECONDS)
+            finally:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+change_broker = ChangeBroker()
+change_listener = ChangeListener(change_broker)
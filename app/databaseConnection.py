@@ -1,4 +1,9 @@
-from sqlalchemy import create_engine, text
+import itertools
+import time
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 from app.config import settings
@@ -7,11 +12,91 @@ from app.config import settings
 SQLALCHEMY_DATABASE_URL = f'''postgresql+psycopg2://{settings.database_username}:{settings.database_password}@{
                               settings.database_hostname}:{settings.database_port}/{settings.database_name}'''
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=settings.database_pool_size,
+                       max_overflow=settings.database_max_overflow)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Name of the cookie that pins a client to the primary after it wrote something
+PRIMARY_PIN_COOKIE = "primary_pin"
+
+# Writes to the tables every worker keeps in its reference cache (app.cache)
+REFERENCE_PATHS = ("/category", "/financial")
+
+
+class ReplicaRouter:
+    """Hands out read replica engines in round-robin order, skipping replicas
+    that recently failed until ``retry_seconds`` have passed.
+
+    Args:
+        engines (list): Engines bound to the read replicas
+        retry_seconds (int): How long a failed replica is left out of the rotation
+    """
+
+    def __init__(self, engines, retry_seconds: int):
+        self.engines = engines
+        self.retry_seconds = retry_seconds
+        self._counter = itertools.count()
+        self._unhealthy_until = {}
+
+        for replica in engines:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def candidates(self):
+        """Returns the healthy replicas, starting with the next one in the rotation."""
+        if not self.engines:
+            return []
+
+        start = next(self._counter) % len(self.engines)
+        ordered = self.engines[start:] + self.engines[:start]
+        now = time.monotonic()
+
+        return [replica for replica in ordered if self._unhealthy_until.get(replica, 0) <= now]
+
+    def mark_unhealthy(self, replica):
+        self._unhealthy_until[replica] = time.monotonic() + self.retry_seconds
+
+    def status(self):
+        """Returns the health of every replica, keyed by host."""
+        now = time.monotonic()
+        return {str(replica.url.host): self._unhealthy_until.get(replica, 0) <= now for replica in self.engines}
+
+    def _on_error(self, context):
+        # A dropped connection mid-query takes the replica out of the rotation as well
+        if context.is_disconnect and context.engine is not None:
+            self.mark_unhealthy(context.engine)
+
+
+replica_engines = [
+    create_engine(url.strip(), pool_pre_ping=True, pool_size=settings.database_pool_size,
+                  max_overflow=settings.database_max_overflow)
+    for url in (settings.database_replica_urls or "").split(",") if url.strip()
+]
+replica_router = ReplicaRouter(replica_engines, settings.replica_retry_seconds)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+
+class CheckoutLatency:
+    """Moving average of how long requests wait to get a pooled connection, the signal
+    admission control uses to tell that the database is falling behind.
+
+    Args:
+        alpha (float): Weight of the newest sample in the average
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.average_seconds = 0.0
+        self.samples = 0
+
+    def record(self, seconds: float):
+        self.average_seconds += self.alpha * (seconds - self.average_seconds)
+        self.samples += 1
+
+
+checkout_latency = CheckoutLatency()
+
 
 def connection_test():
     try:
@@ -26,10 +111,86 @@ def connection_test():
 def get_db():
     db = SessionLocal()
     try:
+        # Checked out up front so the wait for a pooled connection can be measured
+        started = time.perf_counter()
+        db.connection()
+        checkout_latency.record(time.perf_counter() - started)
+        yield db
+    finally:
+        db.close()
+
+
+def pinned_to_primary(request: Request) -> bool:
+    """Checks whether a request has to see its own recent writes.
+
+    Args:
+        request (Request): The incoming request
+
+    Returns:
+        bool: True if the client asked for the primary or wrote within the pin window
+    """
+    if request.headers.get("x-read-consistency", "").lower() == "primary":
+        return True
+
+    try:
+        return float(request.cookies.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+# Dependency for read only endpoints
+def get_read_db(request: Request):
+    """Yields a session on a healthy read replica, falling back to the primary
+    when no replica is configured or reachable, or the client is pinned to it.
+
+    Args:
+        request (Request): The incoming request, used for read-your-own-write pinning
+    """
+    connection = None
+    started = time.perf_counter()
+    # Lets pin_primary_after_write tell reads sent as POST (e.g. batch lookups) from writes
+    request.state.read_only = True
+
+    if not pinned_to_primary(request):
+        for replica in replica_router.candidates():
+            try:
+                connection = replica.connect()
+                break
+            except DBAPIError:
+                replica_router.mark_unhealthy(replica)
+
+    db = ReadSessionLocal(bind=connection) if connection is not None else SessionLocal()
+    try:
+        if connection is None:
+            db.connection()
+        checkout_latency.record(time.perf_counter() - started)
         yield db
     finally:
         db.close()
+        if connection is not None:
+            connection.close()
+
+
+async def pin_primary_after_write(request: Request, call_next):
+    """Middleware that sets a short lived cookie after a successful write so the
+    same client's following reads are served by the primary, bypassing the reference
+    cache. Other workers may hold a category or quarter the client changed in their
+    cache until it expires, so those writes pin the client for at least the cache TTL,
+    with or without replicas."""
+    response = await call_next(request)
+
+    is_write = request.method not in ("GET", "HEAD", "OPTIONS") and not getattr(request.state, "read_only", False)
+
+    if is_write and response.status_code < 400:
+        pin_seconds = settings.replica_pin_seconds if replica_engines else 0
+        if request.url.path.startswith(REFERENCE_PATHS):
+            pin_seconds = max(pin_seconds, settings.reference_cache_ttl_seconds)
+
+        if pin_seconds:
+            response.set_cookie(PRIMARY_PIN_COOKIE, str(time.time() + pin_seconds), max_age=pin_seconds, httponly=True)
+
+    return response
 
 
 if __name__ == "__main__":
-    get_db()
\ No newline at end of file
+    get_db()
@@ -0,0 +1,229 @@
+"""
+Content negotiation and compression of responses.
+
+List endpoints answer in the format the client asks for in its Accept header: JSON (the
+default), MessagePack (``application/msgpack``) or columnar JSON
+(``application/vnd.inventory.columnar+json``), which lists every key once and the values of
+each column as an array. Any response larger than ``compression_minimum_size`` is then
+compressed with brotli or gzip, whichever the client prefers in its Accept-Encoding header.
+"""
+
+import json
+import zlib
+from functools import lru_cache
+from typing import List, Optional
+
+import brotli
+import msgpack
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.utils import project_row
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+COLUMNAR_JSON = "application/vnd.inventory.columnar+json"
+
+# Accepted names for each supported media type
+MEDIA_TYPES = {
+    "application/json": JSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    COLUMNAR_JSON: COLUMNAR_JSON,
+}
+
+GZIP_LEVEL = 6
+# Brotli's default (11) is far too slow for responses compressed on the fly
+BROTLI_QUALITY = 4
+
+
+def _weighted(header: str):
+    """Parses an Accept style header into (value, quality) pairs."""
+    for part in header.split(","):
+        value, *parameters = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            if parameter.startswith("q="):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    quality = 0.0
+        if value:
+            yield value.lower(), quality
+
+
+def preferred_media_type(accept: Optional[str]) -> str:
+    """Returns the supported media type the client prefers, JSON unless it asks for another."""
+    best, best_quality = JSON, 0.0
+    for value, quality in _weighted(accept or ""):
+        media_type = MEDIA_TYPES.get(value)
+        if media_type is not None and quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+def preferred_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Returns "br" or "gzip", whichever the client prefers (brotli on a tie), or None."""
+    qualities = dict(_weighted(accept_encoding or ""))
+    wildcard = qualities.get("*", 0.0)
+    brotli_quality = qualities.get("br", wildcard)
+    gzip_quality = qualities.get("gzip", wildcard)
+
+    if max(brotli_quality, gzip_quality) <= 0:
+        return None
+    return "br" if brotli_quality >= gzip_quality else "gzip"
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """Whether the client accepts a content coding, honouring q=0 refusals and the "*" wildcard."""
+    qualities = dict(_weighted(accept_encoding or ""))
+    return qualities.get(encoding, qualities.get("*", 0.0)) > 0
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(response_model) -> TypeAdapter:
+    return TypeAdapter(List[response_model])
+
+
+def encode_rows(rows: list, media_type: str) -> bytes:
+    """Serializes JSON-compatible rows (dictionaries) as JSON, columnar JSON or MessagePack."""
+    if media_type == MSGPACK:
+        return msgpack.packb(rows)
+
+    if media_type == COLUMNAR_JSON:
+        keys = list(rows[0]) if rows else []
+        rows = {"count": len(rows), "columns": {key: [row.get(key) for row in rows] for key in keys}}
+
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def negotiated_response(request: Request, data: list, fields: Optional[List[str]], response_model):
+    """Returns a list of rows in the format the client asked for.
+
+    Args:
+        request (Request): The request, its Accept header picks the format
+        data (list): Rows as dictionaries or ORM instances
+        fields (list): Column names from parse_fields, None for every field of the response model
+        response_model (BaseModel): Schema of one row, used when all fields are returned
+
+    Returns:
+        Response: The rows in the chosen format, with ``Vary: Accept`` so caches keep the formats apart
+    """
+    media_type = preferred_media_type(request.headers.get("accept"))
+
+    if fields is not None:
+        rows = jsonable_encoder([project_row(row, fields) for row in data])
+    else:
+        adapter = _list_adapter(response_model)
+        rows = adapter.dump_python(adapter.validate_python(data, from_attributes=True), mode="json")
+
+    if media_type == JSON:
+        return JSONResponse(rows, headers={"Vary": "Accept"})
+    return Response(content=encode_rows(rows, media_type), media_type=media_type, headers={"Vary": "Accept"})
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses of at least ``minimum_size`` bytes with brotli or
+    gzip. Streamed responses are compressed chunk by chunk; event streams, responses that are
+    already encoded (e.g. stored gzipped report results) and responses without a body (HEAD,
+    1xx, 204 and 304) are passed through.
+
+    Args:
+        app (ASGIApp): The wrapped application
+        minimum_size (int): Smallest response body, in bytes, worth compressing
+    """
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = preferred_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+        compressor = None
+        # Body held back, with the start message, until it is known whether compressing is worth it
+        pending = []
+        pending_size = 0
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough, compressor, pending_size
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = ("content-encoding" in headers
+                               or headers.get("content-type", "").startswith("text/event-stream")
+                               or message["status"] < 200 or message["status"] in (204, 304))
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                pending.append(body)
+                pending_size += len(body)
+                if more_body and pending_size < self.minimum_size:
+                    return
+
+                buffered = len(pending) > 1
+                body = b"".join(pending)
+                pending.clear()
+                headers = MutableHeaders(raw=start_message["headers"])
+
+                if not more_body and len(body) < self.minimum_size:
+                    # A single body message already carries the application's own Content-Length
+                    if buffered or "content-length" not in headers:
+                        headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    start_message = None
+                    return
+
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                compressor = (brotli.Compressor(quality=BROTLI_QUALITY) if encoding == "br"
+                              else zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31))
+
+                if more_body:
+                    # Streamed, the compressed length is not known up front
+                    del headers["Content-Length"]
+                else:
+                    body = _compress(compressor, body, final=True)
+                    headers["Content-Length"] = str(len(body))
+
+                await send(start_message)
+                start_message = None
+
+                if not more_body:
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+            await send({"type": "http.response.body", "body": _compress(compressor, body, final=not more_body),
+                        "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _compress(compressor, data: bytes, final: bool) -> bytes:
+    if isinstance(compressor, brotli.Compressor):
+        return compressor.process(data) + (compressor.finish() if final else b"")
+    return compressor.compress(data) + (compressor.flush() if final else b"")
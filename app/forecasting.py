@@ -0,0 +1,181 @@
+"""
+Demand forecast behind products.suggested_reorder_level.
+
+Each product's daily demand is smoothed exponentially over the last ``forecast_history_days``
+days of daily_stock_movements: with smoothing factor a, the sales of a day d days ago weigh
+a * (1 - a) ** d, normalised over the days the product has existed. The smoothed mean and
+variance give the reorder level
+
+    mean * lead_time + z * standard_deviation * sqrt(lead_time)
+
+where z is the standard normal quantile of ``forecast_service_level``: enough stock to cover
+the expected demand over the lead time plus safety stock for the chosen share of lead times.
+
+The forecast is computed for a whole batch of products at once with NumPy: sales history is
+read with a binary COPY straight into an array of (product, day, units) rows, and the
+weighted sums per product are ``np.bincount`` calls, so there is no Python loop over products
+or days and days without sales cost nothing. Each batch is written back with one
+``UPDATE ... FROM unnest(...)``.
+
+reorder_level itself is left alone: it cannot exceed stock_count, and sales taking stock
+below it are rejected, so raising it is left to a person.
+
+    python -m app.forecasting
+"""
+
+import io
+import logging
+import time
+from datetime import date, timedelta
+from statistics import NormalDist
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from app.config import settings
+from app.databaseConnection import engine
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL's binary COPY format stores dates as days since 2000-01-01
+POSTGRES_EPOCH = date(2000, 1, 1)
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+def smoothing_weights(days: int, smoothing: float) -> np.ndarray:
+    """Returns the weight of each day of the history, oldest first, summing to 1."""
+    ages = np.arange(days - 1, -1, -1, dtype=np.float64)
+    weights = smoothing * (1 - smoothing) ** ages
+    return weights / weights.sum()
+
+
+def forecast_reorder_levels(product_index: np.ndarray, day_index: np.ndarray, units: np.ndarray,
+                            first_day_index: np.ndarray, weights: np.ndarray, lead_time_days: int,
+                            service_level: float) -> np.ndarray:
+    """Computes the reorder level of every product of a batch from its daily sales.
+
+    Args:
+        product_index (np.ndarray): Position of the product of each sales row in the batch
+        day_index (np.ndarray): Day of each sales row, 0 being the oldest day of the history
+        units (np.ndarray): Units sold on that day
+        first_day_index (np.ndarray): For each product of the batch, the first day of the
+            history it existed on, so newer products are not forecast from days before they were added
+        weights (np.ndarray): Weight of each day, from smoothing_weights
+        lead_time_days (int): Days between ordering and restocking
+        service_level (float): Share of lead times that should end without a stockout
+
+    Returns:
+        np.ndarray: Reorder level of each product of the batch
+    """
+    products = len(first_day_index)
+    units = units.astype(np.float64)
+    # Sales dated before the product was added do not count towards its demand
+    row_weights = np.where(day_index >= first_day_index[product_index], weights[day_index], 0.0)
+
+    # Weight of the days each product existed, weights[first_day:].sum()
+    remaining_weight = np.cumsum(weights[::-1])[::-1]
+    product_weight = remaining_weight[first_day_index]
+
+    mean = np.bincount(product_index, weights=units * row_weights, minlength=products) / product_weight
+    mean_square = np.bincount(product_index, weights=units * units * row_weights, minlength=products) / product_weight
+    deviation = np.sqrt(np.maximum(mean_square - mean * mean, 0))
+
+    z = NormalDist().inv_cdf(service_level)
+    levels = mean * lead_time_days + z * deviation * np.sqrt(lead_time_days)
+
+    # Round up, but not past a whole number that is only off by floating point error
+    return np.ceil(levels - 1e-9).astype(np.int64)
+
+
+def _copy_rows(cursor, query: str, fields: tuple) -> np.ndarray:
+    """Runs a binary COPY of a query whose columns are all non-null integers or dates and
+    returns the rows as a NumPy record array without converting them one by one."""
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", buffer)
+    data = buffer.getbuffer()
+
+    if bytes(data[:11]) != COPY_SIGNATURE:
+        raise ValueError("Unexpected COPY output")
+    header = 19 + int.from_bytes(data[15:19], "big")
+
+    # Every row is a field count followed by a length and a 4 byte value per field
+    row_dtype = np.dtype([("fields", ">i2")] + [item for field in fields for item in
+                                                 ((f"{field}_length", ">i4"), (field, ">i4"))])
+    body = len(data) - header - 2
+    if body % row_dtype.itemsize:
+        raise ValueError("COPY rows are not fixed width, a column is null or not 4 bytes wide")
+
+    return np.frombuffer(data, dtype=row_dtype, count=body // row_dtype.itemsize, offset=header)
+
+
+def run_forecast(as_of: Optional[date] = None) -> dict:
+    """Forecasts the reorder level of every product and stores it as suggested_reorder_level.
+
+    Products are handled in batches of ``forecast_batch_products``, each written back and
+    committed on its own so product rows are only locked briefly.
+
+    Args:
+        as_of (date, optional): Last day of sales history used. Defaults to yesterday, the last complete day.
+
+    Returns:
+        dict: Number of products forecast and updated, and the seconds spent reading,
+        computing and writing
+    """
+    as_of = as_of or date.today() - timedelta(days=1)
+    days = settings.forecast_history_days
+    first_day = as_of - timedelta(days=days - 1)
+    first_day_number = (first_day - POSTGRES_EPOCH).days
+    weights = smoothing_weights(days, settings.forecast_smoothing)
+    timings = {"read_seconds": 0.0, "compute_seconds": 0.0, "write_seconds": 0.0}
+    updated = 0
+
+    with engine.connect() as connection:
+        cursor = connection.connection.cursor()
+
+        started = time.perf_counter()
+        products = _copy_rows(cursor, "SELECT id, date_added::date FROM products ORDER BY id", ("id", "added"))
+        timings["read_seconds"] += time.perf_counter() - started
+
+        for start in range(0, len(products), settings.forecast_batch_products):
+            batch = products[start:start + settings.forecast_batch_products]
+            product_ids = batch["id"]
+
+            started = time.perf_counter()
+            sales = _copy_rows(cursor, (
+                "SELECT product_id, day, units_sold FROM daily_stock_movements "
+                f"WHERE product_id BETWEEN {int(product_ids[0])} AND {int(product_ids[-1])} "
+                f"AND day BETWEEN '{first_day.isoformat()}' AND '{as_of.isoformat()}' AND units_sold > 0"
+            ), ("product_id", "day", "units"))
+            timings["read_seconds"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            levels = forecast_reorder_levels(
+                np.searchsorted(product_ids, sales["product_id"]),
+                sales["day"] - first_day_number,
+                sales["units"],
+                np.clip(batch["added"] - first_day_number, 0, days - 1),
+                weights, settings.forecast_lead_time_days, settings.forecast_service_level,
+            )
+            timings["compute_seconds"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            result = connection.execute(text(
+                "UPDATE products SET suggested_reorder_level = suggestions.level "
+                "FROM unnest(CAST(:ids AS integer[]), CAST(:levels AS integer[])) AS suggestions(id, level) "
+                "WHERE products.id = suggestions.id "
+                "AND products.suggested_reorder_level IS DISTINCT FROM suggestions.level"
+            ), {"ids": product_ids.tolist(), "levels": levels.tolist()})
+            connection.commit()
+            updated += result.rowcount
+            timings["write_seconds"] += time.perf_counter() - started
+
+    summary = {"as_of": as_of.isoformat(), "products": len(products), "updated": updated,
+               **{name: round(seconds, 3) for name, seconds in timings.items()}}
+    logger.info("Reorder level forecast: %s", summary)
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(run_forecast())
@@ -0,0 +1,241 @@
+"""
+Idempotency-Key support for POST requests.
+
+The first request with a given key claims it in ``idempotency_keys`` and its response is
+stored (compressed, with its headers) once it completes; retries with the same key get that
+response replayed without reaching the endpoint. A retry arriving while the first request is still running
+waits briefly for it to finish. Responses with a 5xx status are not stored, so the request
+can be retried for real.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from app.config import settings
+from app.databaseConnection import SessionLocal
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# Longest key accepted, matches idempotency_keys.key
+MAX_KEY_LENGTH = 255
+# Share of completed requests that also purge a batch of expired keys
+PURGE_PROBABILITY = 0.01
+
+# Headers not stored with a response: hop-by-hop headers only apply to the connection they were
+# sent on, and the content type and length are set again from the stored response
+UNSTORED_HEADERS = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "content-length", "content-type",
+})
+
+
+class IdempotencyStore:
+    """Claims keys and stores responses in the ``idempotency_keys`` table, with a small
+    per-worker cache of completed responses in front of it.
+
+    Args:
+        ttl_seconds (int): How long a completed response is replayed
+        lock_seconds (int): How long a claim is held before another request may take it over,
+        in case the worker handling it died
+        cache_size (int): Number of completed responses kept in memory
+    """
+
+    def __init__(self, ttl_seconds: int, lock_seconds: int, cache_size: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.cache_size = cache_size
+        self._completed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, key: str):
+        with self._lock:
+            record = self._completed.get(key)
+            if record is None:
+                return None
+            if record["expires"] < time.monotonic():
+                del self._completed[key]
+                return None
+            self._completed.move_to_end(key)
+            return record
+
+    def _remember(self, key: str, record: dict):
+        with self._lock:
+            self._completed[key] = dict(record, expires=time.monotonic() + self.ttl_seconds)
+            self._completed.move_to_end(key)
+            while len(self._completed) > self.cache_size:
+                self._completed.popitem(last=False)
+
+    def claim(self, key: str, fingerprint: str):
+        """Claims a key for a new request, unless it is held or was completed already.
+
+        Args:
+            key (str): The Idempotency-Key header value
+            fingerprint (str): Hash of the request, to detect a key reused for another request
+
+        Returns:
+            dict: None if the key was claimed, otherwise the stored record of the earlier request
+        """
+        with SessionLocal() as db:
+            # Inserting is the claim; an expired record (or an abandoned claim) is taken over
+            claimed = db.execute(text(
+                "INSERT INTO idempotency_keys (key, fingerprint, status, expires_at) "
+                "VALUES (:key, :fingerprint, :status, now() + make_interval(secs => :lock_seconds)) "
+                "ON CONFLICT (key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, status = EXCLUDED.status, "
+                "status_code = NULL, content_type = NULL, response_body = NULL, response_headers = NULL, "
+                "created_at = now(), "
+                "expires_at = EXCLUDED.expires_at "
+                "WHERE idempotency_keys.expires_at < now() "
+                "RETURNING key"
+            ), {"key": key, "fingerprint": fingerprint, "status": IN_PROGRESS,
+                "lock_seconds": self.lock_seconds}).first()
+            db.commit()
+
+            if claimed is not None:
+                return None
+
+            record = db.execute(text(
+                "SELECT fingerprint, status, status_code, content_type, response_body, response_headers "
+                "FROM idempotency_keys WHERE key = :key"
+            ), {"key": key}).mappings().first()
+
+        if record is None:
+            # Purged between the two statements, try again
+            return self.claim(key, fingerprint)
+
+        record = dict(record)
+        if record["status"] == COMPLETED:
+            self._remember(key, record)
+        return record
+
+    def complete(self, key: str, fingerprint: str, status_code: int, content_type: str, body: bytes,
+                 headers: list):
+        """Stores the response of a claimed request so retries can replay it.
+
+        Args:
+            headers (list): [name, value] pairs of the headers to replay, from stored_headers
+        """
+        record = {"fingerprint": fingerprint, "status": COMPLETED, "status_code": status_code,
+                  "content_type": content_type, "response_body": zlib.compress(body), "response_headers": headers}
+
+        with SessionLocal() as db:
+            db.execute(text(
+                "UPDATE idempotency_keys SET status = :status, status_code = :status_code, "
+                "content_type = :content_type, response_body = :response_body, "
+                "response_headers = CAST(:response_headers AS jsonb), "
+                "expires_at = now() + make_interval(secs => :ttl_seconds) "
+                "WHERE key = :key AND fingerprint = :fingerprint"
+            ), dict(record, key=key, ttl_seconds=self.ttl_seconds, response_headers=json.dumps(headers)))
+
+            if random.random() < PURGE_PROBABILITY:
+                self.purge_expired(db)
+
+            db.commit()
+
+        self._remember(key, record)
+
+    def release(self, key: str, fingerprint: str):
+        """Gives up a claim without storing a response, e.g. after a server error."""
+        with SessionLocal() as db:
+            db.execute(text(
+                "DELETE FROM idempotency_keys WHERE key = :key AND fingerprint = :fingerprint AND status = :status"
+            ), {"key": key, "fingerprint": fingerprint, "status": IN_PROGRESS})
+            db.commit()
+
+    @staticmethod
+    def purge_expired(db, batch_size: int = 1000):
+        """Deletes a bounded batch of expired keys."""
+        db.execute(text(
+            "DELETE FROM idempotency_keys WHERE key IN "
+            "(SELECT key FROM idempotency_keys WHERE expires_at < now() LIMIT :batch_size)"
+        ), {"batch_size": batch_size})
+
+
+idempotency_store = IdempotencyStore(settings.idempotency_ttl_seconds, settings.idempotency_lock_seconds)
+
+
+def stored_headers(response: Response) -> list:
+    """Returns the headers of a response worth replaying as [name, value] pairs, repeated
+    headers such as Set-Cookie included."""
+    return [[name.decode("latin-1"), value.decode("latin-1")] for name, value in response.raw_headers
+            if name.decode("latin-1").lower() not in UNSTORED_HEADERS]
+
+
+def replay(record: dict) -> Response:
+    response = Response(content=zlib.decompress(record["response_body"]), status_code=record["status_code"],
+                        media_type=record["content_type"])
+    for name, value in record["response_headers"] or ():
+        response.headers.append(name, value)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+async def idempotency_middleware(request: Request, call_next):
+    """Middleware replaying the stored response of POST requests retried with the same
+    Idempotency-Key header. Requests without the header are passed straight through."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+
+    if key is None or request.method != "POST":
+        return await call_next(request)
+
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                            content={"detail": f"The Idempotency-Key header must be 1 to {MAX_KEY_LENGTH} characters."})
+
+    body = await request.body()
+    fingerprint = hashlib.sha256(b"\0".join([
+        request.method.encode(), request.url.path.encode(), request.url.query.encode(), body
+    ])).hexdigest()
+
+    record = idempotency_store.cached(key)
+    deadline = time.monotonic() + settings.idempotency_wait_seconds
+
+    while record is None:
+        record = await asyncio.to_thread(idempotency_store.claim, key, fingerprint)
+
+        if record is None:
+            # Claimed, this request is the one that runs
+            break
+
+        if record["status"] == IN_PROGRESS and record["fingerprint"] == fingerprint:
+            # The same request is running elsewhere, wait for its response
+            if time.monotonic() >= deadline:
+                return JSONResponse(status_code=status.HTTP_409_CONFLICT,
+                                    content={"detail": "A request with this Idempotency-Key is still being processed."},
+                                    headers={"Retry-After": "1"})
+            await asyncio.sleep(0.1)
+            record = None
+
+    if record is not None:
+        if record["fingerprint"] != fingerprint:
+            return JSONResponse(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                content={"detail": "This Idempotency-Key was already used for a different request."})
+        return replay(record)
+
+    try:
+        response = await call_next(request)
+        response_body = b"".join([chunk async for chunk in response.body_iterator])
+    except BaseException:
+        await asyncio.to_thread(idempotency_store.release, key, fingerprint)
+        raise
+
+    if response.status_code >= 500:
+        await asyncio.to_thread(idempotency_store.release, key, fingerprint)
+    else:
+        await asyncio.to_thread(idempotency_store.complete, key, fingerprint, response.status_code,
+                                response.headers.get("content-type"), response_body, stored_headers(response))
+
+    buffered = Response(content=response_body, status_code=response.status_code)
+    buffered.raw_headers = response.raw_headers
+    return buffered
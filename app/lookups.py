@@ -0,0 +1,78 @@
+"""
+Single-row lookups on the hot request paths, written so SQLAlchemy can reuse their
+statements instead of building and compiling a new ``db.query(...).filter(...)`` each call.
+
+Primary key lookups go through ``Session.get``, whose statement is built once per mapper.
+Lookups by code use ``lambda_stmt``: the lambda's code location is the cache key, so a
+repeated call skips both constructing the statement and generating its cache key, and only
+binds the new value.
+
+Lookups taking ``fields`` use that fast path only when the whole row is wanted; for a sparse
+fieldset they select just the requested columns (load_only), as the list endpoints do.
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import lambda_stmt, or_, select
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.utils import with_fields
+
+
+def _get_with_fields(db: Session, model, column, value, fields: List[str]):
+    return with_fields(db.query(model), model, fields).filter(column == value).first()
+
+
+def get_product(db: Session, product_id: int, fields: Optional[List[str]] = None):
+    if fields is not None:
+        return _get_with_fields(db, models.Products, models.Products.id, product_id, fields)
+    return db.get(models.Products, product_id)
+
+
+def get_category(db: Session, category_id: int, fields: Optional[List[str]] = None):
+    if fields is not None:
+        return _get_with_fields(db, models.ProductCategory, models.ProductCategory.id, category_id, fields)
+    return db.get(models.ProductCategory, category_id)
+
+
+def get_quarter(db: Session, quarter_id: int, fields: Optional[List[str]] = None):
+    if fields is not None:
+        return _get_with_fields(db, models.FinancialQuarters, models.FinancialQuarters.id, quarter_id, fields)
+    return db.get(models.FinancialQuarters, quarter_id)
+
+
+def get_quarter_covering(db: Session, when: datetime):
+    """The financial quarter containing a point in time, for callers that cannot use the cached quarter index."""
+    statement = lambda_stmt(lambda: select(models.FinancialQuarters).where(
+        or_(models.FinancialQuarters.start_date.is_(None), models.FinancialQuarters.start_date <= when),
+        or_(models.FinancialQuarters.end_date.is_(None), models.FinancialQuarters.end_date >= when)
+    ))
+    return db.execute(statement).scalars().first()
+
+
+def get_location(db: Session, location_id: int):
+    return db.get(models.Locations, location_id)
+
+
+def get_category_by_code(db: Session, code: str, fields: Optional[List[str]] = None):
+    if fields is not None:
+        return _get_with_fields(db, models.ProductCategory, models.ProductCategory.code, code, fields)
+    statement = lambda_stmt(lambda: select(models.ProductCategory).where(models.ProductCategory.code == code))
+    return db.execute(statement).scalars().first()
+
+
+def category_code_exists(db: Session, code: str) -> bool:
+    statement = lambda_stmt(lambda: select(models.ProductCategory.id).where(models.ProductCategory.code == code))
+    return db.execute(statement).first() is not None
+
+
+def product_code_exists(db: Session, code: str) -> bool:
+    statement = lambda_stmt(lambda: select(models.Products.id).where(models.Products.product_code == code))
+    return db.execute(statement).first() is not None
+
+
+def location_code_exists(db: Session, code: str) -> bool:
+    statement = lambda_stmt(lambda: select(models.Locations.id).where(models.Locations.code == code))
+    return db.execute(statement).first() is not None
@@ -2,39 +2,130 @@
 # Developers: Andre McKenzie
 # Version: 1.0
 # Version Date: 2025-01-05
-# Purpose: FastAPI backend implementation for a inventory Management system, designed to store use and 
+# Purpose: FastAPI backend implementation for a inventory Management system, designed to store use and
 # products data as will as having the ability to generate reports on said data
 
+import asyncio
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from app.databaseConnection import engine, Base
+from app.admission import AdmissionControl
+from app.encoding import CompressionMiddleware
+from app.databaseConnection import engine, replica_engines, pin_primary_after_write
 import app.models
-from app.routers import categories, financial_quarter
+from app.catalogue_snapshot import maintain_snapshot
+from app.change_stream import change_listener
+from app.config import settings
+from app.idempotency import idempotency_middleware
+from app.outbox import outbox_dispatcher
+from app.profiling import RequestProfiler
+from app.report_jobs import report_job_runner
+from app.routers import admin, categories, financial_quarter, health, locations, products, reports, stream
+from app.warmup import FirstRequestTimer, startup_metrics, warm_up
+
+logger = logging.getLogger(__name__)
+
+# Seconds between warm-up attempts while the database cannot be reached
+WARM_UP_RETRY_SECONDS = 5
+
+
+async def keep_warming_up():
+    """Retries the warm-up until it succeeds, the worker reports not ready meanwhile."""
+    while not startup_metrics.ready:
+        try:
+            await asyncio.to_thread(warm_up)
+        except Exception as e:
+            startup_metrics.last_error = str(e)
+            logger.warning("Warm-up failed, retrying in %ss: %s", WARM_UP_RETRY_SECONDS, e)
+            await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+
+
 # Create an async lifespan function
-# @asynccontextmanager
-# async def lifespan(app: FastAPI):
-#     Base.metadata.create_all(bind=engine)
-#     yield
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await asyncio.to_thread(warm_up)
+        retry_task = None
+    except Exception as e:
+        # Start serving anyway so the health endpoints can report why the worker is not ready
+        startup_metrics.last_error = str(e)
+        retry_task = asyncio.create_task(keep_warming_up())
 
-app = FastAPI()
+    snapshot_task = asyncio.create_task(maintain_snapshot()) if settings.catalogue_snapshot_path else None
+    outbox_task = asyncio.create_task(outbox_dispatcher.run()) if outbox_dispatcher is not None else None
 
-origins = ["*"]
+    report_job_runner.start()
+    try:
+        await asyncio.to_thread(report_job_runner.resume)
+    except Exception as e:
+        logger.warning("Could not resume queued report jobs: %s", e)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    yield
+
+    if retry_task is not None:
+        retry_task.cancel()
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    if outbox_task is not None:
+        outbox_task.cancel()
+    change_listener.stop()
+    report_job_runner.stop()
+    engine.dispose()
+    for replica in replica_engines:
+        replica.dispose()
 
-app.include_router(categories.category_router)
-app.include_router(financial_quarter.financial_router)
 
-@app.get("/")
 def read_root():
     return {"Hello": "World"}
 
 
+def create_app() -> FastAPI:
+    """Builds the application, run with ``uvicorn --factory app.main:create_app``.
+
+    Returns:
+        FastAPI: The configured application
+    """
+    application = FastAPI(lifespan=lifespan)
+
+    # Close to the routes, so a profiled request (X-Profile header) covers little besides the route
+    application.add_middleware(RequestProfiler)
+    # Keeps a client on the primary for a few seconds after it writes, so it reads its own changes
+    application.middleware("http")(pin_primary_after_write)
+    # Replays the stored response of POST requests retried with the same Idempotency-Key
+    application.middleware("http")(idempotency_middleware)
+    application.add_middleware(FirstRequestTimer)
+    application.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+    # Outside everything but CORS, so requests shed under overload cost as little as possible
+    application.add_middleware(AdmissionControl)
+
+    origins = ["*"]
+
+    # Outermost, so shed (503), idempotency (409/422) and profiler responses carry CORS headers
+    # too and browsers can read their status and Retry-After
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Retry-After"],
+    )
+
+    application.include_router(categories.category_router)
+    application.include_router(financial_quarter.financial_router)
+    application.include_router(products.products_router)
+    application.include_router(locations.location_router)
+    application.include_router(reports.reports_router)
+    application.include_router(stream.stream_router)
+    application.include_router(health.health_router)
+    application.include_router(admin.admin_router)
+
+    application.get("/")(read_root)
+
+    return application
+
+
+app = create_app()
@@ -1,8 +1,9 @@
 from datetime import datetime
-from sqlalchemy import Boolean, CheckConstraint, Column, Integer, String, Float, ForeignKey, UniqueConstraint, false
+from sqlalchemy import BigInteger, Boolean, CheckConstraint, Column, Index, Integer, String, Float, ForeignKey, UniqueConstraint, false, func
+from sqlalchemy.dialects.postgresql import ExcludeConstraint, JSONB, TSTZRANGE
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import text
-from sqlalchemy.sql.sqltypes import TIMESTAMP, Text, Enum, DECIMAL, DATE
+from sqlalchemy.sql.sqltypes import TIMESTAMP, Text, Enum, DECIMAL, DATE, LargeBinary
 from enum import Enum as PyEnum
 
 from app.databaseConnection import Base
@@ -48,11 +49,22 @@ class ProductCategory(Base):
     code = Column(String(5), unique=True, nullable=False)
     category = Column(String(50), nullable=False)
     description = Column(Text, nullable=True)
+    parent_id = Column(Integer, ForeignKey("product_category.id"), nullable=True)
+    # Ids from the root category down to this one, each followed by a dot (e.g. "1.4.9."), so the
+    # subcategories of a category are the rows whose path starts with its path (app/category_tree.py)
+    path = Column(String(255), nullable=False)
     date_created = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
     date_updated = Column(TIMESTAMP, default=datetime.now, onupdate=datetime.now)
 
     products = relationship("Products", back_populates="product_category")
 
+    __table_args__ = (
+        CheckConstraint('parent_id <> id', name='check_category_not_own_parent'),
+        # text_pattern_ops lets prefix matches (path LIKE '1.4.%') use the index
+        Index('ix_product_category_path', 'path', postgresql_ops={'path': 'text_pattern_ops'}),
+        Index('ix_product_category_parent', 'parent_id'),
+    )
+
 class FinancialQuarters(Base):
     __tablename__ = "financial_quarters"
     id = Column(Integer, primary_key=True, nullable=False)
@@ -61,9 +73,18 @@ class FinancialQuarters(Base):
     end_date = Column(TIMESTAMP, default=datetime.now)
     description = Column(Text, nullable=True)
     date_created = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    closed_at = Column(TIMESTAMP, nullable=True)
 
     products = relationship("Products", back_populates="financial")
 
+    __table_args__ = (
+        CheckConstraint('start_date <= end_date', name='check_quarter_dates'),
+        # No two quarters may cover the same point in time
+        ExcludeConstraint(
+        (func.tsrange(start_date, end_date, text("'[]'")), '&&'),
+        name='financial_quarters_no_overlap', using='gist'),
+    )
+
 class BarcodeType(PyEnum):
     UPC = "UPC"
     EAN_13 = "EAN-13"
@@ -83,6 +104,8 @@ class Products(Base):
     selling_price = Column(DECIMAL(19, 4), nullable=False)
     stock_count = Column(Integer, default=0, nullable=False)
     reorder_level = Column(Integer, default=0, nullable=False)
+    # Written by the demand forecast (app/forecasting.py), reorder_level stays hand-entered
+    suggested_reorder_level = Column(Integer, nullable=True)
     date_added = Column(TIMESTAMP, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
     date_modified = Column(TIMESTAMP(timezone=True), default=datetime.now, onupdate=datetime.now, nullable=True)
     financial_quarter_id = Column(Integer, ForeignKey("financial_quarters.id"), nullable=False)
@@ -104,8 +127,54 @@ class Products(Base):
         CheckConstraint('reorder_level <= stock_count', name='check_reorder_level'),
         CheckConstraint('stock_count >= 0', name='check_stock_count_non_negative'),
         CheckConstraint('reorder_level >= 0', name='check_reorder_level_non_negative'),
+        # Products of a category or of a category subtree, newest first
+        Index('ix_products_category', 'category_id', 'id'),
+    )
+
+class ProductStockHistory(Base):
+    # Frozen copy of every product's stock and price taken when a financial quarter is closed.
+    # Partitioned by quarter so reports on one quarter only read that quarter's partition.
+    __tablename__ = "product_stock_history"
+    financial_quarter_id = Column(Integer, ForeignKey("financial_quarters.id"), primary_key=True, nullable=False)
+    product_id = Column(Integer, primary_key=True, nullable=False)
+    product_code = Column(String(5), nullable=False)
+    product_name = Column(String(150), nullable=False)
+    category_id = Column(Integer, nullable=False)
+    selling_price = Column(DECIMAL(19, 4), nullable=False)
+    stock_count = Column(Integer, nullable=False)
+    reorder_level = Column(Integer, nullable=False)
+    snapshot_at = Column(TIMESTAMP, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+
+    __table_args__ = (
+        Index('ix_product_stock_history_category', 'financial_quarter_id', 'category_id'),
+        {"postgresql_partition_by": "LIST (financial_quarter_id)"},
+    )
+
+class ProductPriceHistory(Base):
+    # Every selling price a product has had and when it applied, written by a trigger on products.
+    # The current price has an open-ended range; ranges of one product never overlap.
+    __tablename__ = "product_price_history"
+    id = Column(BigInteger, primary_key=True, nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    selling_price = Column(DECIMAL(19, 4), nullable=False)
+    valid_during = Column(TSTZRANGE, nullable=False)
+
+    __table_args__ = (
+        # Its GiST index also serves the point in time lookups (product_id = ? AND valid_during @> ?)
+        ExcludeConstraint(
+        ('product_id', '='), ('valid_during', '&&'),
+        name='product_price_history_no_overlap', using='gist'),
     )
 
+class DailyStockMovements(Base):
+    # Units sold and received per product and day through stock adjustments, the demand history
+    # the reorder level forecast is computed from
+    __tablename__ = "daily_stock_movements"
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    day = Column(DATE, primary_key=True, nullable=False)
+    units_sold = Column(Integer, nullable=False, server_default=text('0'))
+    units_received = Column(Integer, nullable=False, server_default=text('0'))
+
 class ProductDiscounts(Base):
     __tablename__ = "product_discounts"
     id = Column(Integer, primary_key=True, nullable=False)
@@ -121,3 +190,98 @@ class ProductDiscounts(Base):
 
     product = relationship("Products", back_populates="discounts")
 
+
+#==================================== Locations =======================================
+class Locations(Base):
+    # A store or warehouse holding stock. Product-level stock adjustments go to the default location.
+    __tablename__ = "locations"
+    id = Column(Integer, primary_key=True, nullable=False)
+    code = Column(String(10), unique=True, nullable=False)
+    name = Column(String(150), nullable=False)
+    location_type = Column(Enum('Store', 'Warehouse', name='location_types'), nullable=False)
+    is_default = Column(Boolean, nullable=False, server_default=false())
+    date_created = Column(TIMESTAMP, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+
+    __table_args__ = (
+        Index('ux_locations_default', 'is_default', unique=True, postgresql_where=text('is_default')),
+    )
+
+class LocationStock(Base):
+    # Stock of a product at one location. products.stock_count is kept equal to the sum over all
+    # locations by triggers (see the add_locations migration), in the same transaction.
+    __tablename__ = "location_stock"
+    location_id = Column(Integer, ForeignKey("locations.id"), primary_key=True, nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    stock_count = Column(Integer, nullable=False, server_default=text('0'))
+    reorder_level = Column(Integer, nullable=False, server_default=text('0'))
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+
+    __table_args__ = (
+        CheckConstraint('stock_count >= 0', name='check_location_stock_non_negative'),
+        CheckConstraint('reorder_level >= 0', name='check_location_reorder_level_non_negative'),
+        # Every location holding a product, for the per product totals and consistency checks
+        Index('ix_location_stock_product', 'product_id', 'location_id'),
+        # Products of a location closest to (or below) their reorder level, for location reorder queries
+        Index('ix_location_stock_headroom', 'location_id', text('(stock_count - reorder_level)')),
+    )
+
+
+#==================================== API =======================================
+class IdempotencyKeys(Base):
+    # First response to a request sent with an Idempotency-Key header, replayed on retries
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True, nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    status = Column(String(11), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    content_type = Column(String(100), nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    # [name, value] pairs of the response headers other than the content type and length
+    response_headers = Column(JSONB, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+
+class ReportJobs(Base):
+    # Report requested through the API and computed in a worker process, result stored gzipped
+    __tablename__ = "report_jobs"
+    id = Column(Integer, primary_key=True, nullable=False)
+    report_type = Column(String(30), nullable=False)
+    params = Column(JSONB, nullable=False)
+    params_hash = Column(String(64), nullable=False)
+    status = Column(String(9), nullable=False, server_default=text("'queued'"))
+    error = Column(Text, nullable=True)
+    row_count = Column(Integer, nullable=True)
+    result = Column(LargeBinary, nullable=True)
+    result_size = Column(Integer, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+    started_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # At most one queued or running job per set of parameters, identical requests share it
+        Index('ux_report_jobs_active_params', 'params_hash', unique=True,
+              postgresql_where=text("status IN ('queued', 'running')")),
+    )
+
+class OutboxEvents(Base):
+    # Inserts and updates of categories, quarters, products and discounts, written by triggers in
+    # the same transaction as the change and deleted once a dispatcher delivered them (app/outbox.py)
+    __tablename__ = "outbox_events"
+    id = Column(BigInteger, primary_key=True, nullable=False)
+    table_name = Column(String(50), nullable=False)
+    operation = Column(String(6), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+
+
+#==================================== Migrations =======================================
+class BackfillCheckpoints(Base):
+    # Progress of a batched backfill run from a migration, so an interrupted run resumes where it stopped
+    __tablename__ = "backfill_checkpoints"
+    name = Column(String(100), primary_key=True, nullable=False)
+    last_key = Column(BigInteger, nullable=True)
+    rows_updated = Column(BigInteger, nullable=False, server_default=text('0'))
+    started_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
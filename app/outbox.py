@@ -0,0 +1,220 @@
+"""
+Delivery of the change events in ``outbox_events`` to downstream systems.
+
+Triggers record every insert and update of categories, quarters, products and discounts in
+``outbox_events`` in the same transaction as the change, so an event exists exactly when its
+change committed and requests pay for one extra insert per statement rather than a call to
+another system. A dispatcher drains the table in batches: it locks the oldest events with
+``FOR UPDATE SKIP LOCKED``, hands them to a sink and deletes them in the same transaction.
+Several dispatchers (one per API worker, or ``python -m app.outbox`` processes) can run side
+by side, each taking different events.
+
+Delivery is at least once: a batch the sink accepted is delivered again if the transaction
+deleting it fails. Batches of concurrent dispatchers can reach the sink out of order, the
+event ids give the order the changes committed in per row.
+
+A sink is any object with a ``write(events)`` method that raises when the events were not
+stored; sinks are picked with the ``outbox_sink`` setting, e.g. ``ndjson:/var/lib/inventory/outbox.ndjson``.
+
+    python -m app.outbox [--once]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.databaseConnection import engine
+
+logger = logging.getLogger(__name__)
+
+# Longest pause after failed deliveries, doubled from poll_seconds on each failure in a row
+MAX_RETRY_SECONDS = 60
+
+CLAIM_BATCH = """
+SELECT id, table_name, operation, row_id, payload, created_at FROM outbox_events
+ORDER BY id LIMIT :batch_size
+FOR UPDATE SKIP LOCKED
+"""
+
+
+class NdjsonSink:
+    """Appends events to a file as one JSON object per line, flushed to disk after every batch.
+
+    Args:
+        path (str): File the events are appended to
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, events: list):
+        lines = "".join(json.dumps(event, default=str, separators=(",", ":")) + "\n" for event in events)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+# Sink classes by the scheme of the outbox_sink setting, called with the rest of the setting
+SINKS = {"ndjson": NdjsonSink}
+
+
+def make_sink(spec: str):
+    """Builds the sink described by a setting of the form ``<scheme>:<argument>``.
+
+    Args:
+        spec (str): e.g. "ndjson:/var/lib/inventory/outbox.ndjson"
+
+    Raises:
+        ValueError: When no sink is registered for the scheme
+
+    Returns:
+        The sink
+    """
+    scheme, _, argument = spec.partition(":")
+    if scheme not in SINKS:
+        raise ValueError(f"Unknown outbox sink {scheme!r}, expected one of {', '.join(SINKS)}")
+    return SINKS[scheme](argument)
+
+
+class OutboxDispatcher:
+    """Moves events from outbox_events to a sink in batches, and keeps delivery metrics.
+
+    Args:
+        sink: Object whose write(events) method stores a batch of events
+        batch_size (int): Events claimed per transaction
+        poll_seconds (float): Pause once the outbox is drained before looking again
+    """
+
+    def __init__(self, sink, batch_size: int, poll_seconds: float):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.delivered = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_delivery_at = None
+        # Time from the start of the transaction that made the oldest change of the last batch to its delivery
+        self.last_lag_seconds = None
+
+    def dispatch_batch(self) -> int:
+        """Delivers the oldest events not claimed by another dispatcher.
+
+        Returns:
+            int: Number of events delivered
+        """
+        with engine.connect() as connection:
+            rows = connection.execute(text(CLAIM_BATCH), {"batch_size": self.batch_size}).mappings().all()
+            if not rows:
+                connection.rollback()
+                return 0
+
+            events = [{**row, "created_at": row["created_at"].isoformat()} for row in rows]
+            self.sink.write(events)
+
+            connection.execute(text("DELETE FROM outbox_events WHERE id = ANY(:ids)"),
+                               {"ids": [row["id"] for row in rows]})
+            lag = connection.execute(text("SELECT extract(epoch FROM clock_timestamp() - :created_at)"),
+                                     {"created_at": rows[0]["created_at"]}).scalar()
+            connection.commit()
+
+        self.delivered += len(rows)
+        self.batches += 1
+        self.last_delivery_at = time.time()
+        self.last_lag_seconds = round(float(lag), 3)
+        return len(rows)
+
+    def drain(self) -> int:
+        """Delivers batches until the outbox is empty.
+
+        Returns:
+            int: Number of events delivered
+        """
+        delivered = 0
+        while True:
+            count = self.dispatch_batch()
+            delivered += count
+            if count < self.batch_size:
+                return delivered
+
+    async def run(self):
+        """Delivers events until cancelled. Batches follow each other straight away while the
+        outbox is backed up; once it is drained it is polled every ``poll_seconds``."""
+        failures_in_a_row = 0
+        while True:
+            try:
+                count = await asyncio.to_thread(self.dispatch_batch)
+                failures_in_a_row = 0
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                failures_in_a_row += 1
+                delay = min(self.poll_seconds * 2 ** failures_in_a_row, MAX_RETRY_SECONDS)
+                logger.warning("Outbox delivery failed, retrying in %.1fs: %s", delay, e)
+                await asyncio.sleep(delay)
+                continue
+
+            if count < self.batch_size:
+                await asyncio.sleep(self.poll_seconds)
+
+    def status(self) -> dict:
+        """Returns this dispatcher's delivery counts and the outbox backlog.
+
+        Returns:
+            dict: Events delivered, batches and failures of this process, the lag of the last
+            batch, and the number and age of the oldest of the events waiting
+        """
+        with engine.connect() as connection:
+            # The first and last ids are index lookups, unlike a count of a large backlog
+            oldest = connection.execute(text(
+                "SELECT (SELECT max(id) FROM outbox_events) - first.id + 1 AS pending, "
+                "extract(epoch FROM clock_timestamp() - first.created_at) AS age_seconds "
+                "FROM (SELECT id, created_at FROM outbox_events ORDER BY id LIMIT 1) AS first"
+            )).mappings().first()
+
+        return {
+            "delivered": self.delivered,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_delivery_at": self.last_delivery_at,
+            "last_lag_seconds": self.last_lag_seconds,
+            "pending_estimate": oldest["pending"] if oldest else 0,
+            "oldest_pending_age_seconds": round(float(oldest["age_seconds"]), 3) if oldest else None,
+        }
+
+
+def make_dispatcher(sink_spec: Optional[str] = None) -> Optional[OutboxDispatcher]:
+    """Returns a dispatcher for the configured sink, None when no sink is configured."""
+    sink_spec = sink_spec or settings.outbox_sink
+    if not sink_spec:
+        return None
+    return OutboxDispatcher(make_sink(sink_spec), settings.outbox_batch_size, settings.outbox_poll_seconds)
+
+
+outbox_dispatcher = make_dispatcher()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sink", help="Sink to deliver to, defaults to the outbox_sink setting")
+    parser.add_argument("--once", action="store_true", help="Drain the outbox and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    dispatcher = make_dispatcher(args.sink)
+    if dispatcher is None:
+        parser.error("no sink configured, set outbox_sink or pass --sink")
+
+    if args.once:
+        print({"delivered": dispatcher.drain(), **dispatcher.status()})
+    else:
+        asyncio.run(dispatcher.run())
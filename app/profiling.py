@@ -0,0 +1,212 @@
+"""
+On-demand profiling of a live worker.
+
+Two tools, both idle (and free) until an admin asks for them:
+
+- StackSampler, behind ``POST /admin/profile``: a background thread that reads the stack of
+  every other thread of the worker every few milliseconds for a fixed time and counts them
+  as collapsed stacks (``thread;outer;...;inner count`` per line), the input of flamegraph.pl,
+  speedscope and similar tools. In wall mode every sample counts, so threads waiting on the
+  database or the event loop waiting for work show up too. In CPU mode only threads the
+  kernel reports as running (/proc/self/task/<tid>/stat, Linux only) are counted, so only
+  code that burns CPU shows up.
+- RequestProfiler: runs a single request under cProfile when it is sent with an
+  ``X-Profile: pstats`` or ``X-Profile: text`` header and the admin token, and answers with
+  the profile instead of the response. Requests without the header only pay for a header lookup.
+
+cProfile traces the event loop thread while the request runs, so requests served concurrently
+by the same worker are included, and work the request hands to other threads is not.
+"""
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from app.config import settings
+
+WALL = "wall"
+CPU = "cpu"
+
+# Functions listed in the text form of a request profile
+TEXT_PROFILE_LINES = 50
+
+# One profile of each kind at a time per worker: samplers would count each other, and a
+# second cProfile would replace the first one's hook
+sampling_lock = threading.Lock()
+request_profile_lock = threading.Lock()
+
+
+def admin_token_matches(token: Optional[str]) -> bool:
+    """Whether a token is the configured admin token. Always False when none is configured."""
+    if not settings.admin_token or token is None:
+        return False
+    return secrets.compare_digest(token.encode(), settings.admin_token.encode())
+
+
+def thread_state(native_id: int) -> Optional[str]:
+    """Returns the scheduler state of a thread of this process, "R" while it runs on a CPU
+    (or waits for one), None if it is unknown."""
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", "rb") as file:
+            # The thread name before the state is in parentheses and may contain spaces
+            return file.read().rsplit(b")", 1)[1].split()[0].decode()
+    except (OSError, IndexError):
+        return None
+
+
+class StackSampler:
+    """Samples the stacks of the worker's threads into collapsed stack counts.
+
+    Args:
+        interval_seconds (float): Time between samples
+        mode (str): WALL to count every sample, CPU to only count threads running at the time
+
+    Raises:
+        ValueError: When CPU mode is asked for where thread states cannot be read
+    """
+
+    def __init__(self, interval_seconds: float, mode: str = WALL):
+        if mode == CPU and thread_state(threading.get_native_id()) is None:
+            raise ValueError("CPU profiles need /proc/self/task/<tid>/stat, which this system does not provide")
+
+        self.interval_seconds = interval_seconds
+        self.mode = mode
+        self.samples = 0
+        self.stacks = Counter()
+        self._labels = {}
+
+    def run(self, seconds: float) -> Counter:
+        """Samples for ``seconds`` on the calling thread, which is left out of the samples.
+
+        Returns:
+            Counter: Weight of each collapsed stack
+        """
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                thread = threads.get(ident)
+                if self.mode == CPU and (thread is None or thread_state(thread.native_id) != "R"):
+                    continue
+                name = thread.name if thread is not None else f"thread-{ident}"
+                self.stacks[self._collapse(name.replace(";", ":"), frame)] += 1
+
+            self.samples += 1
+            time.sleep(self.interval_seconds)
+
+        return self.stacks
+
+    def _collapse(self, thread_name: str, frame) -> str:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = f"{code.co_qualname} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+                self._labels[code] = label
+            labels.append(label)
+            frame = frame.f_back
+
+        return ";".join([thread_name, *reversed(labels)])
+
+
+def _short_path(path: str) -> str:
+    # Paths relative to site-packages or the application keep the lines of a profile short
+    position = path.rfind("site-packages" + os.sep)
+    if position != -1:
+        return path[position + len("site-packages" + os.sep):]
+
+    working_directory = os.getcwd() + os.sep
+    return path[len(working_directory):] if path.startswith(working_directory) else path
+
+
+def format_collapsed(stacks: Counter) -> str:
+    """Returns collapsed stacks one per line, the heaviest first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestProfiler:
+    """ASGI middleware that profiles requests sent with an ``X-Profile`` header and a valid
+    ``X-Admin-Token``, and returns the profile in place of the response: ``pstats`` gives a
+    binary file for pstats.Stats, snakeviz and the like, ``text`` the slowest functions by
+    cumulative time. The status code the request got is sent in ``X-Profiled-Status``.
+
+    Args:
+        app (ASGIApp): The wrapped application
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.admin_token:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        profile_format = headers.get(b"x-profile")
+        if profile_format is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not admin_token_matches(headers.get(b"x-admin-token", b"").decode("latin-1")):
+            await _send_text(send, 403, "A valid X-Admin-Token header is needed to profile a request.")
+            return
+        if profile_format not in (b"pstats", b"text"):
+            await _send_text(send, 400, "X-Profile must be pstats or text.")
+            return
+        if not request_profile_lock.acquire(blocking=False):
+            await _send_text(send, 409, "Another request is being profiled by this worker.")
+            return
+
+        response = {"status": None}
+
+        async def capture(message):
+            # The profile replaces the response, so its body is dropped
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, capture)
+            finally:
+                profiler.disable()
+        finally:
+            request_profile_lock.release()
+
+        if profile_format == b"pstats":
+            profiler.create_stats()
+            body, content_type = marshal.dumps(profiler.stats), b"application/octet-stream"
+        else:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(TEXT_PROFILE_LINES)
+            body, content_type = stream.getvalue().encode(), b"text/plain; charset=utf-8"
+
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(body)).encode()),
+            (b"x-profiled-status", str(response["status"]).encode()),
+            (b"x-worker-pid", str(os.getpid()).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def _send_text(send, status_code: int, message: str):
+    body = message.encode()
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,129 @@
+"""
+Closing a financial quarter: freezes every product's stock and price into the quarter's
+partition of ``product_stock_history`` with one set-based ``INSERT ... SELECT``.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.cache import reference_cache
+from app.databaseConnection import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class QuarterCloseProgress:
+    """Progress of the quarter closes started by this worker, keyed by quarter id."""
+
+    def __init__(self):
+        self._progress = {}
+        self._lock = threading.Lock()
+
+    def start(self, quarter_id: int, expected_rows: int) -> bool:
+        """Registers a close, returns False if one is already running for the quarter."""
+        with self._lock:
+            current = self._progress.get(quarter_id)
+            if current is not None and current["status"] == "running":
+                return False
+
+            self._progress[quarter_id] = {
+                "quarter_id": quarter_id,
+                "status": "running",
+                "phase": "queued",
+                "expected_rows": expected_rows,
+                "rows_copied": None,
+                "started_at": datetime.now(),
+                "finished_at": None,
+                "elapsed_seconds": None,
+                "error": None,
+            }
+            return True
+
+    def update(self, quarter_id: int, **changes):
+        with self._lock:
+            self._progress[quarter_id].update(changes)
+
+    def get(self, quarter_id: int):
+        with self._lock:
+            progress = self._progress.get(quarter_id)
+            return dict(progress) if progress is not None else None
+
+
+close_progress = QuarterCloseProgress()
+
+
+def partition_name(quarter_id: int) -> str:
+    return f"product_stock_history_q{int(quarter_id)}"
+
+
+def estimated_product_count(db: Session) -> int:
+    """Planner estimate of the number of products, avoids a full count on a large table."""
+    estimate = db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'products'")).scalar()
+    return max(int(estimate or 0), 0)
+
+
+def close_quarter(quarter_id: int):
+    """Snapshots all products into the quarter's history partition and marks the quarter closed.
+
+    The partition is created and committed first in a short transaction of its own: creating
+    it locks product_stock_history exclusively, which would otherwise block every report on the
+    history until the copy commits. Claiming the quarter and copying the products then happen in
+    one transaction, so a failed close leaves neither a partial snapshot nor a closed quarter
+    behind, only an empty partition a retry reuses. Meant to run as a background task.
+
+    Args:
+        quarter_id (int): The financial quarter to close
+    """
+    started = time.perf_counter()
+    partition = partition_name(quarter_id)
+
+    try:
+        with SessionLocal() as db:
+            close_progress.update(quarter_id, phase="creating partition")
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF product_stock_history "
+                f"FOR VALUES IN ({int(quarter_id)})"
+            ))
+            db.commit()
+
+        with SessionLocal() as db:
+            close_progress.update(quarter_id, phase="locking quarter")
+            # Claiming the quarter first also serializes concurrent closes of the same quarter
+            claimed = db.execute(text(
+                "UPDATE financial_quarters SET closed_at = now() "
+                "WHERE id = :quarter_id AND closed_at IS NULL RETURNING id"
+            ), {"quarter_id": quarter_id}).first()
+
+            if claimed is None:
+                raise ValueError(f"Financial quarter {quarter_id} is already closed.")
+
+            close_progress.update(quarter_id, phase="copying products")
+            copied = db.execute(text(
+                "INSERT INTO product_stock_history (financial_quarter_id, product_id, product_code, product_name, "
+                "category_id, selling_price, stock_count, reorder_level) "
+                "SELECT :quarter_id, id, product_code, product_name, category_id, selling_price, stock_count, "
+                "reorder_level FROM products"
+            ), {"quarter_id": quarter_id}).rowcount
+
+            close_progress.update(quarter_id, phase="committing", rows_copied=copied)
+            db.commit()
+
+        # Fresh statistics on the new partition keep report plans sensible straight away
+        close_progress.update(quarter_id, phase="analyzing")
+        with SessionLocal() as db:
+            db.execute(text(f"ANALYZE {partition}"))
+            db.commit()
+
+        reference_cache.invalidate("quarters")
+        close_progress.update(quarter_id, status="done", phase="done", finished_at=datetime.now(),
+                              elapsed_seconds=round(time.perf_counter() - started, 3))
+        logger.info("Closed financial quarter %s, %s products snapshotted", quarter_id, copied)
+    except Exception as e:
+        logger.exception("Closing financial quarter %s failed", quarter_id)
+        close_progress.update(quarter_id, status="failed", error=str(e), finished_at=datetime.now(),
+                              elapsed_seconds=round(time.perf_counter() - started, 3))
@@ -0,0 +1,96 @@
+"""
+Sorted interval index over the financial quarters, used to find the quarter a date
+falls in without querying the database.
+"""
+
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from typing import Optional
+
+from app.cache import reference_cache
+
+
+def _naive(value: datetime) -> datetime:
+    # Quarter dates are stored without a time zone, in server local time
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+class QuarterIndex:
+    """Keeps the financial quarters sorted by start date and answers "which quarter
+    contains this date" with a binary search. Quarters may not overlap (enforced by the
+    ``financial_quarters_no_overlap`` exclusion constraint), so the only candidate is the
+    last quarter starting on or before the date.
+
+    The index is rebuilt from the reference cache whenever its quarters change, which
+    includes every ``add_quarter`` on this worker.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._quarters = []
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bounds(quarter: dict):
+        # A missing start or end date leaves the quarter open on that side
+        return quarter["start_date"] or datetime.min, quarter["end_date"] or datetime.max
+
+    def _ensure_current(self):
+        quarters = reference_cache.quarters()
+        if self._version == reference_cache.quarters_version:
+            return
+
+        with self._lock:
+            version = reference_cache.quarters_version
+            ordered = sorted(quarters.values(), key=lambda quarter: self._bounds(quarter)[0])
+            self._starts = [self._bounds(quarter)[0] for quarter in ordered]
+            self._quarters = ordered
+            self._version = version
+
+    def resolve(self, when: datetime) -> Optional[dict]:
+        """Finds the financial quarter containing a point in time.
+
+        Args:
+            when (datetime): The date and time to look up
+
+        Returns:
+            dict: The matching quarter, or None if the date is not covered by any quarter
+        """
+        self._ensure_current()
+        starts, quarters = self._starts, self._quarters
+
+        when = _naive(when)
+
+        position = bisect_right(starts, when) - 1
+        if position < 0:
+            return None
+
+        quarter = quarters[position]
+        return quarter if when <= self._bounds(quarter)[1] else None
+
+    def overlapping(self, start: Optional[datetime], end: Optional[datetime]) -> Optional[dict]:
+        """Returns an existing quarter overlapping the given range, if any.
+
+        Args:
+            start (datetime): Start of the range, None for open ended
+            end (datetime): End of the range, None for open ended
+
+        Returns:
+            dict: The first overlapping quarter, or None
+        """
+        self._ensure_current()
+        start, end = _naive(start or datetime.min), _naive(end or datetime.max)
+
+        # Quarters starting after the end of the range cannot overlap it, and of the rest
+        # only the latest one can reach into the range since they do not overlap each other
+        position = bisect_right(self._starts, end) - 1
+        if position < 0:
+            return None
+
+        quarter = self._quarters[position]
+        return quarter if self._bounds(quarter)[1] >= start else None
+
+
+quarter_index = QuarterIndex()
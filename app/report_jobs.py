@@ -0,0 +1,191 @@
+"""
+Report jobs. A report request is stored in ``report_jobs`` and computed in a separate worker
+process, so a report running for minutes neither blocks the event loop nor hits an HTTP
+timeout. The result is stored gzipped in the job row and downloaded later.
+
+Identical requests (same report and parameters) made while a job for them is queued or
+running share that job, which the partial unique index on ``params_hash`` enforces across
+API workers.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.config import settings
+from app.databaseConnection import SessionLocal, engine
+from app.reports import REPORTS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def params_hash(report_type: str, params: dict) -> str:
+    canonical = json.dumps({"report_type": report_type, "params": params}, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _json_default(value):
+    # Decimals as strings like the API's responses, so money keeps its precision
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def create_job(db: Session, report_type: str, params: dict):
+    """Queues a report job, or returns the queued or running job for the same parameters.
+
+    Args:
+        db (Session): Database session, committed before returning
+        report_type (str): One of the reports in app.reports.REPORTS
+        params (dict): The report's parameters
+
+    Returns:
+        tuple: The job, and whether it was created by this call
+    """
+    digest = params_hash(report_type, params)
+
+    while True:
+        job_id = db.execute(text(
+            "INSERT INTO report_jobs (report_type, params, params_hash, status) "
+            "VALUES (:report_type, CAST(:params AS jsonb), :params_hash, :status) "
+            "ON CONFLICT (params_hash) WHERE status IN ('queued', 'running') DO NOTHING "
+            "RETURNING id"
+        ), {"report_type": report_type, "params": json.dumps(params), "params_hash": digest,
+            "status": QUEUED}).scalar()
+        db.commit()
+
+        created = job_id is not None
+        if not created:
+            job_id = db.execute(text(
+                "SELECT id FROM report_jobs WHERE params_hash = :params_hash AND status IN ('queued', 'running')"
+            ), {"params_hash": digest}).scalar()
+
+        # None only if the identical job finished between the two statements, queue a new one
+        if job_id is not None:
+            return db.get(models.ReportJobs, job_id), created
+
+
+def run_report_job(job_id: int):
+    """Computes a queued report job and stores its result. Runs in a worker process.
+
+    Args:
+        job_id (int): The job to run, skipped unless it is still queued
+    """
+    with engine.connect() as connection:
+        job = connection.execute(text(
+            "UPDATE report_jobs SET status = :running, started_at = now() "
+            "WHERE id = :id AND status = :queued RETURNING report_type, params"
+        ), {"id": job_id, "running": RUNNING, "queued": QUEUED}).first()
+        connection.commit()
+
+        if job is None:
+            return
+
+        try:
+            rows = REPORTS[job.report_type](connection, job.params)
+            connection.rollback()
+
+            payload = json.dumps({
+                "report_type": job.report_type,
+                "params": job.params,
+                "generated_at": datetime.now().isoformat(),
+                "rows": rows,
+            }, default=_json_default).encode()
+            result = gzip.compress(payload)
+
+            connection.execute(text(
+                "UPDATE report_jobs SET status = :completed, result = :result, result_size = :result_size, "
+                "row_count = :row_count, finished_at = now() WHERE id = :id"
+            ), {"id": job_id, "completed": COMPLETED, "result": result, "result_size": len(result),
+                "row_count": len(rows)})
+            connection.commit()
+        except Exception as e:
+            logger.exception("Report job %s failed", job_id)
+            connection.rollback()
+            connection.execute(text(
+                "UPDATE report_jobs SET status = :failed, error = :error, finished_at = now() WHERE id = :id"
+            ), {"id": job_id, "failed": FAILED, "error": str(e)})
+            connection.commit()
+
+
+class ReportJobRunner:
+    """Process pool running report jobs, started and stopped with the application.
+
+    Args:
+        workers (int): Number of worker processes
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = None
+
+    def start(self):
+        if self._pool is None:
+            # Spawned rather than forked: the API process holds pooled connections and threads
+            # (e.g. the change listener) that a forked child must not inherit
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def submit(self, job_id: int):
+        """Hands a job to the pool. Without a pool it stays queued until the next start."""
+        if self._pool is None:
+            logger.warning("Report job %s queued while the job runner is stopped", job_id)
+            return
+
+        try:
+            future = self._pool.submit(run_report_job, job_id)
+        except BrokenProcessPool:
+            # A worker process died, e.g. killed for using too much memory; start a new pool
+            logger.warning("Report job pool was broken, restarting it")
+            self._pool = None
+            self.start()
+            future = self._pool.submit(run_report_job, job_id)
+
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Report job worker failed: %s", future.exception())
+
+    def resume(self):
+        """Queues jobs left running past the timeout again, then submits every queued job.
+        Called at startup, so jobs survive restarts of the API."""
+        with SessionLocal() as db:
+            db.execute(text(
+                "UPDATE report_jobs SET status = :queued, started_at = NULL "
+                "WHERE status = :running AND started_at < now() - make_interval(secs => :timeout)"
+            ), {"queued": QUEUED, "running": RUNNING, "timeout": settings.report_job_timeout_seconds})
+            db.commit()
+
+            job_ids = db.execute(text(
+                "SELECT id FROM report_jobs WHERE status = :queued ORDER BY id"
+            ), {"queued": QUEUED}).scalars().all()
+
+        for job_id in job_ids:
+            self.submit(job_id)
+
+
+report_job_runner = ReportJobRunner(settings.report_job_workers)
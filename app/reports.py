@@ -0,0 +1,147 @@
+"""
+Heavy reports computed by report jobs rather than inside a request. Every report takes a
+connection and the job's parameters and returns its rows as dictionaries.
+
+Closed quarters are read from their ``product_stock_history`` partition; the quarter that
+is still open uses the live ``products`` table.
+"""
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.category_tree import SUBTREE_IDS, subtree_pattern
+
+
+def _category_filter(column: str, params: dict) -> str:
+    if params.get("category_id") is None:
+        return ""
+    if params.get("include_subcategories"):
+        return f" AND {column} IN ({SUBTREE_IDS})"
+    return f" AND {column} = :category_id"
+
+
+def _with_subtree_path(connection: Connection, params: dict) -> dict:
+    # The subtree's path is looked up first so the filter is a constant prefix the path index can use
+    if params.get("category_id") is None or not params.get("include_subcategories"):
+        return params
+
+    path = connection.execute(text("SELECT path FROM product_category WHERE id = :category_id"), params).scalar()
+    return {**params, "subtree_path": subtree_pattern(path) if path is not None else None}
+
+
+def valuation_report(connection: Connection, params: dict) -> list:
+    """Units and value of stock per category for every quarter of a year.
+
+    Args:
+        connection (Connection): Database connection
+        params (dict): year, and optionally category_id and include_subcategories
+
+    Returns:
+        list: One row per quarter and category
+    """
+    params = _with_subtree_path(connection, params)
+    rows = connection.execute(text(
+        "SELECT q.id AS financial_quarter_id, q.start_date, q.end_date, 'snapshot' AS source, "
+        "h.category_id, count(*) AS products, SUM(h.stock_count) AS units, "
+        "SUM(h.stock_count * h.selling_price) AS value "
+        "FROM financial_quarters q JOIN product_stock_history h ON h.financial_quarter_id = q.id "
+        "WHERE q.year = :year AND q.closed_at IS NOT NULL" + _category_filter("h.category_id", params) + " "
+        "GROUP BY q.id, h.category_id "
+        "UNION ALL "
+        "SELECT q.id, q.start_date, q.end_date, 'live', "
+        "p.category_id, count(*), SUM(p.stock_count), SUM(p.stock_count * p.selling_price) "
+        "FROM financial_quarters q CROSS JOIN products p "
+        "WHERE q.year = :year AND q.closed_at IS NULL AND now() BETWEEN q.start_date AND q.end_date"
+        + _category_filter("p.category_id", params) + " "
+        "GROUP BY q.id, p.category_id "
+        "ORDER BY start_date, category_id"
+    ), params).mappings().all()
+
+    return [dict(row) for row in rows]
+
+
+def reorder_report(connection: Connection, params: dict) -> list:
+    """Products at or close to their reorder level, with how much their stock changed since
+    the most recently closed quarter.
+
+    Args:
+        connection (Connection): Database connection
+        params (dict): headroom (units above the reorder level still included), and optionally
+            category_id and include_subcategories
+
+    Returns:
+        list: One row per product, those with the least headroom first
+    """
+    params = _with_subtree_path(connection, params)
+    rows = connection.execute(text(
+        "WITH last_closed AS ("
+        "    SELECT id FROM financial_quarters WHERE closed_at IS NOT NULL ORDER BY end_date DESC LIMIT 1"
+        ") "
+        "SELECT p.id AS product_id, p.product_code, p.product_name, p.category_id, "
+        "p.stock_count, p.reorder_level, p.suggested_reorder_level, p.stock_count - p.reorder_level AS headroom, "
+        "h.stock_count AS last_close_stock_count, p.stock_count - h.stock_count AS change_since_close "
+        "FROM products p "
+        "LEFT JOIN product_stock_history h "
+        "ON h.financial_quarter_id = (SELECT id FROM last_closed) AND h.product_id = p.id "
+        "WHERE p.stock_count - p.reorder_level <= :headroom" + _category_filter("p.category_id", params) + " "
+        "ORDER BY headroom, p.id"
+    ), params).mappings().all()
+
+    return [dict(row) for row in rows]
+
+
+def discount_impact_report(connection: Connection, params: dict) -> list:
+    """Value given away by discounts per category for every quarter of a year, if all stock
+    of each discounted product sold at its largest discount running during the quarter.
+
+    Args:
+        connection (Connection): Database connection
+        params (dict): year, and optionally category_id and include_subcategories
+
+    Returns:
+        list: One row per quarter and category
+    """
+    params = _with_subtree_path(connection, params)
+    rows = connection.execute(text(
+        "WITH discounted AS ("
+        "    SELECT q.id AS financial_quarter_id, q.start_date, q.end_date, "
+        "    COALESCE(h.category_id, p.category_id) AS category_id, d.product_id, "
+        "    COALESCE(h.stock_count, p.stock_count) AS units, "
+        "    COALESCE(h.selling_price, p.selling_price) AS price, "
+        "    MAX(CASE WHEN d.discount_type = 'Percentage' "
+        "        THEN COALESCE(h.selling_price, p.selling_price) * d.discount_value / 100 "
+        "        ELSE LEAST(d.discount_value, COALESCE(h.selling_price, p.selling_price)) END) AS unit_discount, "
+        "    count(*) AS discounts "
+        "    FROM financial_quarters q "
+        "    JOIN product_discounts d "
+        "    ON d.start_date <= q.end_date AND (d.end_date IS NULL OR d.end_date >= q.start_date) "
+        "    LEFT JOIN product_stock_history h ON h.financial_quarter_id = q.id AND h.product_id = d.product_id "
+        "    LEFT JOIN products p ON q.closed_at IS NULL AND p.id = d.product_id "
+        "    WHERE q.year = :year "
+        "    GROUP BY q.id, q.start_date, q.end_date, h.category_id, p.category_id, d.product_id, "
+        "    h.stock_count, p.stock_count, h.selling_price, p.selling_price"
+        ") "
+        "SELECT financial_quarter_id, start_date, end_date, category_id, "
+        "count(*) AS discounted_products, SUM(discounts)::integer AS discounts, "
+        "SUM(units * price) AS full_price_value, round(SUM(units * unit_discount), 4) AS discount_value "
+        "FROM discounted WHERE units IS NOT NULL" + _category_filter("category_id", params) + " "
+        "GROUP BY financial_quarter_id, start_date, end_date, category_id "
+        "ORDER BY start_date, category_id"
+    ), params).mappings().all()
+
+    return [dict(row) for row in rows]
+
+
+REPORTS = {
+    "valuation": valuation_report,
+    "reorder": reorder_report,
+    "discount_impact": discount_impact_report,
+}
+
+# Parameters each report uses, the others are left out of its job so they cannot make two
+# identical requests look different
+REPORT_PARAMETERS = {
+    "valuation": ("year", "category_id", "include_subcategories"),
+    "reorder": ("headroom", "category_id", "include_subcategories"),
+    "discount_impact": ("year", "category_id", "include_subcategories"),
+}
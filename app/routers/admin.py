@@ -0,0 +1,80 @@
+"""
+Router for operating a live worker: on-demand profiling. Only enabled when an admin token is configured
+"""
+
+import asyncio
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Depends, Header, Query, status, APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.config import settings
+from app.profiling import CPU, WALL, StackSampler, admin_token_matches, format_collapsed, sampling_lock
+
+admin_router = APIRouter(
+    prefix="/admin",
+    tags=['Admin']
+)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Only lets requests with the configured admin token through.
+
+    Args:
+        x_admin_token (str, optional): The X-Admin-Token header
+
+    Raises:
+        HTTPException: Raises a 404 error when no admin token is configured, and a 403 error
+        when the header does not match it.
+    """
+    if not settings.admin_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    if not admin_token_matches(x_admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="A valid X-Admin-Token header is required.")
+
+
+@admin_router.post("/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile_worker(seconds: float = Query(10, gt=0), mode: str = Query(WALL, pattern=f"^({WALL}|{CPU})$"),
+                         interval_ms: float = Query(5, ge=1, le=1000)):
+    """Samples the stacks of every thread of the worker serving this request for a while and
+    returns them as collapsed stacks, one ``frames count`` line per stack, ready for
+    flamegraph.pl or speedscope. Sampling stops by itself, so a forgotten profile costs nothing.
+
+    Args:
+        seconds (float, optional): How long to sample, at most profile_max_seconds. Defaults to 10.
+        mode (str, optional): "wall" counts every sample, "cpu" only the threads running on a
+            CPU at the time. Defaults to "wall".
+        interval_ms (float, optional): Milliseconds between samples. Defaults to 5.
+
+    Raises:
+        HTTPException: Raises a 400 error if seconds is above the limit or CPU time cannot be
+        read on this system, and a 409 error if the worker is already being profiled.
+
+    Returns:
+        text: The collapsed stacks, heaviest first. The worker's process id and the number of
+        samples taken are sent in the X-Worker-Pid and X-Profile-Samples headers.
+    """
+    if seconds > settings.profile_max_seconds:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Profiles are limited to {settings.profile_max_seconds} seconds.")
+
+    try:
+        sampler = StackSampler(interval_ms / 1000, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if not sampling_lock.acquire(blocking=False):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This worker is already being profiled.")
+
+    try:
+        # On its own thread, the event loop keeps serving (and is sampled) meanwhile
+        stacks = await asyncio.to_thread(sampler.run, seconds)
+    finally:
+        sampling_lock.release()
+
+    return PlainTextResponse(format_collapsed(stacks), headers={
+        "X-Worker-Pid": str(os.getpid()),
+        "X-Profile-Samples": str(sampler.samples),
+    })
@@ -2,13 +2,18 @@
 Router for managing product categories
 """
 
-from fastapi import HTTPException, Depends, status, APIRouter
+from fastapi import HTTPException, Depends, Request, status, APIRouter
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 import app.schemas as schemas
 import app.models as models
-from app.databaseConnection import get_db
+import app.lookups as lookups
+from app.cache import reference_cache
+from app.category_tree import category_path, move_category, new_category_path, subtree_pattern
+from app.databaseConnection import get_db, get_read_db, pinned_to_primary
+from app.encoding import negotiated_response
+from app.utils import batch_lookup, batch_response, parse_fields, sparse_response, with_fields
 
 category_router = APIRouter(
     prefix="/category",
@@ -24,51 +29,64 @@ async def add_category(category_data: schemas.AddProductCategory, db: Session =
         db (Session, optional): Starts a database connection. Defaults to Depends(get_db).
 
     Raises:
-        HTTPException: Returns a 409 error is the category code already exist.
+        HTTPException: Returns a 409 error is the category code already exist, and a 404 error if
+        the parent category does not exist.
 
     Returns:
         json: Returns a json representation of the category entered
     """
     # Check if the category code already exists
-    existing_category = db.query(models.ProductCategory).filter(
-        models.ProductCategory.code == category_data.code).first()
-
-    if existing_category:
+    if lookups.category_code_exists(db, category_data.code):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail=f"A category with code {category_data.code} already exists.")
 
-    new_category = models.ProductCategory(**category_data.model_dump())
+    try:
+        category_id, path = new_category_path(db, category_data.parent_id)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    new_category = models.ProductCategory(id=category_id, path=path, **category_data.model_dump())
 
     db.add(new_category)
     db.commit()
     db.refresh(new_category)
+    reference_cache.put_category(new_category)
 
     return new_category
 
 
 @category_router.get("/get_categories", response_model=List[schemas.ProductCategoryResponse])
-async def get_all_categories(db: Session = Depends(get_db)):
-    """Returns all product categories
+async def get_all_categories(request: Request, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """Returns all product categories, as MessagePack or columnar JSON if the Accept header asks for it
 
     Args:
+        request (Request): Its Accept header picks the response format, clients pinned to the primary skip the cache
+        fields (str, optional): Comma separated fields to return, e.g. "code,category". Defaults to all fields.
         db (Session, optional): Stores a database connection. Defaults to Depends(get_db).
 
     Returns:
         dict: Returns a json representation of all product categories stored in a python dictionary
     """
-    categories = db.query(models.ProductCategory).order_by(models.ProductCategory.id.desc()).all()
+    selected_fields = parse_fields(fields, models.ProductCategory)
 
-    category_dict = [category.__dict__ for category in categories]
+    if pinned_to_primary(request):
+        category_dict = (with_fields(db.query(models.ProductCategory), models.ProductCategory, selected_fields)
+                        .order_by(models.ProductCategory.id.desc()).all())
+    else:
+        categories = reference_cache.categories()
+        category_dict = [categories[category_id] for category_id in sorted(categories, reverse=True)]
 
-    return category_dict
+    return negotiated_response(request, category_dict, selected_fields, schemas.ProductCategoryResponse)
 
 
 @category_router.get("/get_category_by_id/{category_id}", response_model=schemas.ProductCategoryResponse)
-async def get_category_by_id(category_id: int, db: Session = Depends(get_db)):
+async def get_category_by_id(category_id: int, request: Request, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
     """End point that returns a single product category based on the id provided
 
     Args:
         category_id (int): ID associated with a product category
+        request (Request): Clients pinned to the primary skip the cache
+        fields (str, optional): Comma separated fields to return. Defaults to all fields.
         db (Session, optional): Stores the instance of a database connection. Defaults to Depends(get_db).
 
     Raises:
@@ -77,20 +95,26 @@ async def get_category_by_id(category_id: int, db: Session = Depends(get_db)):
     Returns:
         json: json representation of the corresponding product category
     """
-    category = db.query(models.ProductCategory).filter(models.ProductCategory.id == category_id).first()
+    selected_fields = parse_fields(fields, models.ProductCategory)
+    category = None if pinned_to_primary(request) else reference_cache.get_category(category_id)
+
+    if category is None:
+        category = lookups.get_category(db, category_id, selected_fields)
 
     if category is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Category with ID {category_id} not found.")
 
-    return category
+    return sparse_response(category, selected_fields)
 
 
 @category_router.get("/get_category_by_code/{category_code}", response_model=schemas.ProductCategoryResponse)
-async def get_category_by_code(category_code: str, db: Session = Depends(get_db)):
+async def get_category_by_code(category_code: str, request: Request, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
     """Returns a single product category based on the category code provided
 
     Args:
         category_code (str): Code associated with a category
+        request (Request): Clients pinned to the primary skip the cache
+        fields (str, optional): Comma separated fields to return. Defaults to all fields.
         db (Session, optional): Stores a database connection. Defaults to Depends(get_db).
 
     Raises:
@@ -99,12 +123,70 @@ async def get_category_by_code(category_code: str, db: Session = Depends(get_db)
     Returns:
         json: Returns a json representation of a category 
     """
-    category = db.query(models.ProductCategory).filter(models.ProductCategory.code == category_code).first()
+    selected_fields = parse_fields(fields, models.ProductCategory)
+    category = None if pinned_to_primary(request) else reference_cache.get_category_by_code(category_code)
+
+    if category is None:
+        category = lookups.get_category_by_code(db, category_code, selected_fields)
 
     if category is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Category with code {category_code} not found.")
 
-    return category
+    return sparse_response(category, selected_fields)
+
+
+@category_router.post("/get_categories_by_ids", response_model=schemas.BatchLookupResponse[schemas.ProductCategoryResponse])
+async def get_categories_by_ids(lookup: schemas.BatchLookup, request: Request, fields: Optional[str] = None,
+                                db: Session = Depends(get_read_db)):
+    """Returns many product categories at once, looked up either by id or by code
+
+    Args:
+        lookup (schemas.BatchLookup): Up to 5000 category ids or codes
+        request (Request): Clients pinned to the primary skip the cache
+        fields (str, optional): Comma separated fields to return. Defaults to all fields.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Returns:
+        json: The categories found keyed by the id or code requested, and the ids or codes not found
+    """
+    selected_fields = parse_fields(fields, models.ProductCategory)
+    pinned = pinned_to_primary(request)
+    if not pinned:
+        reference_cache.categories()
+
+    if lookup.codes:
+        found, missing = batch_lookup(db, models.ProductCategory, "code", lookup.codes,
+                                      cached=None if pinned else reference_cache.categories_by_code,
+                                      fields=selected_fields)
+    else:
+        found, missing = batch_lookup(db, models.ProductCategory, "id", lookup.ids,
+                                      cached=None if pinned else reference_cache.categories_by_id,
+                                      fields=selected_fields)
+
+    return batch_response(found, missing, selected_fields)
+
+
+@category_router.get("/get_subtree/{category_id}", response_model=List[schemas.ProductCategoryResponse])
+async def get_category_subtree(category_id: int, db: Session = Depends(get_read_db)):
+    """Returns a category and all of its subcategories at any depth, each after its parent
+
+    Args:
+        category_id (int): ID associated with a product category
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Rases a HTTP error if the id provided does not correspond to any category
+
+    Returns:
+        json: The categories of the subtree, ordered by path
+    """
+    path = category_path(db, category_id)
+
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Category with ID {category_id} not found.")
+
+    return db.query(models.ProductCategory).filter(models.ProductCategory.path.like(subtree_pattern(path))) \
+        .order_by(models.ProductCategory.path).all()
 
 
 @category_router.put("/update_category/{category_id}")
@@ -118,6 +200,8 @@ async def update_category(category_id: int, category_update: schemas.AddProductC
 
     Raises:
         HTTPException: Rases a HTTP error of the id provided does not match any product category
+        or parent category, and a 409 error if the category would be moved under itself or one
+        of its subcategories
 
     Returns:
         json: Returns a json representation of the updated product category
@@ -129,8 +213,25 @@ async def update_category(category_id: int, category_update: schemas.AddProductC
     if category is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Category with id {category_id} not found.")
 
-    update_category_query.update(category_update.dict(), synchronize_session=False)
+    # The category only moves when parent_id is sent, so older clients leave the tree alone
+    moved = 0
+    if "parent_id" in category_update.model_fields_set and category_update.parent_id != category.parent_id:
+        try:
+            moved = move_category(db, category_id, category_update.parent_id)
+        except LookupError as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    update_category_query.update(category_update.dict(exclude={"parent_id"}), synchronize_session=False)
     db.commit()
 
-    return update_category_query.first()
+    updated_category = update_category_query.first()
+    if moved:
+        # The paths of the subcategories changed as well
+        reference_cache.invalidate("categories")
+    else:
+        reference_cache.put_category(updated_category)
+
+    return updated_category
 
@@ -1,10 +1,18 @@
-from fastapi import HTTPException, Depends, status, APIRouter
+from datetime import datetime
+from fastapi import BackgroundTasks, HTTPException, Depends, Query, Request, status, APIRouter
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 import app.schemas as schemas
 import app.models as models
-from app.databaseConnection import get_db
+import app.lookups as lookups
+from app.cache import reference_cache
+from app.databaseConnection import get_db, get_read_db, pinned_to_primary
+from app.encoding import negotiated_response
+from app.quarter_close import close_progress, close_quarter, estimated_product_count
+from app.quarter_index import quarter_index
+from app.utils import batch_lookup, batch_response, parse_fields, sparse_response, with_fields
 
 financial_router = APIRouter(
     prefix="/financial",
@@ -20,40 +28,67 @@ async def add_quarter(quarter_data: schemas.AddFinancialQuarters, db: Session =
         quarter_data (schemas.AddFinancialQuarters): Contains data based to the end point and validated by the relivant schema
         db (Session, optional): Database connection. Defaults to Depends(get_db).
 
+    Raises:
+        HTTPException: Returns a 409 error if the quarter overlaps an existing one.
+
     Returns:
         json: json representation of the entered quarter
     """
+    overlapping = quarter_index.overlapping(quarter_data.start_date, quarter_data.end_date)
+
+    if overlapping:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"The quarter overlaps financial quarter {overlapping['id']}.")
+
     new_quarter = models.FinancialQuarters(**quarter_data.model_dump())
 
     db.add(new_quarter)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker added an overlapping quarter since this worker's cache was loaded
+        db.rollback()
+        reference_cache.invalidate("quarters")
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="The quarter overlaps an existing financial quarter.")
     db.refresh(new_quarter)
+    reference_cache.put_quarter(new_quarter)
 
     return new_quarter
 
 @financial_router.get("/get_quarters", response_model=List[schemas.FinancialQuartersResponse])
-async def get_all_quarters(db: Session = Depends(get_db)):
-    """Endpoint for returning all financial quarters from the database
+async def get_all_quarters(request: Request, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """Endpoint for returning all financial quarters from the database, as MessagePack or
+    columnar JSON if the Accept header asks for it
 
     Args:
+        request (Request): Its Accept header picks the response format, clients pinned to the primary skip the cache
+        fields (str, optional): Comma separated fields to return, e.g. "year,start_date". Defaults to all fields.
         db (Session, optional): Starts a database connection. Defaults to Depends(get_db).
 
     Returns:
         dict: a dictionary representation of the financial quarter data
     """
-    quarters = db.query(models.FinancialQuarters).order_by(models.FinancialQuarters.id.desc()).all()
+    selected_fields = parse_fields(fields, models.FinancialQuarters)
 
-    quarters_dict = [quarter.__dict__ for quarter in quarters]
+    if pinned_to_primary(request):
+        quarters_dict = (with_fields(db.query(models.FinancialQuarters), models.FinancialQuarters, selected_fields)
+                       .order_by(models.FinancialQuarters.id.desc()).all())
+    else:
+        quarters = reference_cache.quarters()
+        quarters_dict = [quarters[quarter_id] for quarter_id in sorted(quarters, reverse=True)]
 
-    return quarters_dict
+    return negotiated_response(request, quarters_dict, selected_fields, schemas.FinancialQuartersResponse)
 
 
 @financial_router.get("/get_quarter_id/{quarter_id}", response_model=schemas.FinancialQuartersResponse)
-async def get_quarter_by_id(quarter_id: int, db: Session = Depends(get_db)): 
+async def get_quarter_by_id(quarter_id: int, request: Request, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
     """Returns a single financial quarter based on the id provided.
 
     Args:
         quarter_id (int): A valid financial quarter id
+        request (Request): Clients pinned to the primary skip the cache
+        fields (str, optional): Comma separated fields to return. Defaults to all fields.
         db (Session, optional): Starts a database connection. Defaults to Depends(get_db).
 
     Raises:
@@ -62,10 +97,145 @@ async def get_quarter_by_id(quarter_id: int, db: Session = Depends(get_db)):
     Returns:
         json: Returns a json representation of the financial quarter with the id provided.
     """
-    quarter = db.query(models.FinancialQuarters).filter(models.FinancialQuarters.id == quarter_id).first()
-    
+    selected_fields = parse_fields(fields, models.FinancialQuarters)
+    quarter = None if pinned_to_primary(request) else reference_cache.get_quarter(quarter_id)
+
+    if quarter is None:
+        quarter = lookups.get_quarter(db, quarter_id, selected_fields)
+
     if quarter is None: 
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Financial quarter with id {quarter_id} not fund.")
     
+    return sparse_response(quarter, selected_fields)
+
+
+@financial_router.post("/get_quarters_by_ids", response_model=schemas.BatchLookupResponse[schemas.FinancialQuartersResponse])
+async def get_quarters_by_ids(lookup: schemas.BatchIdsLookup, request: Request, fields: Optional[str] = None,
+                              db: Session = Depends(get_read_db)):
+    """Returns many financial quarters at once
+
+    Args:
+        lookup (schemas.BatchIdsLookup): Up to 5000 financial quarter ids
+        request (Request): Clients pinned to the primary skip the cache
+        fields (str, optional): Comma separated fields to return. Defaults to all fields.
+        db (Session, optional): Starts a database connection. Defaults to Depends(get_read_db).
+
+    Returns:
+        json: The quarters found keyed by id, and the ids not found
+    """
+    selected_fields = parse_fields(fields, models.FinancialQuarters)
+    cached = None if pinned_to_primary(request) else reference_cache.quarters()
+
+    found, missing = batch_lookup(db, models.FinancialQuarters, "id", lookup.ids,
+                                  cached=cached, fields=selected_fields)
+
+    return batch_response(found, missing, selected_fields)
+
+
+@financial_router.get("/resolve", response_model=schemas.FinancialQuartersResponse)
+async def resolve_quarter(when: datetime = Query(alias="date")):
+    """Returns the financial quarter a date falls in.
+
+    Args:
+        when (datetime): The date (and optionally time) to look up, passed as ?date=
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if no quarter covers the date.
+
+    Returns:
+        json: Returns a json representation of the matching financial quarter.
+    """
+    quarter = quarter_index.resolve(when)
+
+    if quarter is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No financial quarter covers {when}.")
+
     return quarter
-    
\ No newline at end of file
+
+
+@financial_router.get("/current", response_model=schemas.FinancialQuartersResponse)
+async def current_quarter():
+    """Returns the financial quarter covering the current date.
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if no quarter covers today.
+
+    Returns:
+        json: Returns a json representation of the current financial quarter.
+    """
+    quarter = quarter_index.resolve(datetime.now())
+
+    if quarter is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No financial quarter covers the current date.")
+
+    return quarter
+
+
+@financial_router.post("/close_quarter/{quarter_id}", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.QuarterCloseStatus)
+async def close_financial_quarter(quarter_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """Starts closing a financial quarter, which snapshots every product's stock and price
+    into the quarter's stock history partition in the background.
+
+    Args:
+        quarter_id (int): A valid financial quarter id
+        background_tasks (BackgroundTasks): Runs the snapshot after the response is sent
+        db (Session, optional): Starts a database connection. Defaults to Depends(get_db).
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if the quarter does not exist, and a 409 error if it
+        has not ended yet, is already closed or is being closed.
+
+    Returns:
+        json: The progress of the close, poll /close_quarter/{quarter_id}/status for updates.
+    """
+    quarter = lookups.get_quarter(db, quarter_id)
+
+    if quarter is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Financial quarter with id {quarter_id} not found.")
+
+    if quarter.closed_at is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Financial quarter {quarter_id} is already closed.")
+
+    if quarter.end_date is None or quarter.end_date > datetime.now():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Financial quarter {quarter_id} has not ended yet.")
+
+    if not close_progress.start(quarter_id, estimated_product_count(db)):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Financial quarter {quarter_id} is already being closed.")
+
+    background_tasks.add_task(close_quarter, quarter_id)
+
+    return close_progress.get(quarter_id)
+
+
+@financial_router.get("/close_quarter/{quarter_id}/status", response_model=schemas.QuarterCloseStatus)
+async def get_close_status(quarter_id: int, db: Session = Depends(get_read_db)):
+    """Returns the progress of closing a financial quarter.
+
+    Args:
+        quarter_id (int): A valid financial quarter id
+        db (Session, optional): Starts a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if no quarter with that id is found.
+
+    Returns:
+        json: The progress of the close, or its outcome if it was run by another worker.
+    """
+    progress = close_progress.get(quarter_id)
+
+    if progress is not None:
+        return progress
+
+    quarter = lookups.get_quarter(db, quarter_id)
+
+    if quarter is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Financial quarter with id {quarter_id} not found.")
+
+    if quarter.closed_at is None:
+        return {"quarter_id": quarter_id, "status": "open"}
+
+    rows = db.query(models.ProductStockHistory).filter(
+        models.ProductStockHistory.financial_quarter_id == quarter_id).count()
+
+    return {"quarter_id": quarter_id, "status": "done", "phase": "done", "rows_copied": rows,
+            "finished_at": quarter.closed_at}
@@ -0,0 +1,81 @@
+"""
+Router for liveness, readiness, start-up, admission control and outbox metrics of the current worker
+"""
+
+import asyncio
+
+from fastapi import APIRouter, Response, status
+
+from app.admission import admission_controller
+from app.outbox import outbox_dispatcher
+from app.warmup import startup_metrics
+
+health_router = APIRouter(
+    prefix="/health",
+    tags=['Health']
+)
+
+
+@health_router.get("/live")
+async def live():
+    """Liveness probe, answers as soon as the worker is serving requests.
+
+    Returns:
+        json: A static status
+    """
+    return {"status": "alive"}
+
+
+@health_router.get("/ready")
+async def ready(response: Response):
+    """Readiness probe, only succeeds once the connection pool and caches are warm.
+
+    Args:
+        response (Response): Used to set a 503 status while the worker is still warming up
+
+    Returns:
+        json: The readiness flag together with the start-up timings
+    """
+    if not startup_metrics.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+
+    return startup_metrics.as_dict()
+
+
+@health_router.get("/startup")
+async def startup():
+    """Returns how long the worker took to start and to serve its first request.
+
+    Returns:
+        json: Start-up timings of the current worker
+    """
+    return startup_metrics.as_dict()
+
+
+@health_router.get("/admission")
+async def admission():
+    """Returns the admission control state: requests running, queued, admitted and shed per
+    class, and the connection pool checkout time that decides whether requests are shed.
+
+    Returns:
+        json: Admission control metrics of the current worker
+    """
+    return admission_controller.status()
+
+
+@health_router.get("/outbox")
+async def outbox(response: Response):
+    """Returns the change events delivered by this worker's outbox dispatcher and the backlog
+    left to deliver: roughly how many events wait and how old the oldest of them is.
+
+    Args:
+        response (Response): Used to set a 404 status when no dispatcher runs in this worker
+
+    Returns:
+        json: Outbox delivery metrics
+    """
+    if outbox_dispatcher is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"detail": "No outbox sink is configured."}
+
+    return await asyncio.to_thread(outbox_dispatcher.status)
@@ -0,0 +1,219 @@
+"""
+Router for stores and warehouses and the stock held at each of them
+"""
+
+from fastapi import HTTPException, Depends, Query, Request, status, APIRouter
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from typing import List
+
+import app.schemas as schemas
+import app.models as models
+import app.lookups as lookups
+from app.databaseConnection import get_db, get_read_db
+from app.encoding import negotiated_response
+from app.stock import APPLIED, LOCATION_NOT_FOUND, NOT_FOUND, adjust_stock
+
+location_router = APIRouter(
+    prefix="/locations",
+    tags=['Locations']
+)
+
+
+def get_location_or_404(db: Session, location_id: int):
+    location = lookups.get_location(db, location_id)
+
+    if not location:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Location with ID {location_id} not found.")
+
+    return location
+
+
+@location_router.post("/add_location", status_code=status.HTTP_201_CREATED, response_model=schemas.LocationResponse)
+async def add_location(location_data: schemas.AddLocation, db: Session = Depends(get_db)):
+    """End point for adding a new store or warehouse
+
+    Args:
+        location_data (schemas.AddLocation): Code, name and type of the location
+        db (Session, optional): Starts a database connection. Defaults to Depends(get_db).
+
+    Raises:
+        HTTPException: Returns a 409 error if the location code already exists.
+
+    Returns:
+        json: Returns a json representation of the location entered
+    """
+    if lookups.location_code_exists(db, location_data.code):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"A location with code {location_data.code} already exists.")
+
+    new_location = models.Locations(**location_data.model_dump(mode="json"))
+
+    db.add(new_location)
+    db.commit()
+    db.refresh(new_location)
+
+    return new_location
+
+
+@location_router.get("/get_locations", response_model=List[schemas.LocationResponse])
+async def get_all_locations(db: Session = Depends(get_read_db)):
+    """Returns all locations
+
+    Args:
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Returns:
+        json: A list of all locations
+    """
+    return db.query(models.Locations).order_by(models.Locations.id).all()
+
+
+@location_router.get("/get_stock/{location_id}", response_model=List[schemas.LocationStockResponse])
+async def get_location_stock(location_id: int, request: Request, skip: int = Query(0, ge=0),
+                             limit: int = Query(1000, ge=1, le=10000), db: Session = Depends(get_read_db)):
+    """Returns the stock of every product held at a location, in product order. Sent as
+    MessagePack or columnar JSON when the Accept header asks for it.
+
+    Args:
+        location_id (int): ID associated with a location
+        request (Request): Its Accept header picks the response format
+        skip (int, optional): Number of products to skip. Defaults to 0.
+        limit (int, optional): Maximum number of products to return. Defaults to 1000.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Raises a 404 error if the location does not exist.
+
+    Returns:
+        json: Stock level and reorder level of each product at the location
+    """
+    get_location_or_404(db, location_id)
+
+    stock = db.query(models.LocationStock).filter(models.LocationStock.location_id == location_id) \
+        .order_by(models.LocationStock.product_id).offset(skip).limit(limit).all()
+
+    return negotiated_response(request, stock, None, schemas.LocationStockResponse)
+
+
+@location_router.get("/product_stock/{product_id}", response_model=List[schemas.LocationStockResponse])
+async def get_product_stock_by_location(product_id: int, db: Session = Depends(get_read_db)):
+    """Returns where a product is held and how much of it at each location
+
+    Args:
+        product_id (int): ID associated with a product
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Raises a 404 error if the product does not exist.
+
+    Returns:
+        json: The product's stock at each location holding a row for it
+    """
+    if not lookups.get_product(db, product_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {product_id} not found.")
+
+    return db.query(models.LocationStock).filter(models.LocationStock.product_id == product_id) \
+        .order_by(models.LocationStock.location_id).all()
+
+
+@location_router.get("/reorder/{location_id}", response_model=List[schemas.LocationReorderResponse])
+async def get_location_reorder(location_id: int, headroom: int = Query(0, ge=0), skip: int = Query(0, ge=0),
+                               limit: int = Query(1000, ge=1, le=10000), db: Session = Depends(get_read_db)):
+    """Returns the products of a location at most ``headroom`` units above their reorder level
+    there, the ones with the least headroom first.
+
+    Args:
+        location_id (int): ID associated with a location
+        headroom (int, optional): Units above the reorder level still included. Defaults to 0.
+        skip (int, optional): Number of products to skip. Defaults to 0.
+        limit (int, optional): Maximum number of products to return. Defaults to 1000.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Raises a 404 error if the location does not exist.
+
+    Returns:
+        json: The products to reorder for the location
+    """
+    get_location_or_404(db, location_id)
+
+    # Matches ix_location_stock_headroom, so only the qualifying rows of the location are read
+    rows = db.execute(text(
+        "SELECT ls.location_id, ls.product_id, p.product_code, p.product_name, ls.stock_count, ls.reorder_level, "
+        "ls.stock_count - ls.reorder_level AS headroom "
+        "FROM location_stock ls JOIN products p ON p.id = ls.product_id "
+        "WHERE ls.location_id = :location_id AND ls.stock_count - ls.reorder_level <= :headroom "
+        "ORDER BY ls.stock_count - ls.reorder_level, ls.product_id "
+        "OFFSET :skip LIMIT :limit"
+    ), {"location_id": location_id, "headroom": headroom, "skip": skip, "limit": limit}).mappings().all()
+
+    return rows
+
+
+@location_router.post("/adjust_stock/{location_id}/{product_id}", response_model=schemas.LocationStockLevelResponse)
+async def adjust_location_stock(location_id: int, product_id: int, adjustment: schemas.StockAdjustment):
+    """End point for adding or taking out stock at one location, e.g. for a sale in a store.
+    The product's total stock changes with it.
+
+    Args:
+        location_id (int): ID associated with a location
+        product_id (int): ID associated with a product
+        adjustment (schemas.StockAdjustment): The number of units to add (or remove, when negative)
+
+    Raises:
+        HTTPException: Raises a 404 error if the product or location does not exist, and a 409 error
+        if the stock at the location would fall below zero or the product's total below its reorder level.
+
+    Returns:
+        json: The product's stock at the location and in total after the adjustment
+    """
+    result = await adjust_stock(product_id, adjustment.delta, location_id)
+
+    if result["outcome"] == NOT_FOUND:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {product_id} not found.")
+
+    if result["outcome"] == LOCATION_NOT_FOUND:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Location with ID {location_id} not found.")
+
+    if result["outcome"] != APPLIED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"Cannot adjust stock by {adjustment.delta}, {result['location_stock_count']} "
+                                   f"at the location and {result['stock_count']} in total "
+                                   f"({result['outcome'].replace('_', ' ')}).")
+
+    return result
+
+
+@location_router.put("/set_reorder_level/{location_id}/{product_id}", response_model=schemas.LocationStockResponse)
+async def set_location_reorder_level(location_id: int, product_id: int, reorder: schemas.LocationReorderLevel,
+                                     db: Session = Depends(get_db)):
+    """Sets the level below which a product should be reordered for one location
+
+    Args:
+        location_id (int): ID associated with a location
+        product_id (int): ID associated with a product
+        reorder (schemas.LocationReorderLevel): The new reorder level
+        db (Session, optional): Starts a database connection. Defaults to Depends(get_db).
+
+    Raises:
+        HTTPException: Raises a 404 error if the product or location does not exist.
+
+    Returns:
+        json: The product's stock and reorder level at the location
+    """
+    get_location_or_404(db, location_id)
+
+    if not lookups.get_product(db, product_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {product_id} not found.")
+
+    # Only the reorder level changes, so the stock totals are not involved
+    row = db.execute(text(
+        "INSERT INTO location_stock (location_id, product_id, reorder_level) "
+        "VALUES (:location_id, :product_id, :reorder_level) "
+        "ON CONFLICT (location_id, product_id) DO UPDATE SET reorder_level = EXCLUDED.reorder_level, updated_at = now() "
+        "RETURNING location_id, product_id, stock_count, reorder_level, updated_at"
+    ), {"location_id": location_id, "product_id": product_id, "reorder_level": reorder.reorder_level}).mappings().one()
+    db.commit()
+
+    return row
@@ -1,10 +1,23 @@
-from fastapi import HTTPException, Depends, status, APIRouter
+"""
+Router for managing products
+"""
+
+from datetime import datetime
+from fastapi import HTTPException, Depends, Query, Request, status, APIRouter
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 import app.schemas as schemas
 import app.models as models
-from app.databaseConnection import get_db
+import app.lookups as lookups
+from app.catalogue_snapshot import lookup as snapshot_lookup
+from app.category_tree import subtree_filter
+from app.databaseConnection import get_db, get_read_db, pinned_to_primary
+from app.encoding import negotiated_response
+from app.quarter_index import quarter_index
+from app.stock import APPLIED, NOT_FOUND, adjust_stock
+from app.utils import batch_lookup, batch_response, parse_fields, sparse_response, with_fields
 
 products_router = APIRouter(
     prefix="/products",
@@ -13,9 +26,283 @@ products_router = APIRouter(
 
 
 @products_router.post("/add_products", status_code=status.HTTP_201_CREATED, response_model=schemas.ProductsResponse)
-async def add_product(product_data: schemas.AddProducts, db: Session = Depends(get_db)): 
-    new_products = models.Products(**product_data.model_dump())
-    
-    db.add(new_products)
+async def add_product(product_data: schemas.AddProducts, request: Request, db: Session = Depends(get_db)):
+    """End point for adding a new product
+
+    Args:
+        product_data (schemas.AddProducts): Product data provided by the user, the financial quarter
+        defaults to the quarter covering the current date
+        request (Request): Clients pinned to the primary have the quarter looked up in the database
+        db (Session, optional): Starts a database connection. Defaults to Depends(get_db).
+
+    Raises:
+        HTTPException: Returns a 409 error if the product code already exists, a 400 error if no
+        financial quarter was given and none covers the current date, and a 422 error if the
+        barcode type cannot be stored.
+
+    Returns:
+        json: Returns a json representation of the product entered
+    """
+    if lookups.product_code_exists(db, product_data.product_code):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"A product with code {product_data.product_code} already exists.")
+
+    product = product_data.model_dump()
+
+    if product["financial_quarter_id"] is None:
+        # A quarter this client just added through another worker may not be in this worker's index yet
+        if pinned_to_primary(request):
+            quarter = lookups.get_quarter_covering(db, datetime.now())
+            quarter_id = quarter.id if quarter is not None else None
+        else:
+            quarter = quarter_index.resolve(datetime.now())
+            quarter_id = quarter["id"] if quarter is not None else None
+
+        if quarter_id is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="No financial quarter covers the current date, provide financial_quarter_id.")
+
+        product["financial_quarter_id"] = quarter_id
+
+    try:
+        product["barcode_type"] = models.BarcodeType(product_data.barcode_type.value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"Barcode type {product_data.barcode_type.value} is not supported yet.")
+
+    new_product = models.Products(**product)
+
+    db.add(new_product)
     db.commit()
-    db.refresh(new_products)
+    db.refresh(new_product)
+
+    return new_product
+
+
+@products_router.get("/get_products", response_model=List[schemas.ProductsResponse])
+async def get_all_products(request: Request, category_id: Optional[int] = None, include_subcategories: bool = False,
+                           fields: Optional[str] = None, skip: int = Query(0, ge=0),
+                           limit: int = Query(100, ge=1, le=10000), db: Session = Depends(get_read_db)):
+    """Returns a page of products, newest first. Sent as MessagePack or columnar JSON when
+    the Accept header asks for application/msgpack or application/vnd.inventory.columnar+json.
+
+    Args:
+        request (Request): Its Accept header picks the response format
+        category_id (int, optional): Only return products of this category. Defaults to None.
+        include_subcategories (bool, optional): Also return the products of the category's
+        subcategories at any depth. Defaults to False.
+        fields (str, optional): Comma separated fields to return, e.g. "product_code,product_name".
+        Only these columns are selected from the database. Defaults to all fields.
+        skip (int, optional): Number of products to skip. Defaults to 0.
+        limit (int, optional): Maximum number of products to return. Defaults to 100.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Returns:
+        json: Returns a json representation of the products
+    """
+    selected_fields = parse_fields(fields, models.Products)
+    products_query = with_fields(db.query(models.Products), models.Products, selected_fields)
+
+    if category_id is not None and include_subcategories:
+        # One query: the subtree is a range of the category path index, joined through ix_products_category
+        subtree = subtree_filter(db, models.Products.category_id, category_id)
+        if subtree is None:
+            return negotiated_response(request, [], selected_fields, schemas.ProductsResponse)
+        products_query = products_query.filter(subtree)
+    elif category_id is not None:
+        products_query = products_query.filter(models.Products.category_id == category_id)
+
+    products = products_query.order_by(models.Products.id.desc()).offset(skip).limit(limit).all()
+
+    return negotiated_response(request, products, selected_fields, schemas.ProductsResponse)
+
+
+@products_router.get("/get_product_by_id/{product_id}", response_model=schemas.ProductsResponse)
+async def get_product_by_id(product_id: int, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """Returns a single product based on the id provided
+
+    Args:
+        product_id (int): ID associated with a product
+        fields (str, optional): Comma separated fields to return. Defaults to all fields.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if no product has the id provided
+
+    Returns:
+        json: Returns a json representation of the product
+    """
+    selected_fields = parse_fields(fields, models.Products)
+    product = lookups.get_product(db, product_id, selected_fields)
+
+    if product is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {product_id} not found.")
+
+    return sparse_response(product, selected_fields)
+
+
+@products_router.post("/get_products_by_ids", response_model=schemas.BatchLookupResponse[schemas.ProductsResponse])
+async def get_products_by_ids(lookup: schemas.BatchLookup, fields: Optional[str] = None,
+                              db: Session = Depends(get_read_db)):
+    """Returns many products at once, looked up either by id or by product code, in a single query
+
+    Args:
+        lookup (schemas.BatchLookup): Up to 5000 product ids or product codes
+        fields (str, optional): Comma separated fields to return. Defaults to all fields.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Returns:
+        json: The products found keyed by the id or code requested, and the ids or codes not found
+    """
+    selected_fields = parse_fields(fields, models.Products)
+
+    if lookup.codes:
+        found, missing = batch_lookup(db, models.Products, "product_code", lookup.codes, fields=selected_fields)
+    else:
+        found, missing = batch_lookup(db, models.Products, "id", lookup.ids, fields=selected_fields)
+
+    return batch_response(found, missing, selected_fields)
+
+
+@products_router.get("/lookup_barcode/{barcode}", response_model=schemas.CatalogueEntry)
+async def lookup_barcode(barcode: str):
+    """Returns the price, stock and current discount of the product with a barcode, e.g. for a till.
+    Served from the shared catalogue snapshot when enabled: prices, discounts, barcodes and product
+    names there lag writes by about a second, stock_count and category codes by up to
+    CATALOGUE_SNAPSHOT_MAX_AGE_SECONDS (300 by default).
+
+    Args:
+        barcode (str): The product's barcode
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if no product has the barcode
+
+    Returns:
+        json: The product's catalogue entry
+    """
+    entry = snapshot_lookup(barcode=barcode)
+
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No product with barcode {barcode} was found.")
+
+    return entry
+
+
+@products_router.get("/get_price/{product_id}", response_model=schemas.CatalogueEntry)
+async def get_product_price(product_id: int):
+    """Returns the price, stock and current discount of a product. Served from the shared
+    catalogue snapshot when enabled: prices, discounts, barcodes and product names there lag
+    writes by about a second, stock_count and category codes by up to
+    CATALOGUE_SNAPSHOT_MAX_AGE_SECONDS (300 by default).
+
+    Args:
+        product_id (int): ID associated with a product
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if the product does not exist
+
+    Returns:
+        json: The product's catalogue entry
+    """
+    entry = snapshot_lookup(product_id=product_id)
+
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {product_id} not found.")
+
+    return entry
+
+
+# One index probe of product_price_history per key: the GiST index matches product_id = key
+# together with valid_during @> at, which it could not do for product_id = ANY(keys)
+PRICES_AT_BY_ID = """
+SELECT keys.key, h.product_id, h.selling_price, lower(h.valid_during) AS valid_from, upper(h.valid_during) AS valid_to
+FROM unnest(CAST(:keys AS integer[])) AS keys(key)
+JOIN product_price_history h ON h.product_id = keys.key AND h.valid_during @> CAST(:at AS timestamptz)
+"""
+
+PRICES_AT_BY_CODE = """
+SELECT keys.key, h.product_id, h.selling_price, lower(h.valid_during) AS valid_from, upper(h.valid_during) AS valid_to
+FROM unnest(CAST(:keys AS text[])) AS keys(key)
+JOIN products p ON p.product_code = keys.key
+JOIN product_price_history h ON h.product_id = p.id AND h.valid_during @> CAST(:at AS timestamptz)
+"""
+
+
+@products_router.post("/prices_at", response_model=schemas.BatchLookupResponse[schemas.HistoricPrice])
+async def get_prices_at(lookup: schemas.PricesAtLookup, db: Session = Depends(get_read_db)):
+    """Returns the selling prices many products had at one point in time, e.g. to price past
+    sales, looked up either by id or by product code in a single query
+
+    Args:
+        lookup (schemas.PricesAtLookup): Up to 5000 product ids or product codes, and the point in
+            time. Times without a time zone are taken in the database's time zone.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Returns:
+        json: The prices found keyed by the id or code requested, and the ids or codes of products
+        that did not exist or have no recorded price at that time
+    """
+    keys = list(dict.fromkeys(lookup.codes or lookup.ids))
+    query = PRICES_AT_BY_CODE if lookup.codes else PRICES_AT_BY_ID
+
+    rows = db.execute(text(query), {"keys": keys, "at": lookup.at}).mappings().all()
+    found = {str(row["key"]): row for row in rows}
+    missing = [key for key in keys if str(key) not in found]
+
+    return {"found": found, "missing": missing}
+
+
+@products_router.get("/price_history/{product_id}", response_model=List[schemas.HistoricPrice])
+async def get_price_history(product_id: int, db: Session = Depends(get_read_db)):
+    """Returns every selling price a product has had, oldest first
+
+    Args:
+        product_id (int): ID associated with a product
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if the product does not exist
+
+    Returns:
+        json: The product's prices and the time range each applied during, the current one open ended
+    """
+    if not lookups.get_product(db, product_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {product_id} not found.")
+
+    # Prices replaced within the same transaction leave empty ranges, they never applied
+    return db.execute(text(
+        "SELECT product_id, selling_price, lower(valid_during) AS valid_from, upper(valid_during) AS valid_to "
+        "FROM product_price_history WHERE product_id = :product_id AND NOT isempty(valid_during) "
+        "ORDER BY lower(valid_during)"
+    ), {"product_id": product_id}).mappings().all()
+
+
+@products_router.post("/adjust_stock/{product_id}", response_model=schemas.StockLevelResponse)
+async def adjust_product_stock(product_id: int, adjustment: schemas.StockAdjustment):
+    """End point for adding or taking out stock, e.g. for a sale, at the default location (see
+    /locations/adjust_stock for other locations). When stock coalescing is enabled, concurrent
+    adjustments are written together in one transaction.
+
+    Args:
+        product_id (int): ID associated with a product
+        adjustment (schemas.StockAdjustment): The number of units to add (or remove, when negative)
+
+    Raises:
+        HTTPException: Rases a 404 HTTP error if the product does not exist, and a 409 error if the
+        stock at the default location would fall below zero or the total below the product's reorder level.
+
+    Returns:
+        json: The product's stock level after the adjustment
+    """
+    result = await adjust_stock(product_id, adjustment.delta)
+
+    if result["outcome"] == NOT_FOUND:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {product_id} not found.")
+
+    if result["outcome"] != APPLIED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"Cannot adjust stock by {adjustment.delta}, {result['location_stock_count']} "
+                                   f"at the default location and {result['stock_count']} in total "
+                                   f"({result['outcome'].replace('_', ' ')}).")
+
+    return result
@@ -0,0 +1,175 @@
+"""
+Router for reports on historic (closed) financial quarters, and for heavy reports run as
+background jobs
+"""
+
+import gzip
+
+from fastapi import HTTPException, Depends, Query, Request, Response, status, APIRouter
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from typing import List, Optional
+
+import app.schemas as schemas
+import app.models as models
+from app.category_tree import subtree_filter
+from app.databaseConnection import get_db, get_read_db
+from app.encoding import accepts_encoding, negotiated_response
+from app.report_jobs import COMPLETED, create_job, report_job_runner
+from app.reports import REPORT_PARAMETERS
+
+reports_router = APIRouter(
+    prefix="/reports",
+    tags=['Reports']
+)
+
+
+@reports_router.get("/quarter_snapshot/{quarter_id}", response_model=List[schemas.ProductStockHistoryResponse])
+async def get_quarter_snapshot(quarter_id: int, request: Request, category_id: Optional[int] = None,
+                               include_subcategories: bool = False, skip: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=10000),
+                               db: Session = Depends(get_read_db)):
+    """Returns the stock and prices of products as they were when a financial quarter was closed.
+    Only the quarter's partition of the stock history is read. Sent as MessagePack or columnar
+    JSON when the Accept header asks for it.
+
+    Args:
+        quarter_id (int): A closed financial quarter
+        request (Request): Its Accept header picks the response format
+        category_id (int, optional): Only return products of this category. Defaults to None.
+        include_subcategories (bool, optional): Also return the products snapshotted in one of the
+        category's current subcategories. Defaults to False.
+        skip (int, optional): Number of products to skip. Defaults to 0.
+        limit (int, optional): Maximum number of products to return. Defaults to 1000.
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Returns:
+        json: The snapshotted products, ordered by product id
+    """
+    snapshot_query = db.query(models.ProductStockHistory).filter(
+        models.ProductStockHistory.financial_quarter_id == quarter_id)
+
+    if category_id is not None and include_subcategories:
+        subtree = subtree_filter(db, models.ProductStockHistory.category_id, category_id)
+        if subtree is None:
+            return negotiated_response(request, [], None, schemas.ProductStockHistoryResponse)
+        snapshot_query = snapshot_query.filter(subtree)
+    elif category_id is not None:
+        snapshot_query = snapshot_query.filter(models.ProductStockHistory.category_id == category_id)
+
+    snapshot = snapshot_query.order_by(models.ProductStockHistory.product_id).offset(skip).limit(limit).all()
+
+    return negotiated_response(request, snapshot, None, schemas.ProductStockHistoryResponse)
+
+
+@reports_router.get("/quarter_comparison", response_model=List[schemas.QuarterComparisonResponse])
+async def compare_quarters(base_quarter_id: int, compare_quarter_id: int, db: Session = Depends(get_read_db)):
+    """Compares closing stock units and value per category between two closed quarters,
+    e.g. the same quarter of two years. Only the two quarters' partitions are read.
+
+    Args:
+        base_quarter_id (int): The quarter to compare against
+        compare_quarter_id (int): The quarter being compared
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Raises a 400 error if both quarter ids are the same
+
+    Returns:
+        json: Units and value per category for both quarters
+    """
+    if base_quarter_id == compare_quarter_id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Choose two different quarters to compare.")
+
+    rows = db.execute(text(
+        "SELECT category_id, "
+        "COALESCE(SUM(stock_count) FILTER (WHERE financial_quarter_id = :base), 0) AS base_units, "
+        "COALESCE(SUM(stock_count * selling_price) FILTER (WHERE financial_quarter_id = :base), 0) AS base_value, "
+        "COALESCE(SUM(stock_count) FILTER (WHERE financial_quarter_id = :compare), 0) AS compare_units, "
+        "COALESCE(SUM(stock_count * selling_price) FILTER (WHERE financial_quarter_id = :compare), 0) AS compare_value "
+        "FROM product_stock_history WHERE financial_quarter_id IN (:base, :compare) "
+        "GROUP BY category_id ORDER BY category_id"
+    ), {"base": base_quarter_id, "compare": compare_quarter_id}).mappings().all()
+
+    return rows
+
+
+@reports_router.post("/jobs", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.ReportJobResponse)
+async def request_report(report: schemas.ReportJobRequest, response: Response, db: Session = Depends(get_db)):
+    """Queues a report to be computed in the background. Requesting a report with the same
+    parameters as a queued or running one returns that job instead of starting another.
+
+    Args:
+        report (schemas.ReportJobRequest): The report and its parameters
+        response (Response): Used to set the Location header of the job
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_db).
+
+    Returns:
+        json: The job, poll it until its status is completed or failed
+    """
+    params = report.model_dump(mode="json", include=set(REPORT_PARAMETERS[report.report_type.value]))
+    job, created = create_job(db, report.report_type.value, params)
+
+    if created:
+        report_job_runner.submit(job.id)
+
+    response.headers["Location"] = f"/reports/jobs/{job.id}"
+    return job
+
+
+def get_job_or_404(db: Session, job_id: int) -> models.ReportJobs:
+    job = db.get(models.ReportJobs, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Report job with id {job_id} was not found.")
+    return job
+
+
+@reports_router.get("/jobs/{job_id}", response_model=schemas.ReportJobResponse)
+async def get_report_job(job_id: int, db: Session = Depends(get_read_db)):
+    """Returns the status of a report job.
+
+    Args:
+        job_id (int): The report job
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Raises a 404 error if the job does not exist
+
+    Returns:
+        json: The job's status, and its error if it failed
+    """
+    return get_job_or_404(db, job_id)
+
+
+@reports_router.get("/jobs/{job_id}/download")
+async def download_report(job_id: int, request: Request, db: Session = Depends(get_read_db)):
+    """Downloads the result of a completed report job as JSON. The stored result is already
+    gzipped and is sent as is to clients accepting gzip.
+
+    Args:
+        job_id (int): The report job
+        request (Request): Used to check whether the client accepts gzip
+        db (Session, optional): Stores a database connection. Defaults to Depends(get_read_db).
+
+    Raises:
+        HTTPException: Raises a 404 error if the job does not exist
+        HTTPException: Raises a 409 error if the job has not completed
+
+    Returns:
+        json: The report and its rows
+    """
+    job = get_job_or_404(db, job_id)
+
+    if job.status != COMPLETED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"Report job {job_id} is {job.status}, it has no result to download.")
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="{job.report_type}_report_{job.id}.json"',
+        "Vary": "Accept-Encoding",
+    }
+
+    if accepts_encoding(request.headers.get("accept-encoding"), "gzip"):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=job.result, media_type="application/json", headers=headers)
+
+    return Response(content=gzip.decompress(job.result), media_type="application/json", headers=headers)
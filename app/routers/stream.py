@@ -0,0 +1,53 @@
+"""
+Router streaming stock, price and discount changes as server-sent events
+"""
+
+import asyncio
+import json
+from fastapi import APIRouter
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from app.change_stream import change_broker, change_listener
+from app.config import settings
+
+stream_router = APIRouter(
+    prefix="/stream",
+    tags=['Stream']
+)
+
+
+@stream_router.get("/changes")
+async def stream_changes(category_id: Optional[int] = None):
+    """Streams product stock and price changes and discount changes as server-sent events.
+    Bursts of changes to the same row are coalesced into its latest state, and a comment
+    line is sent as keep-alive when nothing changed for a while.
+
+    Args:
+        category_id (int, optional): Only stream changes to products of this category. Defaults to None.
+
+    Returns:
+        StreamingResponse: A text/event-stream with one event per changed row, named after its table
+    """
+    change_listener.start(asyncio.get_running_loop())
+    subscriber = change_broker.subscribe(category_id)
+    coalesce_seconds = settings.change_stream_coalesce_ms / 1000
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while True:
+                batch = await subscriber.next_batch(coalesce_seconds, settings.change_stream_keepalive_seconds)
+
+                if not batch:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield "".join(f"event: {change['table']}\ndata: {json.dumps(jsonable_encoder(change))}\n\n"
+                              for change in batch)
+        finally:
+            change_broker.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
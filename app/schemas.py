@@ -1,7 +1,7 @@
 from ast import pattern
-from pydantic import BaseModel, EmailStr, ValidationError, field_validator
+from pydantic import BaseModel, EmailStr, Field, ValidationError, ValidationInfo, field_validator, model_validator
 from datetime import datetime
-from typing import Any, Optional, List
+from typing import Any, ClassVar, Dict, Generic, Optional, List, TypeVar, Union
 from enum import Enum
 import re
 
@@ -34,11 +34,28 @@ class FinancialQuartersResponse(FinancialQuartersBase):
     """
     id: int
     date_created: datetime
+    closed_at: Optional[datetime] = None
     
      # Indicates that the schema should populate its fields from ORM model attributes.
     class Config:
         form_attribute = True
 
+class QuarterCloseStatus(BaseModel):
+    """Schema reporting the progress of closing a financial quarter.
+
+    Args:
+        BaseModel (base schema): The pydantic base model all other models inherit from
+    """
+    quarter_id: int
+    status: str
+    phase: Optional[str] = None
+    expected_rows: Optional[int] = None
+    rows_copied: Optional[int] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    elapsed_seconds: Optional[float] = None
+    error: Optional[str] = None
+
 #----------------------- Products Schemas -----------------------
 class ProductCategoryBase(BaseModel):
     """Base schema for validating product category data.
@@ -49,6 +66,8 @@ class ProductCategoryBase(BaseModel):
     code: str
     category: str
     description: Optional[str] = None
+    # None for a root category
+    parent_id: Optional[int] = None
 
 class AddProductCategory(ProductCategoryBase):
     """Schema for adding a new product category to the database.
@@ -66,6 +85,7 @@ class ProductCategoryResponse(ProductCategoryBase):
         attributes for product categories
     """
     id: int
+    path: str
     date_created: datetime
     date_updated: Optional[datetime]
     
@@ -90,8 +110,9 @@ class ProductsBase(BaseModel):
     """
     product_code: str
     product_name: str
-    barcode: str
+    # barcode_type comes first so it is available when the barcode is validated
     barcode_type: BarcodeType
+    barcode: str
     description: str
     category_id: int
     selling_price: float
@@ -100,7 +121,7 @@ class ProductsBase(BaseModel):
     financial_quarter_id: int
     
     # Validation patterns for each barcode type
-    VALIDATION_PATTERNS = {
+    VALIDATION_PATTERNS: ClassVar[dict] = {
         BarcodeType.upc: r'^\d{12}$',
         BarcodeType.ean_13: r'^\d{13}', 
         BarcodeType.ean_8: r'^\d{8}', 
@@ -110,7 +131,7 @@ class ProductsBase(BaseModel):
         BarcodeType.code_39: r'^[A-Z0-9\-\.\$\/\+\%\s]+$'
     }
     
-    ERROR_MESSAGES ={
+    ERROR_MESSAGES: ClassVar[dict] = {
         BarcodeType.upc: "UPC must be exactly 12 digits", 
         BarcodeType.ean_13: "EAN-13 must be exactly 13 digits", 
         BarcodeType.ean_8: "EAN-8 must be exactly 8 digits", 
@@ -129,9 +150,9 @@ class ProductsBase(BaseModel):
         return value.strip()
     
     @field_validator("barcode", mode="after")
-    def validate_barcode_with_type(cls, value: str, values: dict[str, Any]) -> str:
+    def validate_barcode_with_type(cls, value: str, info: ValidationInfo) -> str:
         """Validate the barcode based on its type."""
-        barcode_type = values.get("barcode_type")
+        barcode_type = info.data.get("barcode_type")
         if not barcode_type:
             raise ValueError("Barcode type is required for validation.")
         
@@ -152,7 +173,7 @@ class ProductsBase(BaseModel):
         def calculate_check_digit(digits: str) -> int:
             total = 0 
             for i, digit in enumerate(digits[:-1]):
-                multiplier = 3 if i % 2 == (0 if barcode_type == BarcodeType.ean_13 else 1) else 1
+                multiplier = 3 if i % 2 == (1 if barcode_type == BarcodeType.ean_13 else 0) else 1
                 total += int(digit) * multiplier
             return (10 - (total % 10)) % 10 
         
@@ -162,11 +183,12 @@ class ProductsBase(BaseModel):
 
 class AddProducts(ProductsBase):
     """Schema used for adding new product records to the database.
+    When no financial quarter is given the product is stamped with the current quarter.
 
     Args:
         ProductsBase (pydantic schema): The base schema containing shared product attributes.
     """
-    pass
+    financial_quarter_id: Optional[int] = None
 
 class ProductsResponse(ProductsBase):
     """Schema for API responses related to products.
@@ -175,13 +197,97 @@ class ProductsResponse(ProductsBase):
         ProductsBase (pydantic model): The base schema containing shared product attributes.
     """
     id: int
+    suggested_reorder_level: Optional[int] = None
     date_added: datetime
     date_modified: Optional[datetime] = None
 
+    @field_validator("barcode_type", mode="before")
+    def barcode_type_from_model(cls, value: Any) -> Any:
+        """Accept the database model's barcode type enum by its value."""
+        return value.value if isinstance(value, Enum) else value
+
     class Config:
         form_attribute = True
 
 
+class StockAdjustment(BaseModel):
+    """Schema for changing a product's stock level.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    delta: int = Field(description="Units to add, negative for units sold or removed")
+
+    @field_validator("delta")
+    def validate_delta(cls, value: int) -> int:
+        """A stock adjustment has to change something."""
+        if value == 0:
+            raise ValueError("delta cannot be zero")
+        return value
+
+class StockLevelResponse(BaseModel):
+    """Schema for a product's stock level after an adjustment.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    product_id: int
+    stock_count: int
+
+class CatalogueEntry(BaseModel):
+    """Schema for a product's price, stock and current discount, as served by barcode and price lookups.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    product_id: int
+    product_code: str
+    product_name: str
+    barcode: str
+    category_id: int
+    category_code: Optional[str] = None
+    selling_price: float
+    stock_count: int
+    reorder_level: int
+    discount_type: Optional[str] = None
+    discount_value: Optional[float] = None
+    discounted_price: float
+    # "snapshot" when served from the shared catalogue snapshot, "database" otherwise
+    source: str
+    snapshot_version: Optional[int] = None
+
+class ProductStockHistoryResponse(BaseModel):
+    """Schema for a product's stock and price as frozen when a financial quarter was closed.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    financial_quarter_id: int
+    product_id: int
+    product_code: str
+    product_name: str
+    category_id: int
+    selling_price: float
+    stock_count: int
+    reorder_level: int
+    snapshot_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class QuarterComparisonResponse(BaseModel):
+    """Schema comparing the closing stock of one category between two financial quarters.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    category_id: int
+    base_units: int
+    base_value: float
+    compare_units: int
+    compare_value: float
+
+
 class DiscountType(str, Enum):
     """Enum representing the types of discounts.
 
@@ -209,6 +315,200 @@ class ProductDiscountsBase(BaseModel):
 
 
 
+#----------------------- Batch Lookup Schemas -----------------------
+# Largest number of ids or codes accepted by one batch lookup
+MAX_BATCH_LOOKUP = 5000
+
+T = TypeVar("T")
+
+class BatchIdsLookup(BaseModel):
+    """Schema for looking up many records by id in a single request.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    ids: List[int] = Field(default_factory=list, max_length=MAX_BATCH_LOOKUP)
+
+class BatchLookup(BatchIdsLookup):
+    """Schema for looking up many records either by id or by code in a single request.
+
+    Args:
+        BatchIdsLookup (pydantic schema): The schema providing the ids attribute
+    """
+    codes: List[str] = Field(default_factory=list, max_length=MAX_BATCH_LOOKUP)
+
+    @model_validator(mode="after")
+    def check_ids_or_codes(self):
+        """Only one kind of key can be looked up per request."""
+        if self.ids and self.codes:
+            raise ValueError("Provide either ids or codes, not both.")
+        return self
+
+class BatchLookupResponse(BaseModel, Generic[T]):
+    """Schema for batch lookup responses.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+        Generic (T): The response schema of the records looked up
+    """
+    found: Dict[str, T]
+    missing: List[Union[int, str]]
+
+class PricesAtLookup(BatchLookup):
+    """Schema for looking up the prices of many products at one point in time.
+
+    Args:
+        BatchLookup (pydantic schema): The schema providing the ids and codes attributes
+    """
+    at: datetime
+
+class HistoricPrice(BaseModel):
+    """Schema for a selling price a product had and the time range it applied during.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    product_id: int
+    selling_price: float
+    valid_from: datetime
+    valid_to: Optional[datetime] = None
+
+
+#----------------------- Location Schemas -----------------------
+class LocationType(str, Enum):
+    """Kinds of locations holding stock"""
+    store = "Store"
+    warehouse = "Warehouse"
+
+class LocationBase(BaseModel):
+    """Base schema for stores and warehouses.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    code: str = Field(max_length=10)
+    name: str = Field(max_length=150)
+    location_type: LocationType
+
+class AddLocation(LocationBase):
+    """Schema for adding a new location.
+
+    Args:
+        LocationBase (pydantic schema): The base schema containing shared attributes.
+    """
+    pass
+
+class LocationResponse(LocationBase):
+    """Schema for API responses related to locations.
+
+    Args:
+        LocationBase (pydantic schema): The base schema containing shared attributes.
+    """
+    id: int
+    is_default: bool
+    date_created: datetime
+
+    class Config:
+        from_attributes = True
+
+class LocationStockResponse(BaseModel):
+    """Schema for the stock of a product at one location.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    location_id: int
+    product_id: int
+    stock_count: int
+    reorder_level: int
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class LocationStockLevelResponse(BaseModel):
+    """Schema for a product's stock at a location, and its total, after an adjustment.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    location_id: int
+    product_id: int
+    location_stock_count: int
+    stock_count: int
+
+class LocationReorderLevel(BaseModel):
+    """Schema for setting a product's reorder level at one location.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    reorder_level: int = Field(ge=0)
+
+class LocationReorderResponse(BaseModel):
+    """Schema for a product close to (or below) its reorder level at a location.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    location_id: int
+    product_id: int
+    product_code: str
+    product_name: str
+    stock_count: int
+    reorder_level: int
+    headroom: int
+
+
+#----------------------- Report Job Schemas -----------------------
+class ReportType(str, Enum):
+    """Reports that can be computed as background jobs"""
+    VALUATION = "valuation"
+    REORDER = "reorder"
+    DISCOUNT_IMPACT = "discount_impact"
+
+class ReportJobRequest(BaseModel):
+    """Schema for requesting a report job.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    report_type: ReportType
+    year: Optional[int] = Field(default=None, ge=1900, le=9999)
+    category_id: Optional[int] = None
+    # Also include the products of the category's subcategories
+    include_subcategories: bool = False
+    # Reorder report only: include products with at most this many units above their reorder level
+    headroom: int = Field(default=0, ge=0)
+
+    @model_validator(mode="after")
+    def check_year(self):
+        """Valuation and discount impact reports cover the quarters of one year."""
+        if self.report_type != ReportType.REORDER and self.year is None:
+            raise ValueError(f"The {self.report_type.value} report requires a year.")
+        return self
+
+class ReportJobResponse(BaseModel):
+    """Schema for the status of a report job.
+
+    Args:
+        BaseModel (pydantic schema): The pydantic base model all other models inherit from
+    """
+    id: int
+    report_type: str
+    params: Dict[str, Any]
+    status: str
+    error: Optional[str] = None
+    row_count: Optional[int] = None
+    result_size: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 #----------------------- Employees Schemas -----------------------
 class UserGroupBase(BaseModel):
     """Base schema for user group-related data.
@@ -0,0 +1,265 @@
+"""
+Stock adjustments. Deltas are applied with one locking read and one set-based update per
+batch, and can optionally be coalesced across concurrent requests (group commit) so a
+burst of sales on the same popular products costs one short transaction instead of one
+transaction per sale.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.databaseConnection import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of a single adjustment
+APPLIED = "applied"
+NOT_FOUND = "not_found"
+LOCATION_NOT_FOUND = "location_not_found"
+INSUFFICIENT_STOCK = "insufficient_stock"
+BELOW_REORDER_LEVEL = "below_reorder_level"
+
+
+def apply_stock_deltas(db: Session, adjustments: list) -> list:
+    """Applies a batch of stock adjustments in one transaction.
+
+    The affected products are locked in id order, each adjustment is checked in arrival
+    order against the running stock levels (so one sale that would take its location's stock
+    below zero, or the product's total below its reorder level, fails without failing the
+    others), and the accepted deltas are merged per location and product and written to
+    location_stock with a single ``INSERT ... FROM unnest(...) ON CONFLICT DO UPDATE``. The
+    location_stock trigger adds them to products.stock_count. The units sold and received are
+    added to the day's row in daily_stock_movements in the same transaction.
+
+    Args:
+        db (Session): Database session, committed before returning
+        adjustments (list): (product_id, delta, location_id) triples, negative deltas take stock
+            out, a location_id of None stands for the default location
+
+    Returns:
+        list: One dictionary per adjustment, in the same order, with the outcome and the
+        product's total and location stock levels after the adjustment (or the levels it was
+        checked against)
+    """
+    product_ids = sorted({product_id for product_id, _, _ in adjustments})
+    location_ids = sorted({location_id for _, _, location_id in adjustments if location_id is not None})
+
+    rows = db.execute(text(
+        "SELECT id, stock_count, reorder_level FROM products "
+        "WHERE id = ANY(:ids) ORDER BY id FOR UPDATE"
+    ), {"ids": product_ids}).all()
+
+    locations = db.execute(text(
+        "SELECT id, is_default FROM locations WHERE is_default OR id = ANY(:ids)"
+    ), {"ids": location_ids}).all()
+    default_location = next((location.id for location in locations if location.is_default), None)
+    known_locations = {location.id for location in locations}
+
+    # Every writer of location_stock holds the product's lock taken above, so these rows
+    # cannot change before this transaction commits
+    stored = db.execute(text(
+        "SELECT location_id, product_id, stock_count FROM location_stock "
+        "WHERE product_id = ANY(:product_ids) AND location_id = ANY(:location_ids)"
+    ), {"product_ids": product_ids, "location_ids": list(known_locations)}).all()
+
+    stock = {row.id: row.stock_count for row in rows}
+    reorder_levels = {row.id: row.reorder_level for row in rows}
+    location_stock = {(row.location_id, row.product_id): row.stock_count for row in stored}
+    existing = set(location_stock)
+    net_deltas = {}
+    # Gross movements for the demand history, a sale and a return do not cancel out there
+    sold = {}
+    received = {}
+    results = []
+
+    for product_id, delta, location_id in adjustments:
+        location_id = default_location if location_id is None else location_id
+
+        if product_id not in stock:
+            results.append({"product_id": product_id, "location_id": location_id, "outcome": NOT_FOUND,
+                            "stock_count": None, "location_stock_count": None})
+            continue
+
+        if location_id not in known_locations:
+            results.append({"product_id": product_id, "location_id": location_id, "outcome": LOCATION_NOT_FOUND,
+                            "stock_count": stock[product_id], "location_stock_count": None})
+            continue
+
+        key = (location_id, product_id)
+        location_stock.setdefault(key, 0)
+
+        if location_stock[key] + delta < 0:
+            outcome = INSUFFICIENT_STOCK
+        elif stock[product_id] + delta < reorder_levels[product_id]:
+            # products.check_reorder_level would reject the update
+            outcome = BELOW_REORDER_LEVEL
+        else:
+            outcome = APPLIED
+            stock[product_id] += delta
+            location_stock[key] += delta
+            net_deltas[key] = net_deltas.get(key, 0) + delta
+            if delta < 0:
+                sold[product_id] = sold.get(product_id, 0) - delta
+            elif delta > 0:
+                received[product_id] = received.get(product_id, 0) + delta
+
+        results.append({"product_id": product_id, "location_id": location_id, "outcome": outcome,
+                        "stock_count": stock[product_id], "location_stock_count": location_stock[key]})
+
+    # In product order, the order the trigger then updates the products in
+    changed = sorted((key for key, delta in net_deltas.items() if delta != 0), key=lambda key: (key[1], key[0]))
+    # Updated and inserted separately: the check on stock_count would reject a negative delta
+    # proposed for insertion before ON CONFLICT turned it into an update
+    updated = [key for key in changed if key in existing]
+    inserted = [key for key in changed if key not in existing]
+
+    if updated:
+        db.execute(text(
+            "UPDATE location_stock SET stock_count = location_stock.stock_count + changes.delta, updated_at = now() "
+            "FROM unnest(CAST(:location_ids AS integer[]), CAST(:product_ids AS integer[]), "
+            "CAST(:deltas AS integer[])) AS changes(location_id, product_id, delta) "
+            "WHERE location_stock.location_id = changes.location_id AND location_stock.product_id = changes.product_id"
+        ), _location_deltas(updated, net_deltas))
+
+    if inserted:
+        # Only ever positive. Setting a reorder level may have created the row in the meantime.
+        db.execute(text(
+            "INSERT INTO location_stock (location_id, product_id, stock_count) "
+            "SELECT * FROM unnest(CAST(:location_ids AS integer[]), CAST(:product_ids AS integer[]), "
+            "CAST(:deltas AS integer[])) "
+            "ON CONFLICT (location_id, product_id) DO UPDATE SET "
+            "stock_count = location_stock.stock_count + EXCLUDED.stock_count, updated_at = now()"
+        ), _location_deltas(inserted, net_deltas))
+
+    moved = sorted(sold.keys() | received.keys())
+
+    if moved:
+        db.execute(text(
+            "INSERT INTO daily_stock_movements (product_id, day, units_sold, units_received) "
+            "SELECT id, CURRENT_DATE, sold, received "
+            "FROM unnest(CAST(:ids AS integer[]), CAST(:sold AS integer[]), CAST(:received AS integer[])) "
+            "AS moves(id, sold, received) "
+            "ON CONFLICT (product_id, day) DO UPDATE SET "
+            "units_sold = daily_stock_movements.units_sold + EXCLUDED.units_sold, "
+            "units_received = daily_stock_movements.units_received + EXCLUDED.units_received"
+        ), {"ids": moved, "sold": [sold.get(product_id, 0) for product_id in moved],
+            "received": [received.get(product_id, 0) for product_id in moved]})
+
+    db.commit()
+
+    return results
+
+
+def _location_deltas(keys: list, net_deltas: dict) -> dict:
+    return {"location_ids": [location_id for location_id, _ in keys],
+            "product_ids": [product_id for _, product_id in keys],
+            "deltas": [net_deltas[key] for key in keys]}
+
+
+def apply_stock_deltas_in_session(adjustments: list) -> list:
+    """Runs apply_stock_deltas in its own session, for use from a worker thread."""
+    with SessionLocal() as db:
+        return apply_stock_deltas(db, adjustments)
+
+
+class StockCoalescer:
+    """Buffers stock adjustments for up to ``window_ms`` milliseconds (or until ``max_batch``
+    are waiting) and applies them together with apply_stock_deltas. Each caller still gets
+    the outcome of its own adjustment.
+
+    Batches are written one at a time; adjustments arriving while a batch is being written
+    gather into the next one.
+
+    Args:
+        window_ms (int): How long the first adjustment of a batch waits for others
+        max_batch (int): Number of waiting adjustments that triggers an immediate write
+    """
+
+    def __init__(self, window_ms: int, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._write_lock = None
+        self.batches_written = 0
+        self.adjustments_written = 0
+
+    async def submit(self, product_id: int, delta: int, location_id: Optional[int] = None) -> dict:
+        """Queues one adjustment and waits for the batch containing it to be written.
+
+        Args:
+            product_id (int): The product to adjust
+            delta (int): Units to add, negative to take stock out
+            location_id (int, optional): Location of the stock. Defaults to the default location.
+
+        Returns:
+            dict: The outcome of this adjustment, as returned by apply_stock_deltas
+        """
+        loop = asyncio.get_running_loop()
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+
+        future = loop.create_future()
+        self._pending.append((product_id, delta, location_id, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._write(batch))
+
+    async def _write(self, batch: list):
+        async with self._write_lock:
+            try:
+                results = await asyncio.to_thread(
+                    apply_stock_deltas_in_session,
+                    [(product_id, delta, location_id) for product_id, delta, location_id, _ in batch])
+            except Exception as e:
+                logger.exception("Writing a batch of %s stock adjustments failed", len(batch))
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            self.batches_written += 1
+            self.adjustments_written += len(batch)
+
+            for (*_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+stock_coalescer = StockCoalescer(settings.stock_coalescing_window_ms, settings.stock_coalescing_max_batch)
+
+
+async def adjust_stock(product_id: int, delta: int, location_id: Optional[int] = None) -> dict:
+    """Applies one stock adjustment, coalesced with concurrent ones when enabled in the settings.
+
+    Args:
+        product_id (int): The product to adjust
+        delta (int): Units to add, negative to take stock out
+        location_id (int, optional): Location of the stock. Defaults to the default location.
+
+    Returns:
+        dict: The outcome of the adjustment, as returned by apply_stock_deltas
+    """
+    if settings.stock_coalescing_enabled:
+        return await stock_coalescer.submit(product_id, delta, location_id)
+
+    results = await asyncio.to_thread(apply_stock_deltas_in_session, [(product_id, delta, location_id)])
+    return results[0]
@@ -0,0 +1,120 @@
+"""
+Consistency check of the product stock totals.
+
+products.stock_count is maintained incrementally by the location_stock triggers and is never
+summed at read time, so this compares it with the sum of the product's location_stock rows,
+one batch of products at a time, and can repair the totals that drifted (e.g. after stock was
+edited by hand with the triggers disabled). Each batch is one statement over a range of
+product ids, so it sees a consistent state without locking anything.
+
+    python -m app.stock_consistency [--repair]
+"""
+
+import argparse
+import logging
+import time
+
+from sqlalchemy import text
+
+from app.databaseConnection import engine
+
+logger = logging.getLogger(__name__)
+
+MISMATCHES = """
+SELECT p.id AS product_id, p.stock_count, COALESCE(totals.location_total, 0) AS location_total
+FROM products p
+LEFT JOIN (
+    SELECT product_id, SUM(stock_count) AS location_total FROM location_stock
+    WHERE product_id > :first_id AND product_id <= :last_id
+    GROUP BY product_id
+) AS totals ON totals.product_id = p.id
+WHERE p.id > :first_id AND p.id <= :last_id AND p.stock_count <> COALESCE(totals.location_total, 0)
+ORDER BY p.id
+"""
+
+REPAIR = """
+UPDATE products SET stock_count = totals.location_total, date_modified = now()
+FROM (
+    SELECT ids.id, COALESCE(SUM(ls.stock_count), 0) AS location_total
+    FROM unnest(CAST(:ids AS integer[])) AS ids(id)
+    LEFT JOIN location_stock ls ON ls.product_id = ids.id
+    GROUP BY ids.id
+) AS totals
+WHERE products.id = totals.id AND products.stock_count <> totals.location_total
+AND totals.location_total >= products.reorder_level
+RETURNING products.id
+"""
+
+
+def check_stock_totals(batch_size: int = 10000, repair: bool = False, pause_seconds: float = 0.0) -> dict:
+    """Compares every product's stock_count with the sum of its stock over all locations.
+
+    Args:
+        batch_size (int, optional): Products compared per statement. Defaults to 10000.
+        repair (bool, optional): Set mismatched totals to the sum of the locations. Totals that
+            would fall below the product's reorder level are reported but left alone. Defaults to False.
+        pause_seconds (float, optional): Pause between batches. Defaults to 0.0.
+
+    Returns:
+        dict: Number of products checked, the mismatches found (product, total, sum of
+        locations) and the ids of the products repaired
+    """
+    checked = 0
+    mismatches = []
+    repaired = []
+    last_id = 0
+    started = time.perf_counter()
+
+    with engine.connect() as connection:
+        while True:
+            batch_end = connection.execute(text(
+                "SELECT max(id), count(*) FROM (SELECT id FROM products WHERE id > :last_id ORDER BY id LIMIT :batch_size) batch"
+            ), {"last_id": last_id, "batch_size": batch_size}).one()
+            if batch_end[0] is None:
+                break
+
+            found = connection.execute(text(MISMATCHES), {"first_id": last_id, "last_id": batch_end[0]}).mappings().all()
+            connection.commit()
+            checked += batch_end[1]
+            last_id = batch_end[0]
+
+            if found:
+                mismatches.extend(dict(row) for row in found)
+                for row in found:
+                    logger.warning("Product %s has a stock total of %s, its locations hold %s", row["product_id"],
+                                   row["stock_count"], row["location_total"])
+
+                if repair:
+                    repaired.extend(_repair(connection, [row["product_id"] for row in found]))
+
+            if pause_seconds:
+                time.sleep(pause_seconds)
+
+    summary = {"checked": checked, "mismatches": mismatches, "repaired": repaired,
+               "seconds": round(time.perf_counter() - started, 3)}
+    logger.info("Checked %s stock totals in %ss: %s mismatched, %s repaired", checked, summary["seconds"],
+                len(mismatches), len(repaired))
+    return summary
+
+
+def _repair(connection, product_ids: list) -> list:
+    # Locking the products first holds off stock adjustments, so the totals are recomputed
+    # from location rows that cannot change before the update
+    connection.execute(text("SELECT id FROM products WHERE id = ANY(:ids) ORDER BY id FOR UPDATE"), {"ids": product_ids})
+    # Otherwise the products trigger would move the correction to the default location
+    connection.execute(text("SET LOCAL inventory.stock_sync = 'off'"))
+    repaired = connection.execute(text(REPAIR), {"ids": product_ids}).scalars().all()
+    connection.commit()
+    return repaired
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--repair", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = check_stock_totals(args.batch_size, args.repair)
+    print({"checked": result["checked"], "mismatches": len(result["mismatches"]), "repaired": len(result["repaired"]),
+           "seconds": result["seconds"]})
@@ -0,0 +1,163 @@
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import any_, inspect, literal
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session, load_only
+
+
+def row_to_dict(instance) -> dict:
+    """Converts an ORM instance into a dictionary of its loaded column values.
+
+    Args:
+        instance (Base): A mapped SQLAlchemy object
+
+    Returns:
+        dict: Column name to value, without SQLAlchemy's internal state
+    """
+    state = inspect(instance)
+    return {attr.key: getattr(instance, attr.key) for attr in state.mapper.column_attrs
+            if attr.key not in state.unloaded}
+
+
+def parse_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    """Parses a comma separated ``fields=`` query parameter into column names of a model.
+
+    Args:
+        fields (str): The raw query parameter, e.g. "code,category"
+        model (Base): The model the fields belong to
+
+    Raises:
+        HTTPException: Raises a 400 error if a field is not a column of the model
+
+    Returns:
+        list: The requested column names with "id" always first, or None when all fields are wanted
+    """
+    if not fields:
+        return None
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    columns = {attr.key for attr in inspect(model).column_attrs}
+    unknown = [field for field in requested if field not in columns]
+
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown fields: {', '.join(unknown)}. Available fields: {', '.join(sorted(columns))}.")
+
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+
+def with_fields(query, model, fields: Optional[List[str]]):
+    """Narrows an ORM query to the requested columns so only those are selected.
+
+    Args:
+        query (Query): The query to narrow
+        model (Base): The model being queried
+        fields (list): Column names from parse_fields, None to load every column
+
+    Returns:
+        Query: The query, with a load_only option when fields were requested
+    """
+    if fields is None:
+        return query
+    return query.options(load_only(*[getattr(model, field) for field in fields]))
+
+
+def sparse_response(data, fields: Optional[List[str]]):
+    """Cuts a single row or a list of rows down to the requested fields.
+
+    The response is returned directly instead of through the route's response model,
+    which would otherwise require every field to be present.
+
+    Args:
+        data (dict | Base | list): Rows as dictionaries or ORM instances
+        fields (list): Column names from parse_fields, None to leave the data as it is
+
+    Returns:
+        The data unchanged when no fields were requested, otherwise a JSONResponse
+    """
+    if fields is None:
+        return data
+
+    projected = [project_row(row, fields) for row in data] if isinstance(data, list) else project_row(data, fields)
+    return JSONResponse(jsonable_encoder(projected))
+
+
+def project_row(row, fields: List[str]) -> dict:
+    """Returns only the requested fields of a row given as a dictionary or ORM instance."""
+    row = row if isinstance(row, dict) else row_to_dict(row)
+    return {field: row.get(field) for field in fields}
+
+
+def any_of(column, values):
+    """Builds ``column = ANY(:values)`` with all values bound as a single array parameter,
+    so the statement is the same whatever the number of values.
+
+    Args:
+        column (Column): The column to compare
+        values (iterable): The values to match
+
+    Returns:
+        BinaryExpression: The filter expression
+    """
+    return column == any_(literal(list(values), ARRAY(column.type)))
+
+
+def batch_lookup(db: Session, model, key: str, keys: list, cached: Optional[dict] = None,
+                 fields: Optional[List[str]] = None):
+    """Resolves many keys of one model with at most one query.
+
+    Args:
+        db (Session): Database session used for keys not found in the cache
+        model (Base): The model to look up
+        key (str): Name of the column the keys refer to, e.g. "id" or "code"
+        keys (list): The ids or codes to resolve
+        cached (dict, optional): Rows already held in memory, keyed the same way as keys
+        fields (list, optional): Columns to select, from parse_fields. Defaults to all columns.
+
+    Returns:
+        tuple: A dictionary of the rows found keyed by the string form of their key, and the list of keys not found
+    """
+    keys = list(dict.fromkeys(keys))
+    found = {}
+
+    if cached is not None:
+        for value in keys:
+            row = cached.get(value)
+            if row is not None:
+                found[str(value)] = row
+
+    remaining = [value for value in keys if str(value) not in found]
+
+    if remaining:
+        load_fields = fields if fields is None or key in fields else fields + [key]
+        rows = with_fields(db.query(model), model, load_fields).filter(any_of(getattr(model, key), remaining)).all()
+
+        for row in rows:
+            found[str(getattr(row, key))] = row
+
+    missing = [value for value in keys if str(value) not in found]
+
+    return found, missing
+
+
+def batch_response(found: dict, missing: list, fields: Optional[List[str]]):
+    """Builds the body of a batch lookup, cut down to the requested fields if any.
+
+    Args:
+        found (dict): Rows found, from batch_lookup
+        missing (list): Keys not found, from batch_lookup
+        fields (list): Column names from parse_fields, None to return every field
+
+    Returns:
+        The body for the route's response model, or a JSONResponse when fields were requested
+    """
+    if fields is None:
+        return {"found": found, "missing": missing}
+
+    return JSONResponse(jsonable_encoder({
+        "found": {key: project_row(row, fields) for key, row in found.items()},
+        "missing": missing,
+    }))
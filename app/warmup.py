@@ -0,0 +1,120 @@
+"""
+Worker start-up: opens the connection pools, pre-loads the reference data caches
+and records how long start-up and the first request took.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from app.cache import reference_cache
+from app.config import settings
+from app.databaseConnection import SessionLocal, engine, replica_engines
+
+logger = logging.getLogger(__name__)
+
+
+class StartupMetrics:
+    """Timings of the current worker's start-up, reported by the health endpoints."""
+
+    def __init__(self):
+        self.process_started = time.perf_counter()
+        self.ready = False
+        self.startup_seconds = None
+        self.pool_warm_seconds = None
+        self.cache_warm_seconds = None
+        self.first_request_ms = None
+        self.last_error = None
+
+    def as_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "startup_seconds": self.startup_seconds,
+            "pool_warm_seconds": self.pool_warm_seconds,
+            "cache_warm_seconds": self.cache_warm_seconds,
+            "first_request_ms": self.first_request_ms,
+            "last_error": self.last_error,
+        }
+
+
+startup_metrics = StartupMetrics()
+
+
+def warm_pool(target_engine, size: int):
+    """Opens ``size`` connections at once and hands them back to the pool, so the
+    pool holds that many established connections before the first request.
+
+    Args:
+        target_engine (Engine): The engine whose pool should be filled
+        size (int): Number of connections to open
+    """
+    # Each worker thread holds its connection until all have connected, otherwise the
+    # same pooled connection would simply be reused
+    connections = []
+
+    def open_connection(_):
+        connection = target_engine.connect()
+        connection.execute(text("SELECT 1"))
+        return connection
+
+    with ThreadPoolExecutor(max_workers=size) as executor:
+        try:
+            connections.extend(executor.map(open_connection, range(size)))
+        finally:
+            for connection in connections:
+                connection.close()
+
+
+def warm_up():
+    """Fills the connection pools and the reference data cache, recording the timings.
+
+    Raises:
+        Exception: Re-raises whatever stopped the database from being reached
+    """
+    started = time.perf_counter()
+
+    warm_pool(engine, settings.database_pool_size)
+    for replica in replica_engines:
+        try:
+            warm_pool(replica, settings.database_pool_size)
+        except Exception as e:
+            logger.warning("Could not warm replica %s: %s", replica.url.host, e)
+    startup_metrics.pool_warm_seconds = round(time.perf_counter() - started, 4)
+
+    cache_started = time.perf_counter()
+    with SessionLocal() as db:
+        reference_cache.load(db)
+    startup_metrics.cache_warm_seconds = round(time.perf_counter() - cache_started, 4)
+
+    startup_metrics.ready = True
+    startup_metrics.last_error = None
+    startup_metrics.startup_seconds = round(time.perf_counter() - startup_metrics.process_started, 4)
+    logger.info("Worker ready in %ss (pool %ss, caches %ss)", startup_metrics.startup_seconds,
+                startup_metrics.pool_warm_seconds, startup_metrics.cache_warm_seconds)
+
+
+class FirstRequestTimer:
+    """ASGI middleware that measures the latency of the first HTTP request a worker
+    serves, then gets out of the way for every following request.
+
+    Args:
+        app (ASGIApp): The wrapped application
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.timed = False
+
+    async def __call__(self, scope, receive, send):
+        if self.timed or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.timed = True
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            startup_metrics.first_request_ms = round((time.perf_counter() - started) * 1000, 3)
@@ -0,0 +1,108 @@
+"""
+Overload test for admission control.
+
+Slows every statement down with pg_sleep (standing in for a struggling Postgres), then
+fires far more concurrent reads at /products/get_product_by_id than the connection pool can
+serve, once with admission control off and once with it on. Reports how many requests
+succeeded, were shed (503) or failed otherwise, and the latency of the successful ones.
+Without admission control every request queues on the pool and latency grows with the
+backlog; with it the excess is shed quickly and admitted requests stay fast. Runs
+in-process against the database configured in .env and only reads.
+
+    python -m benchmarks.admission_overload --requests 2000 --concurrency 400 --db-delay-ms 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from sqlalchemy import event, text
+
+from app.admission import admission_controller
+from app.config import settings
+from app.databaseConnection import SessionLocal, checkout_latency, engine
+from app.main import create_app
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    return round(values[max(int(len(values) * fraction) - 1, 0)] * 1000, 2)
+
+
+async def run(client: httpx.AsyncClient, product_ids: list, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    shed_latencies = []
+    failures = 0
+
+    async def read(i: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(f"/products/get_product_by_id/{product_ids[i % len(product_ids)]}")
+            elapsed = time.perf_counter() - started
+
+            if response.status_code == 200:
+                latencies.append(elapsed)
+            elif response.status_code == 503:
+                shed_latencies.append(elapsed)
+            else:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[read(i) for i in range(requests)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    shed_latencies.sort()
+
+    return {
+        "seconds": round(elapsed, 2),
+        "ok": len(latencies),
+        "shed": len(shed_latencies),
+        "failures": failures,
+        "ok_p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "ok_p99_ms": percentile(latencies, 0.99),
+        "shed_p99_ms": percentile(shed_latencies, 0.99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=400)
+    parser.add_argument("--db-delay-ms", type=int, default=20)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        product_ids = list(db.execute(text("SELECT id FROM products ORDER BY id LIMIT 1000")).scalars())
+    if not product_ids:
+        raise SystemExit("The database has no products to benchmark with.")
+
+    delay = args.db_delay_ms / 1000
+
+    def slow_down(connection, cursor, statement, parameters, context, executemany):
+        cursor.execute("SELECT pg_sleep(%s)", (delay,))
+
+    app = create_app()
+    event.listen(engine, "before_cursor_execute", slow_down)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark",
+                                     timeout=None) as client:
+            for enabled in (False, True):
+                settings.admission_control_enabled = enabled
+                checkout_latency.average_seconds = 0.0
+                rejected_before = admission_controller.limits["read"].rejected
+
+                result = await run(client, product_ids, args.requests, args.concurrency)
+                result["rejected_by_controller"] = admission_controller.limits["read"].rejected - rejected_before
+
+                print(f"admission={'on ' if enabled else 'off'} {result}")
+    finally:
+        event.remove(engine, "before_cursor_execute", slow_down)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
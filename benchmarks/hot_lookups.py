@@ -0,0 +1,94 @@
+"""
+Per-lookup CPU cost of the hot single-row lookups, before and after caching their statements.
+
+"before" swaps the old ``db.query(...).filter(...).first()`` implementations back into
+app.lookups; "after" uses the cached statements (Session.get and lambda_stmt). Each lookup
+is measured twice: as a bare function call on an empty session, and as a full request
+through the route (sequentially, so CPU time is not shared between requests). CPU time is
+process time, so it includes the in-process HTTP client for the route figures. Runs against
+the database configured in .env and only reads.
+
+    python -m benchmarks.hot_lookups --lookups 5000
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlalchemy import text
+
+import app.lookups as lookups
+import app.models as models
+from app.databaseConnection import SessionLocal
+from app.main import create_app
+
+
+def legacy_get_product(db, product_id):
+    return db.query(models.Products).filter(models.Products.id == product_id).first()
+
+
+def legacy_get_category_by_code(db, code):
+    return db.query(models.ProductCategory).filter(models.ProductCategory.code == code).first()
+
+
+LEGACY = {"get_product": legacy_get_product, "get_category_by_code": legacy_get_category_by_code}
+CACHED = {"get_product": lookups.get_product, "get_category_by_code": lookups.get_category_by_code}
+
+
+def use(implementations: dict):
+    for name, function in implementations.items():
+        setattr(lookups, name, function)
+
+
+def time_function(lookup, keys: list) -> dict:
+    with SessionLocal() as db:
+        lookup(db, keys[0])
+        started_cpu, started = time.process_time(), time.perf_counter()
+        for key in keys:
+            lookup(db, key)
+            # Like a new request, so Session.get cannot answer from the identity map
+            db.expunge_all()
+        cpu, elapsed = time.process_time() - started_cpu, time.perf_counter() - started
+
+    return {"cpu_us": round(cpu / len(keys) * 1e6, 1), "wall_us": round(elapsed / len(keys) * 1e6, 1)}
+
+
+async def time_route(client: httpx.AsyncClient, paths: list) -> dict:
+    await client.get(paths[0])
+    started_cpu, started = time.process_time(), time.perf_counter()
+    for path in paths:
+        await client.get(path)
+    cpu, elapsed = time.process_time() - started_cpu, time.perf_counter() - started
+
+    return {"cpu_us": round(cpu / len(paths) * 1e6, 1), "wall_us": round(elapsed / len(paths) * 1e6, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        product_ids = list(db.execute(text("SELECT id FROM products ORDER BY id LIMIT 1000")).scalars())
+    if not product_ids:
+        raise SystemExit("The database has no products to benchmark with.")
+
+    product_keys = [product_ids[i % len(product_ids)] for i in range(args.lookups)]
+    # Codes that are not cached, so every request reaches the database
+    category_keys = [f"Z{i % 1000:04d}" for i in range(args.lookups)]
+
+    app = create_app()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        for label, implementations in (("before", LEGACY), ("after ", CACHED)):
+            use(implementations)
+            print(f"{label} get_product          function {time_function(lookups.get_product, product_keys)} "
+                  f"route {await time_route(client, [f'/products/get_product_by_id/{key}' for key in product_keys])}")
+            print(f"{label} get_category_by_code function {time_function(lookups.get_category_by_code, category_keys)} "
+                  f"route {await time_route(client, [f'/category/get_category_by_code/{key}' for key in category_keys])}")
+
+    use(CACHED)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Bytes on the wire and serialization cost of a large list response in each format.
+
+Builds product-like rows shaped like ProductsResponse and, for JSON, columnar JSON and
+MessagePack, reports the encoded size and the time to serialize it, then the size and time
+again after gzip and brotli at the levels the CompressionMiddleware uses. Needs no database.
+
+    python -m benchmarks.payload_encoding --rows 100000
+"""
+
+import argparse
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import brotli
+
+from app.encoding import BROTLI_QUALITY, COLUMNAR_JSON, GZIP_LEVEL, JSON, MSGPACK, encode_rows
+
+
+def make_rows(count: int) -> list:
+    created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "product_code": f"P{i:07d}",
+            "product_name": f"Product {i}",
+            "barcode_type": "EAN-13",
+            "barcode": f"{5000000000000 + i}",
+            "description": f"Description of product {i}",
+            "category_id": i % 40 + 1,
+            "selling_price": round(1 + (i % 997) * 0.37, 2),
+            "stock_count": i % 50,
+            "reorder_level": 10,
+            "financial_quarter_id": 1,
+            "id": i + 1,
+            "date_added": (created + timedelta(minutes=i)).isoformat(),
+            "date_modified": None,
+        }
+        for i in range(count)
+    ]
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, round((time.perf_counter() - started) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    compressors = {
+        "gzip": lambda body: zlib.compress(body, GZIP_LEVEL, wbits=31),
+        "br": lambda body: brotli.compress(body, quality=BROTLI_QUALITY),
+    }
+
+    for label, media_type in (("json", JSON), ("columnar", COLUMNAR_JSON), ("msgpack", MSGPACK)):
+        body, encode_ms = timed(encode_rows, rows, media_type)
+        line = f"{label:9} raw {len(body):>10,} B {encode_ms:>7} ms"
+        for name, compress in compressors.items():
+            compressed, compress_ms = timed(compress, body)
+            line += f" | {name:4} {len(compressed):>9,} B +{compress_ms:>6} ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Cost of the reorder level forecast on synthetic sales history.
+
+Generates daily sales for ``--products`` products over ``--days`` days, a product selling on
+a given day with probability ``--density``, in batches of ``--batch`` products like
+app.forecasting.run_forecast, and times forecast_reorder_levels over all of them. For
+comparison, a plain Python loop computing the same smoothed mean and deviation per product
+is timed on ``--loop-sample`` products and extrapolated. Needs no database.
+
+    python -m benchmarks.reorder_forecast --products 1000000 --days 365
+"""
+
+import argparse
+import math
+import time
+from statistics import NormalDist
+
+import numpy as np
+
+from app.forecasting import forecast_reorder_levels, smoothing_weights
+
+LEAD_TIME_DAYS = 7
+SERVICE_LEVEL = 0.95
+SMOOTHING = 0.1
+
+
+def make_batch(rng: np.random.Generator, products: int, days: int, density: float):
+    selling = rng.random((products, days)) < density
+    product_index, day_index = np.nonzero(selling)
+    rates = rng.gamma(2.0, 2.0, products)
+    units = rng.poisson(rates[product_index]) + 1
+    first_day_index = np.where(rng.random(products) < 0.1, rng.integers(0, days, products), 0)
+    return product_index, day_index, units, first_day_index
+
+
+def loop_forecast(product_index, day_index, units, first_day_index, weights) -> list:
+    """The same forecast one product and one day at a time."""
+    z = NormalDist().inv_cdf(SERVICE_LEVEL)
+    sales = {}
+    for product, day, sold in zip(product_index.tolist(), day_index.tolist(), units.tolist()):
+        sales.setdefault(product, {})[day] = sold
+
+    levels = []
+    for product, first_day in enumerate(first_day_index.tolist()):
+        product_sales = sales.get(product, {})
+        total = total_square = total_weight = 0.0
+        for day in range(first_day, len(weights)):
+            sold = product_sales.get(day, 0)
+            total += weights[day] * sold
+            total_square += weights[day] * sold * sold
+            total_weight += weights[day]
+        mean = total / total_weight
+        deviation = math.sqrt(max(total_square / total_weight - mean * mean, 0))
+        levels.append(math.ceil(mean * LEAD_TIME_DAYS + z * deviation * math.sqrt(LEAD_TIME_DAYS) - 1e-9))
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--density", type=float, default=0.5)
+    parser.add_argument("--batch", type=int, default=100000)
+    parser.add_argument("--loop-sample", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    weights = smoothing_weights(args.days, SMOOTHING)
+    sales_rows = 0
+    vectorised_seconds = 0.0
+
+    for start in range(0, args.products, args.batch):
+        batch = make_batch(rng, min(args.batch, args.products - start), args.days, args.density)
+        sales_rows += len(batch[0])
+
+        started = time.perf_counter()
+        forecast_reorder_levels(*batch, weights, LEAD_TIME_DAYS, SERVICE_LEVEL)
+        vectorised_seconds += time.perf_counter() - started
+
+    sample = make_batch(rng, args.loop_sample, args.days, args.density)
+    started = time.perf_counter()
+    expected = loop_forecast(*sample, weights.tolist())
+    loop_seconds = (time.perf_counter() - started) * args.products / args.loop_sample
+
+    levels = forecast_reorder_levels(*sample, weights, LEAD_TIME_DAYS, SERVICE_LEVEL)
+    mismatches = int(np.count_nonzero(levels != np.array(expected)))
+
+    print(f"{args.products:,} products x {args.days} days, {sales_rows:,} sales rows")
+    print(f"vectorised   {vectorised_seconds:8.2f} s")
+    print(f"python loop  {loop_seconds:8.2f} s (extrapolated from {args.loop_sample:,} products)")
+    print(f"speed-up     {loop_seconds / vectorised_seconds:8.1f}x, {mismatches} mismatches on the sample")
+
+
+if __name__ == "__main__":
+    main()
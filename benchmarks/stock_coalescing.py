@@ -0,0 +1,87 @@
+"""
+Hot-SKU benchmark for stock adjustments, with and without write coalescing.
+
+Fires many concurrent sales (delta -1) at a handful of products through the
+/products/adjust_stock route and reports throughput, latency percentiles and the
+number of transactions used. Runs in-process against the database configured in .env;
+the stock of the chosen products is topped up before each run, so point it at a
+development database.
+
+    python -m benchmarks.stock_coalescing --hot-products 5 --requests 5000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from sqlalchemy import text
+
+from app.config import settings
+from app.databaseConnection import SessionLocal
+from app.main import create_app
+from app.stock import stock_coalescer
+
+
+def top_up(product_ids: list, units: int):
+    with SessionLocal() as db:
+        db.execute(text("UPDATE products SET stock_count = :units WHERE id = ANY(:ids)"),
+                   {"units": units, "ids": product_ids})
+        db.commit()
+
+
+async def run(client: httpx.AsyncClient, product_ids: list, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def sell(i: int):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(f"/products/adjust_stock/{product_ids[i % len(product_ids)]}", json={"delta": -1})
+            latencies.append(time.perf_counter() - started)
+            failures += response.status_code != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*[sell(i) for i in range(requests)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    return {
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "failures": failures,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hot-products", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        product_ids = list(db.execute(text("SELECT id FROM products ORDER BY id LIMIT :n"),
+                                      {"n": args.hot_products}).scalars())
+    if not product_ids:
+        raise SystemExit("The database has no products to benchmark with.")
+
+    app = create_app()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        for enabled in (False, True):
+            settings.stock_coalescing_enabled = enabled
+            top_up(product_ids, args.requests + 1000)
+            batches_before = stock_coalescer.batches_written
+
+            result = await run(client, product_ids, args.requests, args.concurrency)
+            result["transactions"] = stock_coalescer.batches_written - batches_before if enabled else args.requests
+
+            print(f"coalescing={'on ' if enabled else 'off'} {result}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
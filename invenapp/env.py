@@ -69,8 +69,11 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        # One transaction per revision, so the autocommit blocks of online backfills
+        # (app/backfill.py) only commit the revision they are in
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            transaction_per_migration=True
         )
 
         with context.begin_transaction():
@@ -0,0 +1,40 @@
+"""prevent overlapping financial quarters
+
+Revision ID: 5c1e8d2a9f47
+Revises: 06ca019e8871
+Create Date: 2025-01-12 10:14:32.418203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e8d2a9f47'
+down_revision: Union[str, None] = '06ca019e8871'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+        Upgrade the database schema.
+        Make sure a quarter never ends before it starts, and that no two quarters cover the same
+        point in time. A missing start or end date leaves the quarter open on that side.
+        """
+    op.create_check_constraint('check_quarter_dates', 'financial_quarters', 'start_date <= end_date')
+    op.execute(
+        "ALTER TABLE financial_quarters ADD CONSTRAINT financial_quarters_no_overlap "
+        "EXCLUDE USING gist (tsrange(start_date, end_date, '[]') WITH &&)"
+    )
+
+
+def downgrade() -> None:
+    """
+        Downgrade the database schema.
+        Drop the overlap and date order constraints from the `financial_quarters` table.
+        """
+    op.drop_constraint('financial_quarters_no_overlap', 'financial_quarters')
+    op.drop_constraint('check_quarter_dates', 'financial_quarters', type_='check')
@@ -0,0 +1,53 @@
+"""add product stock history partitioned by financial quarter
+
+Revision ID: 9a4f3b7c2e18
+Revises: 5c1e8d2a9f47
+Create Date: 2025-01-19 11:02:47.513806
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4f3b7c2e18'
+down_revision: Union[str, None] = '5c1e8d2a9f47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+        Upgrade the database schema.
+        Record when a financial quarter was closed, and add the `product_stock_history` table that
+        holds the stock snapshot taken at close. The table is list partitioned by financial quarter;
+        one partition per quarter is created when that quarter is closed.
+        """
+    op.add_column('financial_quarters', sa.Column('closed_at', sa.TIMESTAMP(), nullable=True))
+    op.create_table('product_stock_history',
+    sa.Column('financial_quarter_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('product_code', sa.String(length=5), nullable=False),
+    sa.Column('product_name', sa.String(length=150), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('selling_price', sa.DECIMAL(precision=19, scale=4), nullable=False),
+    sa.Column('stock_count', sa.Integer(), nullable=False),
+    sa.Column('reorder_level', sa.Integer(), nullable=False),
+    sa.Column('snapshot_at', sa.TIMESTAMP(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.ForeignKeyConstraint(['financial_quarter_id'], ['financial_quarters.id'], ),
+    sa.PrimaryKeyConstraint('financial_quarter_id', 'product_id'),
+    postgresql_partition_by='LIST (financial_quarter_id)'
+    )
+    op.create_index('ix_product_stock_history_category', 'product_stock_history', ['financial_quarter_id', 'category_id'])
+
+
+def downgrade() -> None:
+    """
+        Downgrade the database schema.
+        Drop the stock history (with all of its partitions) and the `closed_at` column.
+        """
+    op.drop_index('ix_product_stock_history_category', table_name='product_stock_history')
+    op.drop_table('product_stock_history')
+    op.drop_column('financial_quarters', 'closed_at')
@@ -0,0 +1,104 @@
+"""notify stock and price changes
+
+Revision ID: d27b6e0f5a93
+Revises: 9a4f3b7c2e18
+Create Date: 2025-01-26 15:37:05.248119
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd27b6e0f5a93'
+down_revision: Union[str, None] = '9a4f3b7c2e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+        Upgrade the database schema.
+        Publish changes to product stock and prices, and to product discounts, on the
+        `inventory_changes` NOTIFY channel so the API can stream them to its subscribers.
+        """
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_product_change() RETURNS trigger AS $$
+        DECLARE
+            row products%ROWTYPE;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                row := OLD;
+            ELSE
+                row := NEW;
+            END IF;
+
+            PERFORM pg_notify('inventory_changes', json_build_object(
+                'table', 'products',
+                'op', lower(TG_OP),
+                'id', row.id,
+                'product_id', row.id,
+                'category_id', row.category_id,
+                'stock_count', row.stock_count,
+                'selling_price', row.selling_price
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_discount_change() RETURNS trigger AS $$
+        DECLARE
+            row product_discounts%ROWTYPE;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                row := OLD;
+            ELSE
+                row := NEW;
+            END IF;
+
+            PERFORM pg_notify('inventory_changes', json_build_object(
+                'table', 'product_discounts',
+                'op', lower(TG_OP),
+                'id', row.id,
+                'product_id', row.product_id,
+                'category_id', (SELECT category_id FROM products WHERE id = row.product_id),
+                'discount_type', row.discount_type,
+                'discount_value', row.discount_value,
+                'is_active', row.is_active
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER products_notify_change
+        AFTER UPDATE OF stock_count, selling_price ON products
+        FOR EACH ROW
+        WHEN (OLD.stock_count IS DISTINCT FROM NEW.stock_count OR OLD.selling_price IS DISTINCT FROM NEW.selling_price)
+        EXECUTE FUNCTION notify_product_change()
+    """)
+    op.execute("""
+        CREATE TRIGGER products_notify_insert_delete
+        AFTER INSERT OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION notify_product_change()
+    """)
+    op.execute("""
+        CREATE TRIGGER product_discounts_notify_change
+        AFTER INSERT OR UPDATE OR DELETE ON product_discounts
+        FOR EACH ROW EXECUTE FUNCTION notify_discount_change()
+    """)
+
+
+def downgrade() -> None:
+    """
+        Downgrade the database schema.
+        Remove the change notification triggers and their functions.
+        """
+    op.execute("DROP TRIGGER IF EXISTS product_discounts_notify_change ON product_discounts")
+    op.execute("DROP TRIGGER IF EXISTS products_notify_insert_delete ON products")
+    op.execute("DROP TRIGGER IF EXISTS products_notify_change ON products")
+    op.execute("DROP FUNCTION IF EXISTS notify_discount_change()")
+    op.execute("DROP FUNCTION IF EXISTS notify_product_change()")
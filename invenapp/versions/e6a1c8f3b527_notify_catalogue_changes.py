@@ -0,0 +1,83 @@
+"""notify catalogue changes
+
+Revision ID: e6a1c8f3b527
+Revises: d4e8a2b6f913
+Create Date: 2025-03-14 09:42:18.306715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6a1c8f3b527'
+down_revision: Union[str, None] = 'd4e8a2b6f913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+NOTIFY_PRODUCT_CHANGE = """
+    CREATE OR REPLACE FUNCTION notify_product_change() RETURNS trigger AS $$
+    DECLARE
+        row products%%ROWTYPE;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            row := OLD;
+        ELSE
+            row := NEW;
+        END IF;
+
+        PERFORM pg_notify('inventory_changes', json_build_object(
+            'table', 'products',
+            'op', lower(TG_OP),
+            'id', row.id,
+            'product_id', row.id,
+            'category_id', row.category_id,
+            'stock_count', row.stock_count,
+            'selling_price', row.selling_price%s
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    """
+        Upgrade the database schema.
+        Also notify on changes to a product's barcode, code, name or category, and send them
+        with every product notification, so the catalogue snapshot is rebuilt when a barcode
+        is reassigned or a product renamed instead of resolving the old values until it expires.
+        """
+    op.execute(NOTIFY_PRODUCT_CHANGE % """,
+            'product_code', row.product_code,
+            'product_name', row.product_name,
+            'barcode', row.barcode""")
+    op.execute("DROP TRIGGER IF EXISTS products_notify_change ON products")
+    op.execute("""
+        CREATE TRIGGER products_notify_change
+        AFTER UPDATE OF stock_count, selling_price, barcode, product_code, product_name, category_id ON products
+        FOR EACH ROW
+        WHEN (OLD.stock_count IS DISTINCT FROM NEW.stock_count OR OLD.selling_price IS DISTINCT FROM NEW.selling_price
+              OR OLD.barcode IS DISTINCT FROM NEW.barcode OR OLD.product_code IS DISTINCT FROM NEW.product_code
+              OR OLD.product_name IS DISTINCT FROM NEW.product_name OR OLD.category_id IS DISTINCT FROM NEW.category_id)
+        EXECUTE FUNCTION notify_product_change()
+    """)
+
+
+def downgrade() -> None:
+    """
+        Downgrade the database schema.
+        Notify on stock and price changes only, as before.
+        """
+    op.execute(NOTIFY_PRODUCT_CHANGE % "")
+    op.execute("DROP TRIGGER IF EXISTS products_notify_change ON products")
+    op.execute("""
+        CREATE TRIGGER products_notify_change
+        AFTER UPDATE OF stock_count, selling_price ON products
+        FOR EACH ROW
+        WHEN (OLD.stock_count IS DISTINCT FROM NEW.stock_count OR OLD.selling_price IS DISTINCT FROM NEW.selling_price)
+        EXECUTE FUNCTION notify_product_change()
+    """)